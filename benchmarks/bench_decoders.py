@@ -0,0 +1,121 @@
+# Copyright (c) 2013, pynewb
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice, this list
+#     of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice, this
+#     list of conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution.
+#   * Neither the name of pynewb nor the names of its contributors may be used to endorse
+#     or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''Compares the frame decoders with the byte-by-byte versions they replaced
+
+The legacy functions below are the decoders as they were before they
+were rebuilt on str.find and memoryview, kept here for comparison.
+'''
+
+from __future__ import print_function
+
+import argparse
+import struct
+import timeit
+
+import mp3_event_parser
+
+def legacy_unpack_string(bytes):
+    '''Unpacks a nul-terminated string by scanning byte by byte'''
+    i = 0
+    while i < len(bytes):
+        if ord(bytes[i]) == 0:
+            return (i + 1, bytes[0:i])
+        i += 1
+
+    return (len(bytes), '')
+
+def legacy_unpack_unicode(bytes):
+    '''Unpacks a nul-terminated unicode string by scanning character by character'''
+    i = 0
+    while i + 1 < len(bytes):
+        uch = struct.unpack_from('<H', bytes[i:i+2])[0]
+        if uch == 0:
+            return (i + 2, bytes[0:i].decode('utf-16'))
+        i += 2
+
+    return (len(bytes), u'')
+
+def legacy_parse_comm_frame(frame_data):
+    '''Parses a comment frame with slicing and byte-by-byte scanning'''
+    frame_encoding, language = struct.unpack_from('b3s', frame_data)
+    if frame_encoding == 0:
+        descriptor_len, descriptor_string = legacy_unpack_string(frame_data[4:])
+        comment_string = frame_data[4 + descriptor_len:]
+    else:
+        descriptor_len, descriptor_string = legacy_unpack_unicode(frame_data[4:])
+        comment_string = frame_data[4 + descriptor_len:].decode('utf-16')
+    return {'language': language, 'descriptor_string': descriptor_string, 'comment_string': comment_string}
+
+def legacy_parse_apic_frame(frame_data):
+    '''Parses an attached picture frame, copying the picture data'''
+    mime_len, mime_type = legacy_unpack_string(frame_data[1:])
+    description_len, description_string = legacy_unpack_string(frame_data[2 + mime_len:])
+    picture_data = frame_data[2 + mime_len + description_len:]
+    return {'mime_type': mime_type, 'description_string': description_string,
+            'picture_data': bytearray(picture_data)}
+
+def comm_frame(encoding, descriptor_len, text_len):
+    '''Build the data of a COMM or USLT frame with a long descriptor and text'''
+    descriptor = u'd' * descriptor_len
+    text = u't' * text_len
+    if encoding == 0:
+        return '\x00eng' + descriptor.encode('latin-1') + '\x00' + text.encode('latin-1')
+    return '\x01eng' + descriptor.encode('utf-16') + '\x00\x00' + text.encode('utf-16')
+
+def report(name, legacy, current, number):
+    '''Time a legacy and current function and print the comparison'''
+    legacy_time = min(timeit.repeat(legacy, number=number, repeat=3)) / number
+    current_time = min(timeit.repeat(current, number=number, repeat=3)) / number
+    print('{0:>30s} : {1:10.1f} us legacy {2:10.1f} us current {3:8.1f}x'.format(
+        name, legacy_time * 1000000, current_time * 1000000, legacy_time / current_time))
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the frame decoders with their legacy versions')
+    parser.add_argument('--descriptor-length', type=int, default=256, help='Characters in COMM/USLT descriptors')
+    parser.add_argument('--text-length', type=int, default=4096, help='Characters in COMM/USLT text')
+    parser.add_argument('--picture-length', type=int, default=1048576, help='Bytes of APIC picture data')
+    parser.add_argument('--number', type=int, default=200, help='Calls per timing')
+    args = parser.parse_args()
+
+    id3_parser = mp3_event_parser.ID3v2Parser()
+    for encoding in (0, 1):
+        frame_data = comm_frame(encoding, args.descriptor_length, args.text_length)
+        assert legacy_parse_comm_frame(frame_data)['comment_string'] == id3_parser.parse_comm_frame(frame_data)['comment_string']
+        report('unpack (encoding {0:d})'.format(encoding),
+               lambda: (legacy_unpack_string if encoding == 0 else legacy_unpack_unicode)(frame_data[4:]),
+               lambda: (mp3_event_parser.unpack_string if encoding == 0 else mp3_event_parser.unpack_unicode)(frame_data, 4),
+               args.number)
+        report('COMM/USLT (encoding {0:d})'.format(encoding),
+               lambda: legacy_parse_comm_frame(frame_data),
+               lambda: id3_parser.parse_comm_frame(frame_data),
+               args.number)
+
+    frame_data = '\x00image/jpeg\x00\x03\x00' + '\xff' * args.picture_length
+    report('APIC', lambda: legacy_parse_apic_frame(frame_data),
+           lambda: id3_parser.parse_apic_frame(frame_data), args.number)
+
+if __name__ == '__main__':
+    main()
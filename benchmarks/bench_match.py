@@ -0,0 +1,104 @@
+# Copyright (c) 2013, pynewb
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice, this list
+#     of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice, this
+#     list of conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution.
+#   * Neither the name of pynewb nor the names of its contributors may be used to endorse
+#     or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''Measures how matching source files to compare files scales
+
+Synthetic FileInfos are matched through the mp3_compare_dir tiers at
+increasing sizes.  A third of the source files match exactly, a third
+differ in case, spacing, "The " prefixes and track number forms, and a
+third have a typo in the title.  The time per source file should stay
+roughly flat as the size grows.
+'''
+
+from __future__ import print_function
+
+import argparse
+import collections
+import random
+import time
+
+import mp3_compare_dir
+import mp3_match
+
+from benchmarks import synth
+
+def make_file_info(path, artist, album, trck, title):
+    '''Make a FileInfo with the given fields'''
+    file_info = mp3_compare_dir.FileInfo()
+    file_info.path = path
+    file_info.tpe1 = artist
+    file_info.talb = album
+    file_info.trck = trck
+    file_info.tit2 = title
+    return file_info
+
+def vary(rng, file_info, kind):
+    '''Make a copy of a FileInfo with differences of a kind'''
+    artist, album, trck, title = file_info.tpe1, file_info.talb, file_info.trck, file_info.tit2
+    if kind == 1:
+        artist = 'The ' + artist.upper()
+        album = album.replace(' ', '  ')
+        trck = '{0:02d}/{1:d}'.format(int(trck), 12)
+    elif kind == 2:
+        i = rng.randrange(len(title) - 1)
+        title = title[:i] + title[i + 1] + title[i] + title[i + 2:]
+    return make_file_info(file_info.path + '.source', artist, album, trck, title)
+
+def run(rng, size):
+    '''Match size source files against size compare files, returning (seconds, tier counts)'''
+    compare_infos = []
+    for i in range(size):
+        artist = 'Artist {0:d}'.format(i // 36)
+        album = 'Album {0:d}'.format(i // 12)
+        compare_infos.append(make_file_info('c{0:d}'.format(i), artist, album, str(i % 12 + 1),
+                                            synth.random_title(rng, False)))
+    source_infos = [vary(rng, file_info, i % 3) for i, file_info in enumerate(compare_infos)]
+    rng.shuffle(source_infos)
+
+    start = time.time()
+    matcher = mp3_match.Matcher(mp3_compare_dir.get_match_tiers(mp3_match.PathTier('same audio')))
+    for file_info in compare_infos:
+        matcher.add(file_info)
+    counts = collections.Counter()
+    for file_info in source_infos:
+        tier, compare_info, score = matcher.match(file_info)
+        counts[tier.name if tier is not None else 'none'] += 1
+    return time.time() - start, counts
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure how file matching scales')
+    parser.add_argument('--sizes', default='10000,40000,160000',
+                        help='Comma-separated numbers of files in each tree')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    for size in [int(size) for size in args.sizes.split(',')]:
+        elapsed, counts = run(rng, size)
+        print('{0:>15d} : {1:8.1f} us/file  {2}'.format(size, elapsed / size * 1000000,
+                                                       ', '.join('{0} {1:d}'.format(name, count)
+                                                                 for name, count in sorted(counts.items()))))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+# Copyright (c) 2013, pynewb
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice, this list
+#     of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice, this
+#     list of conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution.
+#   * Neither the name of pynewb nor the names of its contributors may be used to endorse
+#     or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''Measures the memory used to hold and index the files of a compare
+
+FileInfos are built by FileInfoBuilder from frame events, as when
+parsing, for a source and a compare tree of synthetic files in which
+artists and albums repeat as they do in real libraries.  The compare
+files are indexed in the mp3_compare_dir match tiers, the source files
+are matched against them, and the growth in resident memory is
+reported along with a digest of the matches, which should not change
+when the representation does.
+'''
+
+from __future__ import print_function
+
+import argparse
+import hashlib
+import os
+import random
+import resource
+import time
+
+import mp3_compare_dir
+import mp3_match
+
+from benchmarks import synth
+
+def get_rss():
+    '''Get the resident memory of this process in bytes'''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def build_file_info(path, artist, album, trck, title):
+    '''Build a FileInfo from frame events, with its own copies of the strings as a parser would give'''
+    builder = mp3_compare_dir.FileInfoBuilder()
+    builder.on_path(path)
+    for frame_type, text in (('TPE1', artist), ('TALB', album), ('TRCK', trck), ('TIT2', title)):
+        builder.on_id3v2dot3_frame(frame_type, {'frame_string': (' ' + text)[1:]})
+    return builder.get_file_info()
+
+def generate(rng, count, tree, vary=False, tracks_per_album=12, albums_per_artist=4):
+    '''Yield count FileInfos for a synthetic tree
+
+    If vary is set, a third of the files have the artist and track number
+    written differently, and a third have a typo in the title.
+    '''
+    for i in range(count):
+        album_number = i // tracks_per_album
+        artist = 'Artist {0:d}'.format(album_number // albums_per_artist)
+        album = 'Album {0:d}'.format(album_number)
+        trck = '{0:d}/{1:d}'.format(i % tracks_per_album + 1, tracks_per_album)
+        title = synth.random_title(rng, False)
+        if vary and i % 3 == 1:
+            artist = 'The ' + artist.upper()
+            trck = '{0:02d}'.format(i % tracks_per_album + 1)
+        elif vary and i % 3 == 2 and len(title) > 2:
+            title = title[:1] + title[2] + title[1] + title[3:]
+        path = '/music/{0}/{1}/{2}/{3:02d} {4}.mp3'.format(tree, artist, album, i % tracks_per_album + 1, title)
+        yield build_file_info(path, artist, album, trck, title)
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the memory used by a compare')
+    parser.add_argument('--files', type=int, default=1000000, help='Number of files in each tree')
+    args = parser.parse_args()
+
+    start_rss = get_rss()
+    start = time.time()
+
+    source_file_infos = {}
+    for file_info in generate(random.Random(0), args.files, 'source', True):
+        source_file_infos[file_info.get_key()] = file_info
+    source_rss = get_rss()
+
+    matcher = mp3_match.Matcher(mp3_compare_dir.get_match_tiers(mp3_match.PathTier('same audio')))
+    for file_info in generate(random.Random(0), args.files, 'compare'):
+        matcher.add(file_info)
+    compare_rss = get_rss()
+
+    digest = hashlib.sha1()
+    for key in sorted(source_file_infos.keys()):
+        tier, compare_info, score = matcher.match(source_file_infos[key])
+        digest.update('{0}|{1}|{2}\n'.format(key, tier.name if tier else None, compare_info.path if compare_info else None))
+    elapsed = time.time() - start
+
+    print('{0:>15s} : {1:8.1f} MB'.format('source', (source_rss - start_rss) / 1e6))
+    print('{0:>15s} : {1:8.1f} MB'.format('compare', (compare_rss - source_rss) / 1e6))
+    print('{0:>15s} : {1:8.1f} MB'.format('total', (get_rss() - start_rss) / 1e6))
+    print('{0:>15s} : {1:8.1f} s'.format('elapsed', elapsed))
+    print('{0:>15s} : {1}'.format('matches', digest.hexdigest()))
+
+if __name__ == '__main__':
+    main()
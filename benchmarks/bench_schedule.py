@@ -0,0 +1,101 @@
+# Copyright (c) 2013, pynewb
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice, this list
+#     of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice, this
+#     list of conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution.
+#   * Neither the name of pynewb nor the names of its contributors may be used to endorse
+#     or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''Compares reading a tree in walk order with reading it sorted by inode or disk extent
+
+Before each pass, the pages of every file are dropped from the page
+cache with posix_fadvise(POSIX_FADV_DONTNEED), so the tags are read from
+the disk; this needs no privileges, but does not drop the inodes and
+directories, and pages shared with other processes may stay.  Each
+configuration reports the best of several passes, in files per second.
+The gains show on spinning disks; on SSDs and in memory the orders
+are about the same.
+
+    python -m benchmarks.synth /tmp/corpus --artists 100
+    python -m benchmarks.bench_schedule /tmp/corpus --windows 256,4096
+'''
+
+from __future__ import print_function
+
+import argparse
+import time
+
+import mp3_event_parser
+import mp3_read_schedule
+import mp3_walk
+
+class FrameCounter(object):
+    '''A handler for the ID3v2 file parser that counts decoded frames'''
+
+    def __init__(self):
+        self.frames = 0
+
+    def on_id3v2dot3_frame(self, frame_type, frame_dict):
+        self.frames += 1
+
+def drop_caches(paths):
+    '''Drop the cached pages of files'''
+    for path in paths:
+        mp3_read_schedule.advise(path, mp3_read_schedule.POSIX_FADV_DONTNEED, 0)
+
+def time_scan(top, scheduler, paths, repeat):
+    '''Walk and parse a tree repeat times with the scheduler, returning the best seconds for one pass'''
+    parser = mp3_event_parser.ID3v2Parser(whole_tag=True)
+    best = None
+    for i in range(repeat):
+        drop_caches(paths)
+        handler = FrameCounter()
+        start = time.time()
+        for path in mp3_read_schedule.walk_scheduled(top, mp3_walk.DEFAULT_EXTENSIONS, scheduler):
+            parser.parse_id3v2_file(path, False, handler)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare walk order with inode and extent ordered reads')
+    parser.add_argument('tree', help='The tree of MP3 files to read')
+    parser.add_argument('--windows', default='256,4096', help='Comma-separated window sizes to try')
+    parser.add_argument('--readahead', type=int, default=mp3_read_schedule.DEFAULT_READAHEAD,
+                        help='Number of files whose headers are read ahead')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed passes')
+    args = parser.parse_args()
+
+    if mp3_read_schedule.posix_fadvise is None:
+        print('posix_fadvise is not available, so caches are not dropped and headers are not read ahead')
+    paths = list(mp3_walk.walk_files(args.tree))
+    print('{0:>30s} : {1:d}'.format('files', len(paths)))
+    configurations = [('walk', None)]
+    for window in [int(window) for window in args.windows.split(',')]:
+        for order in ('walk', 'inode', 'extent'):
+            configurations.append(('{0} window {1:d}'.format(order, window),
+                                   mp3_read_schedule.ReadScheduler(order, window, args.readahead)))
+    for name, scheduler in configurations:
+        elapsed = time_scan(args.tree, scheduler, paths, args.repeat)
+        print('{0:>30s} : {1:8.3f} s {2:10.0f} files/s'.format(name, elapsed, len(paths) / elapsed if elapsed else 0))
+
+if __name__ == '__main__':
+    main()
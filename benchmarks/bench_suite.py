@@ -0,0 +1,211 @@
+# Copyright (c) 2013, pynewb
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice, this list
+#     of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice, this
+#     list of conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution.
+#   * Neither the name of pynewb nor the names of its contributors may be used to endorse
+#     or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''Times the parser, walkers and directory comparison over a tree of MP3 files
+
+Each benchmark runs in a child process of its own, so that its peak RSS
+can be measured, and the best of several runs is kept.  For example:
+
+    python -m benchmarks.synth /tmp/corpus --artists 100
+    python -m benchmarks.bench_suite /tmp/corpus --output before.json
+    ...
+    python -m benchmarks.bench_suite /tmp/corpus --output after.json --baseline before.json
+
+Bytes read are taken from /proc/self/io where it is available.  With
+--jobs, they only count reads made by the benchmark process itself, not
+by its workers; peak RSS is the largest of the process and its workers.
+'''
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import mp3_compare_dir
+import mp3_event_parser
+import mp3_walk
+import walk_mp3_full
+
+BENCHMARKS = ('parse', 'walk_parse', 'find_in_tree', 'compare')
+
+class FrameCounter(object):
+    '''A handler for the ID3v2 file parser that counts files and decoded frames'''
+
+    def __init__(self):
+        self.files = 0
+        self.frames = 0
+
+    def on_path(self, path):
+        self.files += 1
+
+    def on_id3v2dot3_frame(self, frame_type, frame_dict):
+        self.frames += 1
+
+def bytes_read():
+    '''Get the number of bytes this process has read, or None'''
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return None
+
+def bench_parse(tree, parser_options, jobs):
+    '''Parse a list of the files in the tree with ID3v2Parser.parse_id3v2_file'''
+    paths = list(mp3_walk.walk_files(tree))
+    parser = mp3_event_parser.ID3v2Parser(**parser_options)
+    handler = FrameCounter()
+    start = time.time()
+    for path in paths:
+        parser.parse_id3v2_file(path, False, handler)
+    return (start, handler.files)
+
+def bench_walk_parse(tree, parser_options, jobs):
+    '''Walk and parse the tree with walk_mp3_and_parse'''
+    handler = FrameCounter()
+    start = time.time()
+    walk_mp3_full.walk_mp3_and_parse(tree, False, handler, jobs, parser_options=parser_options)
+    return (start, handler.files)
+
+def bench_find_in_tree(tree, parser_options, jobs):
+    '''Collect a FileInfo for each file in the tree with find_in_tree, without a cache
+
+    The rate is of files walked, including those find_in_tree drops for errors.
+    '''
+    count = sum(1 for path in mp3_walk.walk_files(tree))
+    start = time.time()
+    for file_info in mp3_compare_dir.find_in_tree(tree, jobs=jobs, parser_options=parser_options):
+        pass
+    return (start, count)
+
+def bench_compare(tree, parser_options, jobs):
+    '''Run the whole mp3_compare_dir flow, comparing the tree with itself'''
+    argv = ['mp3_compare_dir.py', tree, tree, '--jobs', str(jobs)]
+    if parser_options.get('whole_tag'):
+        argv.append('--whole-tag')
+    count = 2 * sum(1 for path in mp3_walk.walk_files(tree))
+    saved = (sys.argv, sys.stdout, sys.stderr)
+    with open(os.devnull, 'w') as devnull:
+        sys.argv, sys.stdout, sys.stderr = argv, devnull, devnull
+        try:
+            start = time.time()
+            mp3_compare_dir.main()
+        finally:
+            sys.argv, sys.stdout, sys.stderr = saved
+    return (start, count)
+
+def run_one(name, tree, parser_options, jobs):
+    '''Run one benchmark in this process, returning its result'''
+    read_before = bytes_read()
+    start, files = globals()['bench_' + name](tree, parser_options, jobs)
+    seconds = time.time() - start
+    read_after = bytes_read()
+    result = {
+        'files': files,
+        'seconds': seconds,
+        'files_per_second': files / seconds if seconds else None,
+        'peak_rss_kb': max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                           resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss),
+    }
+    if read_before is not None:
+        result['mb_read_per_second'] = (read_after - read_before) / 1048576.0 / seconds if seconds else None
+    return result
+
+def run_child(name, args):
+    '''Run one benchmark in a child process, returning its result'''
+    command = [sys.executable, '-m', 'benchmarks.bench_suite', args.tree, '--run', name, '--jobs', str(args.jobs)]
+    if args.whole_tag:
+        command.append('--whole-tag')
+    with open(os.devnull, 'w') as devnull:
+        output = subprocess.check_output(command, stderr=devnull)
+    return json.loads(output)
+
+def git_revision():
+    '''Get the git revision of the working tree, or None'''
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the MP3 parser, walkers and directory comparison')
+    parser.add_argument('tree', help='Tree of MP3 files, such as one generated by benchmarks.synth')
+    parser.add_argument('--benchmarks', default=','.join(BENCHMARKS),
+                        help='Comma-separated benchmarks to run (default is all of {0})'.format(', '.join(BENCHMARKS)))
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of each benchmark, keeping the fastest')
+    parser.add_argument('--jobs', type=int, default=1, help='Worker processes for the walkers and comparison')
+    parser.add_argument('--whole-tag', action='store_true', help='Parse with whole-tag reads')
+    parser.add_argument('--output', help='Save the results as JSON to this file')
+    parser.add_argument('--baseline', help='Compare with results previously saved as JSON to this file')
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_one(args.run, args.tree, {'whole_tag': args.whole_tag}, args.jobs)))
+        return
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    results = {}
+    for name in args.benchmarks.split(','):
+        runs = [run_child(name, args) for i in range(args.repeat)]
+        best = min(runs, key=lambda run: run['seconds'])
+        best['peak_rss_kb'] = max(run['peak_rss_kb'] for run in runs)
+        results[name] = best
+
+        line = '{0:>15s} : {1:7d} files {2:9.1f} files/s'.format(name, best['files'], best['files_per_second'] or 0)
+        if best.get('mb_read_per_second') is not None:
+            line += ' {0:8.1f} MB/s read'.format(best['mb_read_per_second'])
+        line += ' {0:8d} KB peak RSS'.format(best['peak_rss_kb'])
+        if baseline and name in baseline and baseline[name]['seconds']:
+            line += ' {0:6.2f}x baseline'.format(baseline[name]['seconds'] / best['seconds'])
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'tree': os.path.abspath(args.tree),
+                'jobs': args.jobs,
+                'whole_tag': args.whole_tag,
+                'time': time.time(),
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# Copyright (c) 2013, pynewb
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice, this list
+#     of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice, this
+#     list of conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution.
+#   * Neither the name of pynewb nor the names of its contributors may be used to endorse
+#     or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''Compares frame-by-frame and whole-tag reading in ID3v2Parser
+
+For each mode this reports the parse time and the number of read system
+calls per file, the latter from /proc/self/io where it is available.
+'''
+
+from __future__ import print_function
+
+import argparse
+import os
+import os.path
+import shutil
+import tempfile
+import time
+
+import mp3_event_parser
+
+from benchmarks import synth
+
+class FrameCounter(object):
+    '''A handler for the ID3v2 file parser that counts decoded frames'''
+
+    def __init__(self):
+        self.frames = 0
+
+    def on_id3v2dot3_frame(self, frame_type, frame_dict):
+        self.frames += 1
+
+def read_syscalls():
+    '''Get the number of read system calls made by this process, or None'''
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('syscr:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return None
+
+def make_files(top, file_count, frame_count):
+    '''Write files with tags of frame_count text frames, returning their paths'''
+    frames = [synth.text_info_frame('TXXX', 'Text frame {0:d}'.format(i)) for i in range(frame_count - 2)]
+    frames.append(synth.id3v2dot3_frame('COMM', '\x00eng\x00' + 'comment ' * 512))
+    frames.append(synth.id3v2dot3_frame('PRIV', 'WM/Provider\x00' + '\x00' * 32))
+    paths = []
+    for i in range(file_count):
+        path = os.path.join(top, '{0:05d}.mp3'.format(i))
+        synth.write_mp3(path, frames, padding=8192, audio_frames=100)
+        paths.append(path)
+    return paths
+
+def time_parse(paths, whole_tag, repeat):
+    '''Parse the files repeat times, returning (best seconds, read syscalls) for one pass'''
+    parser = mp3_event_parser.ID3v2Parser(whole_tag=whole_tag)
+    best = None
+    syscalls = None
+    for i in range(repeat):
+        handler = FrameCounter()
+        syscr = read_syscalls()
+        start = time.time()
+        for path in paths:
+            parser.parse_id3v2_file(path, False, handler)
+        elapsed = time.time() - start
+        if syscr is not None:
+            syscalls = read_syscalls() - syscr
+        if best is None or elapsed < best:
+            best = elapsed
+    return (best, syscalls)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare frame-by-frame and whole-tag reading')
+    parser.add_argument('--files', type=int, default=500, help='Number of files to parse')
+    parser.add_argument('--frames', type=int, default=40, help='Number of frames per tag')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timed passes')
+    args = parser.parse_args()
+
+    top = tempfile.mkdtemp(prefix='bench_tag_read')
+    try:
+        paths = make_files(top, args.files, args.frames)
+        for whole_tag in (False, True):
+            elapsed, syscalls = time_parse(paths, whole_tag, args.repeat)
+            print('{0:>15s} : {1:8.1f} us/file'.format('whole tag' if whole_tag else 'frame by frame',
+                                                       elapsed * 1000000 / len(paths)), end='')
+            if syscalls is not None:
+                print(' {0:6.1f} reads/file'.format(float(syscalls) / len(paths)), end='')
+            print()
+    finally:
+        shutil.rmtree(top)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# Copyright (c) 2013, pynewb
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice, this list
+#     of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice, this
+#     list of conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution.
+#   * Neither the name of pynewb nor the names of its contributors may be used to endorse
+#     or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''Measures the throughput of validating whole MPEG audio streams
+
+A file of synthetic VBR audio is validated with
+mp3_audio.validate_mpeg_audio, and the rate is reported in MB/s.
+'''
+
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import mp3_audio
+
+from benchmarks import synth
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure MPEG audio validation throughput')
+    parser.add_argument('--megabytes', type=int, default=200, help='Size of the audio to validate')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed passes')
+    args = parser.parse_args()
+
+    top = tempfile.mkdtemp(prefix='bench_validate')
+    try:
+        path = os.path.join(top, 'audio.mp3')
+        audio = synth.vbr_mpeg_audio(random.Random(0), 10000)
+        tag = synth.id3v2dot3_tag([synth.text_info_frame('TIT2', 'Validate')])
+        with open(path, 'wb') as f:
+            f.write(tag)
+            for i in range(args.megabytes * 1000000 // len(audio) + 1):
+                f.write(audio)
+        size = os.path.getsize(path)
+
+        best = None
+        for i in range(args.repeat):
+            with open(path, 'rb') as f:
+                start = time.time()
+                validation_dict = mp3_audio.validate_mpeg_audio(f, len(tag))
+                elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        print('{0:>15s} : {1:d}'.format('frames', validation_dict['valid_frames']))
+        print('{0:>15s} : {1:d}'.format('junk bytes', validation_dict['junk_bytes']))
+        print('{0:>15s} : {1:8.1f} MB/s'.format('validate', size / best / 1000000))
+    finally:
+        shutil.rmtree(top)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+# Copyright (c) 2013, pynewb
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice, this list
+#     of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice, this
+#     list of conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution.
+#   * Neither the name of pynewb nor the names of its contributors may be used to endorse
+#     or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''Measures walking a tree for MP3 files
+
+A tree of empty files laid out as artist/album/track, with a cover image
+in each album, is walked with the listdir and isdir recursion of the
+list_* scripts, with os.walk as in the walk_* scripts, and with
+mp3_walk.walk_files.  The stat calls made through os.stat and os.lstat
+are counted, and the best time of each is reported.
+'''
+
+from __future__ import print_function
+
+import argparse
+import os
+import os.path
+import re
+import shutil
+import tempfile
+import time
+
+import mp3_walk
+
+def make_tree(top, artist_count, album_count, track_count):
+    '''Make a tree of empty files, returning the number of entries'''
+    entries = 0
+    for artist_number in range(artist_count):
+        for album_number in range(album_count):
+            album_dir = os.path.join(top, 'Artist {0:04d}'.format(artist_number), 'Album {0:02d}'.format(album_number))
+            os.makedirs(album_dir)
+            for name in ['cover.jpg'] + ['{0:02d} Track.mp3'.format(n) for n in range(1, track_count + 1)]:
+                open(os.path.join(album_dir, name), 'wb').close()
+            entries += track_count + 2
+        entries += 1
+    return entries
+
+def listdir_walk(dirpath):
+    '''Walk as the list_* scripts did, with listdir and isdir'''
+    for name in os.listdir(dirpath):
+        path = os.path.join(dirpath, name)
+        if os.path.isdir(path):
+            for path in listdir_walk(path):
+                yield path
+        elif re.search('\.mp3$', name):
+            yield path
+
+def os_walk(dirpath):
+    '''Walk as the walk_* scripts did, with os.walk'''
+    for root, dirs, files in os.walk(dirpath):
+        for name in files:
+            if name.endswith('.mp3'):
+                yield os.path.join(root, name)
+
+class StatCounter(object):
+    '''Counts calls to os.stat and os.lstat while installed'''
+
+    def __init__(self):
+        self.count = 0
+        self.saved = None
+
+    def __wrap(self, function):
+        def counted(*args):
+            self.count += 1
+            return function(*args)
+        return counted
+
+    def __enter__(self):
+        self.saved = (os.stat, os.lstat)
+        os.stat, os.lstat = self.__wrap(os.stat), self.__wrap(os.lstat)
+        return self
+
+    def __exit__(self, *exc_info):
+        os.stat, os.lstat = self.saved
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure walking a tree for MP3 files')
+    parser.add_argument('--artists', type=int, default=1000, help='Number of artist directories')
+    parser.add_argument('--albums', type=int, default=4, help='Number of albums per artist')
+    parser.add_argument('--tracks', type=int, default=12, help='Number of tracks per album')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed passes')
+    args = parser.parse_args()
+
+    top = tempfile.mkdtemp(prefix='bench_walk')
+    try:
+        entries = make_tree(top, args.artists, args.albums, args.tracks)
+        print('{0:>15s} : {1:d}'.format('entries', entries))
+        print('{0:>15s} : {1}'.format('scandir', mp3_walk.scandir.__name__))
+        for name, walk in (('listdir', listdir_walk), ('os.walk', os_walk), ('mp3_walk', mp3_walk.walk_files)):
+            best = None
+            for i in range(args.repeat):
+                with StatCounter() as counter:
+                    start = time.time()
+                    files = sum(1 for path in walk(top))
+                    elapsed = time.time() - start
+                if best is None or elapsed < best:
+                    best = elapsed
+            print('{0:>15s} : {1:8.3f} s {2:9d} stats {3:9d} files'.format(name, best, counter.count, files))
+    finally:
+        shutil.rmtree(top)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+# Copyright (c) 2013, pynewb
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice, this list
+#     of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice, this
+#     list of conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution.
+#   * Neither the name of pynewb nor the names of its contributors may be used to endorse
+#     or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''Builds synthetic MP3 files and trees of them for benchmarks
+
+Run as a script to generate a tree:
+
+    python -m benchmarks.synth /tmp/corpus --artists 100
+
+The ID3v2 specification is at http://id3.org
+'''
+
+from __future__ import print_function
+
+import argparse
+import binascii
+import os
+import os.path
+import random
+import struct
+
+def synchsafe(n):
+    '''Encode an integer as a 4-byte synchsafe integer'''
+    return struct.pack('BBBB', (n >> 21) & 0x7f, (n >> 14) & 0x7f, (n >> 7) & 0x7f, n & 0x7f)
+
+def id3v2dot3_frame(frame_type, frame_data, frame_flags=0):
+    '''Build an ID3v2.3 frame'''
+    return struct.pack('>4sIH', frame_type, len(frame_data), frame_flags) + frame_data
+
+def text_info_frame(frame_type, text):
+    '''Build an ID3v2.3 text info frame, using UTF-16 for unicode text'''
+    if isinstance(text, unicode):
+        return id3v2dot3_frame(frame_type, '\x01' + text.encode('utf-16'))
+    return id3v2dot3_frame(frame_type, '\x00' + text)
+
+def id3v2dot3_tag(frames, padding=0):
+    '''Build an ID3v2.3 tag from a list of frames'''
+    body = ''.join(frames) + '\x00' * padding
+    return 'ID3\x03\x00\x00' + synchsafe(len(body)) + body
+
+def mpeg_audio(frame_count):
+    '''Build silent MPEG-1 layer III audio, 128 kbit/s at 44100 Hz'''
+    return ('\xff\xfb\x90\x00' + '\x00' * 413) * frame_count
+
+def vbr_mpeg_audio(rng, frame_count):
+    '''Build silent MPEG-1 layer III audio with bitrates from 96 to 320 kbit/s at 44100 Hz'''
+    frames = []
+    for i in range(frame_count):
+        bitrate, bitrate_index = rng.choice(((96, 7), (128, 9), (192, 11), (320, 14)))
+        padding = rng.randint(0, 1)
+        header = struct.pack('>I', 0xfffb0040 | (bitrate_index << 12) | (padding << 9))
+        frames.append(header + '\x00' * (144000 * bitrate // 44100 + padding - 4))
+    return ''.join(frames)
+
+def write_mp3(path, frames, padding=0, audio_frames=0):
+    '''Write an MP3 file with an ID3v2.3 tag of the given frames'''
+    with open(path, 'wb') as f:
+        f.write(id3v2dot3_tag(frames, padding))
+        f.write(mpeg_audio(audio_frames))
+
+GENRES = ('(13)', '(17)', 'Rock', 'Jazz', 'Classical', '(52)Electronic')
+
+WORDS = ('Blue', 'Night', 'River', 'Song', 'Light', 'Heart', 'Road', 'Rain', 'Dream', 'Fire',
+         'Stone', 'Summer', 'Ghost', 'Morning', 'Echo', 'Garden', 'Silver', 'Ocean', 'Wild', 'Home')
+
+UNICODE_WORDS = (u'Caf\xe9', u'S\xfc\xdf', u'\xc5ngstr\xf6m', u'Na\xefve', u'\u6771\u4eac', u'\u041c\u043e\u0441\u043a\u0432\u0430')
+
+def random_bytes(rng, count):
+    '''Get count reproducible pseudo-random bytes'''
+    if count == 0:
+        return ''
+    return binascii.unhexlify('{0:0{1}x}'.format(rng.getrandbits(count * 8), count * 2))
+
+def random_title(rng, unicode_text):
+    '''Get a title of a few words'''
+    words = [rng.choice(WORDS) for i in range(rng.randint(1, 4))]
+    if unicode_text:
+        words.append(rng.choice(UNICODE_WORDS))
+        return u' '.join(words)
+    return ' '.join(words)
+
+def track_frames(rng, artist, album, track_number, track_count, title, picture, unicode_text):
+    '''Build a varied mix of frames for a track'''
+    frames = [
+        text_info_frame('TPE1', artist),
+        text_info_frame('TALB', album),
+        text_info_frame('TIT2', title),
+    ]
+    if rng.random() < 0.5:
+        frames.append(text_info_frame('TRCK', '{0:d}/{1:d}'.format(track_number, track_count)))
+    else:
+        frames.append(text_info_frame('TRCK', '{0:02d}'.format(track_number)))
+    if rng.random() < 0.3:
+        frames.append(text_info_frame('TPE2', artist))
+    if rng.random() < 0.8:
+        frames.append(text_info_frame('TYER', str(rng.randint(1960, 2013))))
+    if rng.random() < 0.7:
+        frames.append(text_info_frame('TCON', rng.choice(GENRES)))
+    if rng.random() < 0.4:
+        frames.append(text_info_frame('TENC', 'iTunes 11.0'))
+    if rng.random() < 0.5:
+        frames.append(id3v2dot3_frame('COMM', '\x00eng\x00' + ' '.join(rng.choice(WORDS) for i in range(rng.randint(1, 40)))))
+    if rng.random() < 0.1:
+        lyrics = u'\n'.join(random_title(rng, unicode_text) for i in range(rng.randint(10, 100)))
+        frames.append(id3v2dot3_frame('USLT', '\x01eng' + u''.encode('utf-16') + '\x00\x00' + lyrics.encode('utf-16')))
+    if rng.random() < 0.3:
+        frames.append(id3v2dot3_frame('PRIV', 'WM/Provider\x00' + u'Provider'.encode('utf-16-le') + '\x00\x00'))
+    if picture:
+        frames.append(id3v2dot3_frame('APIC', '\x00image/jpeg\x00\x03\x00' + picture))
+    rng.shuffle(frames)
+    return frames
+
+def write_corrupt_mp3(path, rng, audio_frames):
+    '''Write an MP3 file whose ID3v2 header is corrupt or truncated'''
+    kind = rng.randint(0, 2)
+    with open(path, 'wb') as f:
+        if kind == 0:
+            # A size byte with the high bit set
+            f.write('ID3\x03\x00\x00\x00\x00\x80\x10')
+        elif kind == 1:
+            # A tag claiming more bytes than the file holds
+            f.write('ID3\x03\x00\x00' + synchsafe(1 << 20) + text_info_frame('TIT2', 'Truncated'))
+            return
+        else:
+            # A header cut short
+            f.write('ID3\x03')
+            return
+        f.write(mpeg_audio(audio_frames))
+
+def write_untagged_mp3(path, audio_frames):
+    '''Write an MP3 file with no ID3v2 tag'''
+    with open(path, 'wb') as f:
+        f.write(mpeg_audio(audio_frames))
+
+def generate_tree(top, artist_count=10, album_count=3, track_count=12, seed=0,
+                  picture_size=65536, unicode_fraction=0.2, corrupt_fraction=0.01,
+                  untagged_fraction=0.02, max_padding=4096, audio_frames=40):
+    '''Generate a reproducible artist/album/track tree of synthetic MP3 files
+
+    Each album has one picture of picture_size bytes, attached to all of
+    its tracks.  This returns the number of files written.
+    '''
+    rng = random.Random(seed)
+    file_count = 0
+    for artist_number in range(artist_count):
+        unicode_artist = rng.random() < unicode_fraction
+        artist = random_title(rng, unicode_artist)
+        for album_number in range(album_count):
+            album = random_title(rng, unicode_artist)
+            picture = random_bytes(rng, picture_size)
+            album_dir = os.path.join(top, 'Artist {0:04d}'.format(artist_number), 'Album {0:02d}'.format(album_number))
+            if not os.path.isdir(album_dir):
+                os.makedirs(album_dir)
+            for track_number in range(1, track_count + 1):
+                path = os.path.join(album_dir, '{0:02d} Track.mp3'.format(track_number))
+                kind = rng.random()
+                if kind < corrupt_fraction:
+                    write_corrupt_mp3(path, rng, audio_frames)
+                elif kind < corrupt_fraction + untagged_fraction:
+                    write_untagged_mp3(path, audio_frames)
+                else:
+                    title = random_title(rng, rng.random() < unicode_fraction)
+                    frames = track_frames(rng, artist, album, track_number, track_count, title, picture,
+                                          unicode_artist)
+                    write_mp3(path, frames, rng.randint(0, max_padding), audio_frames)
+                file_count += 1
+    return file_count
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a tree of synthetic MP3 files')
+    parser.add_argument('top', help='The directory in which to generate the tree')
+    parser.add_argument('--artists', type=int, default=10, help='Number of artist directories')
+    parser.add_argument('--albums', type=int, default=3, help='Number of albums per artist')
+    parser.add_argument('--tracks', type=int, default=12, help='Number of tracks per album')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--picture-size', type=int, default=65536, help='Bytes of attached picture per album')
+    parser.add_argument('--unicode-fraction', type=float, default=0.2, help='Fraction of UTF-16 text')
+    parser.add_argument('--corrupt-fraction', type=float, default=0.01, help='Fraction of files with corrupt headers')
+    parser.add_argument('--untagged-fraction', type=float, default=0.02, help='Fraction of files with no tag')
+    parser.add_argument('--max-padding', type=int, default=4096, help='Maximum bytes of tag padding')
+    parser.add_argument('--audio-frames', type=int, default=40, help='MPEG audio frames per file')
+    args = parser.parse_args()
+
+    count = generate_tree(args.top, args.artists, args.albums, args.tracks, args.seed,
+                          args.picture_size, args.unicode_fraction, args.corrupt_fraction,
+                          args.untagged_fraction, args.max_padding, args.audio_frames)
+    print(count, 'files written to', args.top)
+
+if __name__ == '__main__':
+    main()
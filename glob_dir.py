@@ -1,25 +1,22 @@
 #!/usr/bin/env python
 #
 # Introduces:
-#  import
+#  import, including a module of this project
 #  def
 #  for..in
-#  if..else
+#  if
 #  Console output using the print statement
 #  Path manipulation
-#  Directory listing via glob
+#  Listing every file in a directory tree using the generator mp3_walk.walk_files
 #
 
-import glob
 import os.path
 
+import mp3_walk
+
 def list_dir(dirpath):
-    wc_path = os.path.join(dirpath, '*')
-    for path in glob.iglob(wc_path):
-        if os.path.isdir(path):
-            list_dir(path)
-        else:
-            print path
+    for path in mp3_walk.walk_files(dirpath, None):
+        print path
 
 if __name__ == '__main__':
     list_dir('..')
@@ -2,19 +2,17 @@
 #
 # Introduces:
 #  Console input using the raw_input function
-#  Directory listing using listdir
+#  Listing every file in a directory tree entered by the user, using mp3_walk.walk_files
 #
 
 import os
 import os.path
 
+import mp3_walk
+
 def list_dir(dirpath):
-    for file in os.listdir(dirpath):
-        path = os.path.join(dirpath, file)
-        if os.path.isdir(path):
-            list_dir(path)
-        else:
-            print path
+    for path in mp3_walk.walk_files(dirpath, None):
+        print path
 
 if __name__ == '__main__':
     dir = raw_input("Enter the top directory: ")
@@ -2,26 +2,23 @@
 #
 # Introduces:
 #  array slicing
-#  Filename matching using regular expressions
+#  Listing only the files with an extension, by default .mp3, using mp3_walk.walk_files
 #  Argument processing using sys.argv
 #  Early termination with the exit function
 #
 
 import os
 import os.path
-import re
 import sys
 
+import mp3_walk
+
 def list_mp3(dirpath):
     if not os.path.isdir(dirpath):
         exit(dirpath + " is not a directory")
 
-    for file in os.listdir(dirpath):
-        path = os.path.join(dirpath, file)
-        if (os.path.isdir(path)):
-            list_mp3(path)
-        elif (re.search('\.mp3$', file)):
-            print path
+    for path in mp3_walk.walk_files(dirpath):
+        print path
 
 if __name__ == '__main__':
     print sys.argv[0]
@@ -7,9 +7,10 @@
 
 import os
 import os.path
-import re
 import sys
 
+import mp3_walk
+
 def print_mp3_file(path):
     track = os.path.basename(path)
     toppath = os.path.dirname(path)
@@ -26,12 +27,8 @@ def list_mp3_file(dirpath):
     if not os.path.isdir(dirpath):
         exit(dirpath + " is not a directory")
 
-    for file in os.listdir(dirpath):
-        path = os.path.join(dirpath, file)
-        if (os.path.isdir(path)):
-            list_mp3_file(path)
-        elif (re.search('\.mp3$', file)):
-            print_mp3_file(path)
+    for path in mp3_walk.walk_files(dirpath):
+        print_mp3_file(path)
 
 if __name__ == '__main__':
     print sys.argv[0]
@@ -7,9 +7,10 @@
 import argparse
 import os
 import os.path
-import re
 import sys
 
+import mp3_walk
+
 def print_mp3_info(path, aatpath):
     track = os.path.basename(path)
     toppath = os.path.dirname(path)
@@ -28,12 +29,8 @@ def list_mp3_info(dirpath, aatpath):
     if not os.path.isdir(dirpath):
         exit(dirpath + " is not a directory")
 
-    for file in os.listdir(dirpath):
-        path = os.path.join(dirpath, file)
-        if (os.path.isdir(path)):
-            list_mp3_info(path, aatpath)
-        elif (re.search('\.mp3$', file)):
-            print_mp3_info(path, aatpath)
+    for path in mp3_walk.walk_files(dirpath):
+        print_mp3_info(path, aatpath)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='List MP3 file information')
@@ -0,0 +1,128 @@
+# Copyright (c) 2013, pynewb
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice, this list
+#     of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice, this
+#     list of conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution.
+#   * Neither the name of pynewb nor the names of its contributors may be used to endorse
+#     or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''Keeps the attached pictures and objects of MP3 files in a content-addressed store
+
+Each payload is stored once, in a file named for the SHA-1 hash of its
+bytes, however many files it is attached to.  Payloads are streamed from
+the MP3 files in chunks, so memory use does not grow with their size.
+'''
+
+from __future__ import print_function
+
+import errno
+import hashlib
+import os
+import os.path
+import tempfile
+
+# Bytes read at a time when hashing and storing a payload
+CHUNK_SIZE = 1 << 16
+
+# Extensions of the stored files, by MIME type
+MIME_EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/jpg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/bmp': '.bmp',
+}
+
+def file_chunks(f, offset, length, chunk_size=CHUNK_SIZE):
+    '''Yield the bytes of an open file from offset, length bytes of them, in chunks'''
+    f.seek(offset)
+    while length > 0:
+        chunk = f.read(min(chunk_size, length))
+        if not chunk:
+            raise IOError("File ends {0:d} bytes short of the payload".format(length))
+        length -= len(chunk)
+        yield chunk
+
+def buffer_chunks(data, chunk_size=CHUNK_SIZE):
+    '''Yield a string or memoryview in chunks'''
+    for offset in xrange(0, len(data), chunk_size):
+        yield data[offset:offset + chunk_size]
+
+class ArtStore(object):
+    '''A directory of payloads named for their hashes
+
+    A payload with the hash 0beec7b5ea3f0fdbc95d0dd47f3c5bc275da8a33 and
+    the MIME type image/jpeg is stored as
+    0b/0beec7b5ea3f0fdbc95d0dd47f3c5bc275da8a33.jpg under the directory.
+    Payloads are written to temporary files and renamed into place, so
+    several processes can add to the same store at once.
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get_path(self, digest, mime_type):
+        '''Get the path of the stored file of a payload'''
+        extension = MIME_EXTENSIONS.get(mime_type.lower(), '.bin')
+        return os.path.join(self.directory, digest[0:2], digest + extension)
+
+    def put(self, chunks, mime_type):
+        '''Store a payload, unless it is stored already, returning its hex digest
+
+        chunks is a function returning an iterable of the payload's bytes,
+        which is called once to hash them and, if the payload is new, again
+        to write them.  Duplicates are only read.
+        '''
+        digest = hashlib.sha1()
+        for chunk in chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        path = self.get_path(digest, mime_type)
+        if os.path.exists(path):
+            return digest
+
+        dirpath = os.path.dirname(path)
+        try:
+            os.makedirs(dirpath)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        fd, temp_path = tempfile.mkstemp(prefix='.' + digest, suffix='.tmp', dir=dirpath)
+        try:
+            written = hashlib.sha1()
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in chunks():
+                    written.update(chunk)
+                    out.write(chunk)
+            if written.hexdigest() != digest:
+                raise IOError("Payload changed while being stored")
+            os.rename(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return digest
+
+    def put_file(self, f, offset, length, mime_type):
+        '''Store length bytes of an open file from offset, returning their hex digest'''
+        return self.put(lambda: file_chunks(f, offset, length), mime_type)
+
+    def put_buffer(self, data, mime_type):
+        '''Store a string or memoryview, returning its hex digest'''
+        return self.put(lambda: buffer_chunks(data), mime_type)
@@ -0,0 +1,478 @@
+# Copyright (c) 2013, pynewb
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice, this list
+#     of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice, this
+#     list of conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution.
+#   * Neither the name of pynewb nor the names of its contributors may be used to endorse
+#     or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import print_function
+
+import collections
+import os
+import struct
+
+# Number of bytes read at the start of the audio, enough for the first
+# frame's VBR header and a few frames after it
+AUDIO_FIRST_READ = 4096
+
+# Number of bytes past the end of the tag searched for the first frame
+MAX_SYNC_SEARCH = 65536
+
+# Number of bytes read at a time when scanning every frame
+SCAN_CHUNK_SIZE = 65536
+
+# MPEG audio versions and layers, by the version and layer bits of a frame header
+MPEG_VERSIONS = ('2.5', None, '2', '1')
+LAYERS = (None, 3, 2, 1)
+
+CHANNEL_MODES = ('Stereo', 'Joint stereo', 'Dual channel', 'Mono')
+
+# Bitrates in kbit/s by MPEG-1 or not, layer and bitrate index; 0 is free format
+BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448, None),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384, None),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, None),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256, None),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160, None),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160, None),
+}
+
+# Sample rates in Hz by version and sample rate index
+SAMPLE_RATES = {
+    '1': (44100, 48000, 32000, None),
+    '2': (22050, 24000, 16000, None),
+    '2.5': (11025, 12000, 8000, None),
+}
+
+FrameHeader = collections.namedtuple('FrameHeader', (
+    'version', 'layer', 'protected', 'bitrate', 'sample_rate', 'padding',
+    'channel_mode', 'frame_size', 'samples'))
+
+# Decoded frame headers by header value, since a file uses only a few
+frame_header_cache = {}
+
+def decode_frame_header(header):
+    '''Decode a 32-bit MPEG audio frame header, returning a FrameHeader
+
+    This returns None if the value is not a valid frame header.  Free
+    format frames, which have no bitrate in the header, are not supported.
+    '''
+    frame_header = frame_header_cache.get(header)
+    if frame_header is not None:
+        return frame_header
+    if (header & 0xffe00000) != 0xffe00000:
+        return None
+    version = MPEG_VERSIONS[(header >> 19) & 3]
+    layer = LAYERS[(header >> 17) & 3]
+    if version is None or layer is None:
+        return None
+    mpeg1 = version == '1'
+    bitrate = BITRATES[(mpeg1, layer)][(header >> 12) & 15]
+    sample_rate = SAMPLE_RATES[version][(header >> 10) & 3]
+    if not bitrate or sample_rate is None:
+        return None
+    padding = (header >> 9) & 1
+    if layer == 1:
+        frame_size = (12000 * bitrate // sample_rate + padding) * 4
+        samples = 384
+    elif layer == 2 or mpeg1:
+        frame_size = 144000 * bitrate // sample_rate + padding
+        samples = 1152
+    else:
+        frame_size = 72000 * bitrate // sample_rate + padding
+        samples = 576
+    frame_header = FrameHeader(version, layer, not (header >> 16) & 1, bitrate, sample_rate, padding,
+                               CHANNEL_MODES[(header >> 6) & 3], frame_size, samples)
+    frame_header_cache[header] = frame_header
+    return frame_header
+
+def is_same_stream(frame_header, next_header):
+    '''Get whether two frame headers could belong to the same stream'''
+    return (next_header is not None and next_header.version == frame_header.version
+            and next_header.layer == frame_header.layer and next_header.sample_rate == frame_header.sample_rate)
+
+def find_frame(data, offset=0):
+    '''Find the first MPEG audio frame at or after an offset in some bytes
+
+    A frame is only accepted if the next frame follows it, unless the
+    next frame would be past the end of the bytes.  This returns a tuple
+    of (offset, FrameHeader), or (None, None) if there is no frame.
+    '''
+    end = len(data) - 4
+    while True:
+        offset = data.find('\xff', offset, end + 1)
+        if offset < 0:
+            return (None, None)
+        frame_header = decode_frame_header(struct.unpack_from('>I', data, offset)[0])
+        if frame_header is not None:
+            next_offset = offset + frame_header.frame_size
+            if next_offset > end:
+                return (offset, frame_header)
+            if is_same_stream(frame_header, decode_frame_header(struct.unpack_from('>I', data, next_offset)[0])):
+                return (offset, frame_header)
+        offset += 1
+
+def parse_vbr_header(data, offset, frame_header):
+    '''Parse the Xing, Info or VBRI header in the frame at an offset, if any
+
+    This returns a dict of vbr_header, the header's name, and frame_count,
+    byte_count, encoder, encoder_delay and encoder_padding where known,
+    or None if there is no VBR header
+    '''
+    # The Xing header follows the side information of the first granule
+    if frame_header.version == '1':
+        side_info_size = 17 if frame_header.channel_mode == 'Mono' else 32
+    else:
+        side_info_size = 9 if frame_header.channel_mode == 'Mono' else 17
+    xing_offset = offset + 4 + side_info_size
+    vbr_dict = None
+
+    name = data[xing_offset:xing_offset + 4]
+    if (name == 'Xing' or name == 'Info') and xing_offset + 8 <= len(data):
+        vbr_dict = {'vbr_header': name, 'frame_count': None, 'byte_count': None, 'encoder': None,
+                    'encoder_delay': 0, 'encoder_padding': 0}
+        flags = struct.unpack_from('>I', data, xing_offset + 4)[0]
+        pos = xing_offset + 8
+        if flags & 1 and pos + 4 <= len(data):
+            vbr_dict['frame_count'] = struct.unpack_from('>I', data, pos)[0]
+            pos += 4
+        if flags & 2 and pos + 4 <= len(data):
+            vbr_dict['byte_count'] = struct.unpack_from('>I', data, pos)[0]
+            pos += 4
+        if flags & 4:
+            pos += 100
+        if flags & 8:
+            pos += 4
+        # The LAME tag, which FFmpeg also writes, follows with the encoder delay and padding
+        encoder = data[pos:pos + 9]
+        if encoder[0:4] in ('LAME', 'Lavf', 'Lavc', 'GOGO') and pos + 24 <= len(data):
+            vbr_dict['encoder'] = encoder.rstrip('\0 ')
+            delay_bytes = bytearray(data[pos + 21:pos + 24])
+            vbr_dict['encoder_delay'] = (delay_bytes[0] << 4) | (delay_bytes[1] >> 4)
+            vbr_dict['encoder_padding'] = ((delay_bytes[1] & 0x0f) << 8) | delay_bytes[2]
+    elif data[offset + 36:offset + 40] == 'VBRI' and offset + 54 <= len(data):
+        byte_count, frame_count = struct.unpack_from('>II', data, offset + 46)
+        vbr_dict = {'vbr_header': 'VBRI', 'frame_count': frame_count, 'byte_count': byte_count,
+                    'encoder': None, 'encoder_delay': struct.unpack_from('>H', data, offset + 42)[0],
+                    'encoder_padding': 0}
+    return vbr_dict
+
+def scan_frames(f, offset, frame_header):
+    '''Walk every frame from an offset in a file, returning (frame_count, samples, byte_count)
+
+    This is for VBR files without a VBR header.  Junk between frames is
+    skipped by searching for the next frame.
+    '''
+    frame_count = 0
+    samples = 0
+    byte_count = 0
+    f.seek(offset)
+    data = f.read(SCAN_CHUNK_SIZE)
+    pos = 0
+    while True:
+        if pos + 4 > len(data):
+            chunk = f.read(SCAN_CHUNK_SIZE)
+            if not chunk:
+                break
+            data = data[pos:] + chunk
+            pos = 0
+            continue
+        next_header = decode_frame_header(struct.unpack_from('>I', data, pos)[0])
+        if not is_same_stream(frame_header, next_header):
+            found, next_header = find_frame(data, pos + 1)
+            if found is None:
+                # Keep the last bytes, which could be the start of a frame header
+                pos = max(pos + 1, len(data) - 3)
+                continue
+            if not is_same_stream(frame_header, next_header):
+                pos = found + 1
+                continue
+            pos = found
+        frame_count += 1
+        samples += next_header.samples
+        byte_count += next_header.frame_size
+        pos += next_header.frame_size
+    return (frame_count, samples, byte_count)
+
+def analyze_mpeg_audio(f, audio_offset, data=''):
+    '''Analyze the MPEG audio starting at an offset in a file
+
+    data can be bytes already read from the offset on; more are read if
+    it is too short.  The duration and average bitrate are taken from a
+    Xing, Info or VBRI header if the first frame has one, and otherwise
+    from the file size if the first few frames have the same bitrate.
+    Only VBR files without a VBR header are scanned frame by frame.
+
+    This returns a dict of the stream properties, or None if no frame was
+    found within MAX_SYNC_SEARCH bytes of the offset.
+    '''
+    if len(data) < AUDIO_FIRST_READ:
+        f.seek(audio_offset + len(data))
+        data += f.read(AUDIO_FIRST_READ - len(data))
+    offset, frame_header = find_frame(data)
+    while offset is None and len(data) < MAX_SYNC_SEARCH:
+        chunk = f.read(AUDIO_FIRST_READ)
+        if not chunk:
+            break
+        data += chunk
+        offset, frame_header = find_frame(data, max(0, len(data) - len(chunk) - 3))
+    if offset is None:
+        return None
+
+    audio_offset += offset
+    audio_size = os.fstat(f.fileno()).st_size - audio_offset
+    audio_dict = {
+        'mpeg_version': frame_header.version,
+        'layer': frame_header.layer,
+        'bitrate': frame_header.bitrate,
+        'sample_rate': frame_header.sample_rate,
+        'channel_mode': frame_header.channel_mode,
+        'audio_offset': audio_offset,
+        'vbr_header': None,
+        'encoder': None,
+        'frame_count': None,
+        'duration': None,
+        'average_bitrate': None,
+    }
+
+    vbr_dict = parse_vbr_header(data, offset, frame_header)
+    if vbr_dict is not None and vbr_dict['frame_count']:
+        audio_dict['vbr_header'] = vbr_dict['vbr_header']
+        audio_dict['encoder'] = vbr_dict['encoder']
+        audio_dict['frame_count'] = vbr_dict['frame_count']
+        samples = vbr_dict['frame_count'] * frame_header.samples
+        samples = max(0, samples - vbr_dict['encoder_delay'] - vbr_dict['encoder_padding'])
+        byte_count = vbr_dict['byte_count'] or audio_size
+    else:
+        # Constant bitrate unless the frames in hand say otherwise
+        pos = offset
+        constant = True
+        while pos + 4 <= len(data):
+            next_header = decode_frame_header(struct.unpack_from('>I', data, pos)[0])
+            if not is_same_stream(frame_header, next_header):
+                break
+            if next_header.bitrate != frame_header.bitrate:
+                constant = False
+                break
+            pos += next_header.frame_size
+        if constant:
+            average_frame_size = 144000.0 * frame_header.bitrate / frame_header.sample_rate
+            if frame_header.layer == 1:
+                average_frame_size /= 3
+            elif frame_header.layer == 3 and frame_header.version != '1':
+                average_frame_size /= 2
+            audio_dict['frame_count'] = int(round(audio_size / average_frame_size))
+            samples = audio_dict['frame_count'] * frame_header.samples
+            byte_count = audio_size
+        else:
+            audio_dict['frame_count'], samples, byte_count = scan_frames(f, audio_offset, frame_header)
+
+    if samples:
+        audio_dict['duration'] = float(samples) / frame_header.sample_rate
+        audio_dict['average_bitrate'] = int(round(byte_count * 8 / audio_dict['duration'] / 1000))
+    return audio_dict
+
+# Number of bytes read at a time when validating the whole stream
+VALIDATE_CHUNK_SIZE = 1 << 20
+
+# Largest possible frame, for MPEG-1 layer I at 448 kbit/s and 32 kHz
+MAX_FRAME_SIZE = 2884
+
+# Number of junk regions and CRC errors listed in a validation; all are counted
+MAX_REPORTED = 100
+
+def make_crc16_table():
+    '''Make the lookup table for the CRC-16 of MPEG audio frames, polynomial 0x8005'''
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for bit in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x8005) & 0xffff
+            else:
+                crc = (crc << 1) & 0xffff
+        table.append(crc)
+    return table
+
+crc16_table = make_crc16_table()
+
+def crc16(data, crc=0xffff):
+    '''Compute the CRC-16 used by MPEG audio frames over some bytes'''
+    for byte in bytearray(data):
+        crc = ((crc << 8) & 0xffff) ^ crc16_table[(crc >> 8) ^ byte]
+    return crc
+
+def check_frame_crc(data, pos, frame_header):
+    '''Check the CRC of a protected layer III frame, returning False if it is wrong
+
+    The CRC covers the last two bytes of the header and the side
+    information.  Layer I and II CRCs, which cover a variable number of
+    bit allocation bytes, are not checked.
+    '''
+    if frame_header.layer != 3:
+        return True
+    if frame_header.version == '1':
+        side_info_size = 17 if frame_header.channel_mode == 'Mono' else 32
+    else:
+        side_info_size = 9 if frame_header.channel_mode == 'Mono' else 17
+    crc = crc16(data[pos + 6:pos + 6 + side_info_size], crc16(data[pos + 2:pos + 4]))
+    return crc == struct.unpack_from('>H', data, pos + 4)[0]
+
+def validate_mpeg_audio(f, audio_offset, chunk_size=VALIDATE_CHUNK_SIZE):
+    '''Validate the whole MPEG audio stream starting at an offset in a file
+
+    The stream is read in chunks of chunk_size bytes, so memory use is
+    bounded whatever the file size.  Frames are followed by their lengths
+    from the first frame found, CRCs of protected layer III frames are
+    checked, and bytes which are not part of a frame of the stream are
+    reported as junk until the next frame is found.  A final ID3v1 tag is
+    not junk.
+
+    This returns a dict of first_frame_offset (None if no frame was
+    found), valid_frames, junk_bytes, junk_regions, junk (a list of
+    (offset, length) of at most MAX_REPORTED regions), crc_errors,
+    crc_error_offsets (at most MAX_REPORTED), id3v1, and truncated_offset
+    and truncated_bytes, the offset of a final frame cut short by the end
+    of the file and the number of its bytes missing.
+    '''
+    validation_dict = {
+        'first_frame_offset': None,
+        'valid_frames': 0,
+        'junk_bytes': 0,
+        'junk_regions': 0,
+        'junk': [],
+        'crc_errors': 0,
+        'crc_error_offsets': [],
+        'id3v1': False,
+        'truncated_offset': None,
+        'truncated_bytes': 0,
+    }
+    file_size = os.fstat(f.fileno()).st_size
+    f.seek(audio_offset)
+    data = f.read(chunk_size)
+    base = audio_offset
+    eof = base + len(data) >= file_size
+    pos = 0
+    stream_header = None
+    junk_start = audio_offset
+    valid_frames = 0
+    # Sizes of the unprotected frames of the stream, by their header bytes
+    frame_sizes = {}
+
+    def add_junk(start, end):
+        if end > start:
+            validation_dict['junk_bytes'] += end - start
+            validation_dict['junk_regions'] += 1
+            if len(validation_dict['junk']) < MAX_REPORTED:
+                validation_dict['junk'].append((start, end - start))
+
+    while True:
+        if junk_start is None:
+            # Follow frames through the chunk; this is the hot loop
+            end = len(data) - 4
+            while pos <= end:
+                size = frame_sizes.get(data[pos:pos + 4])
+                if size is None or pos + size > len(data):
+                    break
+                valid_frames += 1
+                pos += size
+
+        need_more = pos + 4 > len(data)
+        if not need_more:
+            frame_header = decode_frame_header(struct.unpack_from('>I', data, pos)[0])
+            if stream_header is not None and not is_same_stream(stream_header, frame_header):
+                frame_header = None
+            if frame_header is not None:
+                next_pos = pos + frame_header.frame_size
+                if next_pos > len(data):
+                    # Read on, or leave it as the truncated final frame
+                    need_more = True
+                elif junk_start is not None:
+                    # A frame after junk must be followed by another, or the end of the file
+                    if next_pos + 4 <= len(data):
+                        if not is_same_stream(frame_header, decode_frame_header(
+                                struct.unpack_from('>I', data, next_pos)[0])):
+                            frame_header = None
+                    elif not eof:
+                        need_more = True
+
+            if need_more:
+                pass
+            elif frame_header is not None:
+                if junk_start is not None:
+                    add_junk(junk_start, base + pos)
+                    junk_start = None
+                if stream_header is None:
+                    stream_header = frame_header
+                    validation_dict['first_frame_offset'] = base + pos
+                if frame_header.protected:
+                    if not check_frame_crc(data, pos, frame_header):
+                        validation_dict['crc_errors'] += 1
+                        if len(validation_dict['crc_error_offsets']) < MAX_REPORTED:
+                            validation_dict['crc_error_offsets'].append(base + pos)
+                else:
+                    frame_sizes[data[pos:pos + 4]] = frame_header.frame_size
+                valid_frames += 1
+                pos += frame_header.frame_size
+                continue
+            else:
+                # Not a frame of the stream, so junk up to the next frame, leaving
+                # room after a candidate to check the frame following it
+                if junk_start is None:
+                    junk_start = base + pos
+                search_end = len(data) if eof else len(data) - MAX_FRAME_SIZE - 4
+                next_pos = data.find('\xff', pos + 1, max(pos + 1, search_end))
+                if next_pos >= 0:
+                    pos = next_pos
+                    continue
+                pos = max(pos + 1, search_end)
+
+        if eof:
+            break
+        # Keep the bytes of a partial frame, and read the next chunk
+        chunk = f.read(chunk_size)
+        data = data[pos:] + chunk
+        base += pos
+        pos = 0
+        eof = not chunk or base + len(data) >= file_size
+
+    remaining = len(data) - pos
+    if remaining >= 4 and stream_header is not None:
+        frame_header = decode_frame_header(struct.unpack_from('>I', data, pos)[0])
+        if is_same_stream(stream_header, frame_header) and frame_header.frame_size > remaining:
+            if junk_start is not None:
+                add_junk(junk_start, base + pos)
+            validation_dict['truncated_offset'] = base + pos
+            validation_dict['truncated_bytes'] = frame_header.frame_size - remaining
+            pos = len(data)
+            junk_start = None
+    if remaining > 0 and junk_start is None and pos < len(data):
+        junk_start = base + pos
+    if junk_start is not None:
+        id3v1_pos = file_size - 128 - base
+        if junk_start <= file_size - 128 and id3v1_pos >= 0 and data[id3v1_pos:id3v1_pos + 3] == 'TAG':
+            validation_dict['id3v1'] = True
+            add_junk(junk_start, file_size - 128)
+        else:
+            add_junk(junk_start, base + len(data))
+
+    validation_dict['valid_frames'] = valid_frames
+    return validation_dict
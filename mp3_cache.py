@@ -0,0 +1,189 @@
+# Copyright (c) 2013, pynewb
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice, this list
+#     of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice, this
+#     list of conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution.
+#   * Neither the name of pynewb nor the names of its contributors may be used to endorse
+#     or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import print_function
+
+import os
+import os.path
+import sqlite3
+import struct
+
+# FileInfo fields stored in the cache
+FIELDS = ('talb', 'tit2', 'tpe1', 'tpe2', 'trck', 'duration', 'bitrate')
+
+# Version of the cache schema, to be increased when FIELDS or the parsing of them change
+SCHEMA_VERSION = 5
+
+# Number of stores between commits
+COMMIT_INTERVAL = 1000
+
+# Tables of entries keyed by path
+TABLES = ('file_info', 'audio_hash', 'frame_index')
+
+# An entry of a stored frame index: frame type, flags, offset and size
+frame_index_entry = struct.Struct('>4sHQI')
+
+def get_mtime_ns(st):
+    '''Get the modification time of a stat result in nanoseconds'''
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(st.st_mtime * 1000000000)
+    return mtime_ns
+
+def to_db(value):
+    '''Convert a value for storage, keeping byte strings as blobs'''
+    if isinstance(value, str):
+        return sqlite3.Binary(value)
+    return value
+
+def from_db(value):
+    '''Convert a stored value back, restoring byte strings from blobs'''
+    if isinstance(value, buffer):
+        return str(value)
+    return value
+
+class FileInfoCache(object):
+    '''A persistent cache of FileInfo fields parsed from MP3 files
+
+    Entries are keyed by absolute path and are only valid while the file
+    size and modification time are unchanged, so a file which has not
+    changed can be served without being opened.  FileInfo entries are
+    also only valid for the parser options they were parsed with.  The
+    span and hash of the audio of files, and the frame indexes of their
+    tags, are kept alongside, on the same terms.  A cache with an older
+    schema is emptied.
+    '''
+
+    def __init__(self, db_path):
+        '''Open or create the cache database'''
+        self.conn = sqlite3.connect(db_path)
+        if self.conn.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            for table in TABLES:
+                self.conn.execute('DROP TABLE IF EXISTS ' + table)
+            self.conn.execute('PRAGMA user_version = {0:d}'.format(SCHEMA_VERSION))
+        self.conn.execute('CREATE TABLE IF NOT EXISTS file_info ('
+                          'path BLOB PRIMARY KEY, size INTEGER, mtime_ns INTEGER, '
+                          + ', '.join(FIELDS) + ', error TEXT, options TEXT)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS audio_hash ('
+                          'path BLOB PRIMARY KEY, size INTEGER, mtime_ns INTEGER, '
+                          'audio_start INTEGER, audio_end INTEGER, digest TEXT)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS frame_index ('
+                          'path BLOB PRIMARY KEY, size INTEGER, mtime_ns INTEGER, '
+                          'version INTEGER, flags INTEGER, entries BLOB)')
+        self.pending = 0
+
+    def get(self, path, st, options=''):
+        '''Get the cached (fields, error) for a file, or None if not cached, stale or parsed with other options
+
+        fields is a tuple of values in the order of FIELDS.  options is a
+        string of the parser options which affect the fields, as given to put.
+        '''
+        row = self.conn.execute('SELECT size, mtime_ns, options, ' + ', '.join(FIELDS) + ', error '
+                                'FROM file_info WHERE path = ?',
+                                (to_db(os.path.abspath(path)),)).fetchone()
+        if row is None or row[0] != st.st_size or row[1] != get_mtime_ns(st) or row[2] != options:
+            return None
+        return (tuple(from_db(value) for value in row[3:-1]), row[-1])
+
+    def put(self, path, st, file_info, error, options=''):
+        '''Store the fields of a FileInfo, and any parse error, for a file parsed with options'''
+        values = [to_db(os.path.abspath(path)), st.st_size, get_mtime_ns(st)]
+        values.extend(to_db(getattr(file_info, field)) for field in FIELDS)
+        values.extend((error, options))
+        self.conn.execute('INSERT OR REPLACE INTO file_info VALUES (' + ', '.join('?' * len(values)) + ')', values)
+        self.pending += 1
+        if self.pending >= COMMIT_INTERVAL:
+            self.commit()
+
+    def get_audio_hash(self, path, st):
+        '''Get the cached (audio_start, audio_end, digest) for a file, or None if not cached or stale
+
+        digest is None if the file has not been hashed.
+        '''
+        row = self.conn.execute('SELECT size, mtime_ns, audio_start, audio_end, digest '
+                                'FROM audio_hash WHERE path = ?',
+                                (to_db(os.path.abspath(path)),)).fetchone()
+        if row is None or row[0] != st.st_size or row[1] != get_mtime_ns(st):
+            return None
+        return (row[2], row[3], row[4])
+
+    def put_audio_hash(self, path, st, span, digest):
+        '''Store the (start, end) span of the audio of a file, and its hash if known'''
+        self.conn.execute('INSERT OR REPLACE INTO audio_hash VALUES (?, ?, ?, ?, ?, ?)',
+                          (to_db(os.path.abspath(path)), st.st_size, get_mtime_ns(st), span[0], span[1], digest))
+        self.pending += 1
+        if self.pending >= COMMIT_INTERVAL:
+            self.commit()
+
+    def get_frame_index(self, path, st):
+        '''Get the cached (version, flags, entries) of the frame index of a file, or None if not cached or stale
+
+        entries is a list of (frame_type, frame_flags, offset, frame_size).
+        '''
+        row = self.conn.execute('SELECT size, mtime_ns, version, flags, entries '
+                                'FROM frame_index WHERE path = ?',
+                                (to_db(os.path.abspath(path)),)).fetchone()
+        if row is None or row[0] != st.st_size or row[1] != get_mtime_ns(st):
+            return None
+        packed = str(row[4])
+        entries = []
+        for offset in xrange(0, len(packed), frame_index_entry.size):
+            frame_type, frame_flags, frame_offset, frame_size = frame_index_entry.unpack_from(packed, offset)
+            entries.append((frame_type.rstrip('\x00'), frame_flags, frame_offset, frame_size))
+        return (row[2], row[3], entries)
+
+    def put_frame_index(self, path, st, version, flags, entries):
+        '''Store the frame index of a file, with the version and flags of its tag'''
+        packed = ''.join(frame_index_entry.pack(*entry) for entry in entries)
+        self.conn.execute('INSERT OR REPLACE INTO frame_index VALUES (?, ?, ?, ?, ?, ?)',
+                          (to_db(os.path.abspath(path)), st.st_size, get_mtime_ns(st), version, flags,
+                           sqlite3.Binary(packed)))
+        self.pending += 1
+        if self.pending >= COMMIT_INTERVAL:
+            self.commit()
+
+    def evict_missing(self, tree_top, seen_paths):
+        '''Remove entries for files under tree_top which are not in seen_paths'''
+        prefix = os.path.join(os.path.abspath(tree_top), '')
+        seen = set(os.path.abspath(path) for path in seen_paths)
+        missing = set()
+        for table in TABLES:
+            rows = self.conn.execute('SELECT path FROM ' + table + ' WHERE substr(path, 1, ?) = ?',
+                                     (len(prefix), to_db(prefix))).fetchall()
+            missing.update(from_db(row[0]) for row in rows if from_db(row[0]) not in seen)
+        for table in TABLES:
+            self.conn.executemany('DELETE FROM ' + table + ' WHERE path = ?', ((to_db(path),) for path in missing))
+        self.commit()
+        return len(missing)
+
+    def commit(self):
+        '''Commit stored entries to the database'''
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        '''Commit and close the database'''
+        self.commit()
+        self.conn.close()
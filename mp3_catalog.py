@@ -0,0 +1,497 @@
+# Copyright (c) 2013, pynewb
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice, this list
+#     of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice, this
+#     list of conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution.
+#   * Neither the name of pynewb nor the names of its contributors may be used to endorse
+#     or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''A SQLite catalog of the tags of a tree of MP3 files, for answering questions without rescanning
+
+A scan writes every parsed file, with its header, tag fields and parse
+errors, and every frame, with its type, size, flags and text value, to
+normalized tables.  Files whose size and modification time are unchanged
+since the last scan are not parsed again, and files no longer in the
+tree are removed.  The query subcommand then answers filters on the
+artist, album, title, frame types, attached pictures and errors from
+the indexes:
+
+    mp3_catalog.py scan music.db ~/Music
+    mp3_catalog.py query music.db --artist 'The Beatles' --no-art
+    mp3_catalog.py query music.db --missing-frame TRCK --group-by album
+'''
+
+from __future__ import print_function
+
+import argparse
+import os
+import os.path
+import sqlite3
+import sys
+import time
+
+import mp3_read_schedule
+import mp3_stats
+import mp3_walk
+import walk_mp3_full
+
+# Version of the catalog schema, to be increased when the tables or what is stored in them change
+SCHEMA_VERSION = 1
+
+# Number of files stored between commits
+COMMIT_INTERVAL = 1000
+
+# Fields of the decoded frames stored as the value of the frame, the first one present
+VALUE_FIELDS = ('frame_string', 'comment_string', 'lyrics_string', 'owner_string')
+
+# Columns of the files table filled from frames, and the frame types they are taken from, the first one present
+TEXT_COLUMNS = (
+    ('artist', ('TPE1', 'TPE2')),
+    ('album', ('TALB',)),
+    ('title', ('TIT2',)),
+    ('track', ('TRCK',)),
+)
+
+# Columns of the files table, after its id
+FILE_COLUMNS = ('path', 'size', 'mtime_ns', 'version', 'revision', 'flags', 'tag_size',
+                'artist', 'album', 'title', 'track', 'pictures', 'duration', 'bitrate')
+
+# Tables, with their indexes
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS files ('
+    'id INTEGER PRIMARY KEY, path BLOB UNIQUE NOT NULL, size INTEGER, mtime_ns INTEGER, '
+    'version INTEGER, revision INTEGER, flags INTEGER, tag_size INTEGER, '
+    'artist TEXT, album TEXT, title TEXT, track TEXT, pictures INTEGER, duration REAL, bitrate INTEGER)',
+    'CREATE TABLE IF NOT EXISTS frames ('
+    'file_id INTEGER NOT NULL REFERENCES files (id), frame_type TEXT NOT NULL, '
+    'frame_size INTEGER, frame_flags INTEGER, value TEXT)',
+    'CREATE TABLE IF NOT EXISTS errors ('
+    'file_id INTEGER NOT NULL REFERENCES files (id), message TEXT)',
+    'CREATE INDEX IF NOT EXISTS files_artist ON files (artist)',
+    'CREATE INDEX IF NOT EXISTS files_album ON files (album)',
+    'CREATE INDEX IF NOT EXISTS files_title ON files (title)',
+    'CREATE INDEX IF NOT EXISTS frames_file ON frames (file_id, frame_type)',
+    'CREATE INDEX IF NOT EXISTS frames_type ON frames (frame_type, value)',
+    'CREATE INDEX IF NOT EXISTS errors_file ON errors (file_id)',
+)
+
+def get_mtime_ns(st):
+    '''Get the modification time of a stat result in nanoseconds'''
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(st.st_mtime * 1000000000)
+    return mtime_ns
+
+def to_db(path):
+    '''Convert a path for storage, keeping byte strings as blobs'''
+    if isinstance(path, str):
+        return sqlite3.Binary(path)
+    return path
+
+def from_db(path):
+    '''Convert a stored path back, restoring byte strings from blobs'''
+    if isinstance(path, buffer):
+        return str(path)
+    return path
+
+def to_text(value):
+    '''Convert a parsed string to unicode, decoding ISO-8859-1 byte strings, without nul characters'''
+    if isinstance(value, str):
+        value = value.decode('latin-1')
+    if isinstance(value, unicode):
+        value = value.rstrip(u'\0')
+    return value
+
+def to_output(value):
+    '''Convert a value for printing, encoding unicode as UTF-8'''
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+class FileRecord(object):
+    '''What is catalogued about a file'''
+
+    __slots__ = ('path', 'st', 'version', 'revision', 'flags', 'tag_size', 'frames', 'errors', 'duration', 'bitrate')
+
+    def __init__(self, path, st):
+        '''Initialize members to be populated'''
+        self.path = path
+        self.st = st
+        self.version = None
+        self.revision = None
+        self.flags = None
+        self.tag_size = None
+        # (frame_type, frame_size, frame_flags, value) of each frame
+        self.frames = []
+        self.errors = []
+        self.duration = None
+        self.bitrate = None
+
+    def get_text(self, frame_types):
+        '''Get the value of the first frame of the first of frame_types the file has, or None'''
+        for frame_type in frame_types:
+            for frame in self.frames:
+                if frame[0] == frame_type and frame[3]:
+                    return frame[3]
+        return None
+
+    def get_row(self):
+        '''Get the values of the files table columns, in the order of FILE_COLUMNS'''
+        row = [to_db(os.path.abspath(self.path)), self.st.st_size, get_mtime_ns(self.st),
+               self.version, self.revision, self.flags, self.tag_size]
+        row.extend(self.get_text(frame_types) for column, frame_types in TEXT_COLUMNS)
+        row.append(sum(1 for frame in self.frames if frame[0] == 'APIC'))
+        row.extend((self.duration, self.bitrate))
+        return row
+
+class Catalog(object):
+    '''A SQLite catalog of parsed MP3 files
+
+    Files are stored by absolute path, replacing what was stored for the
+    path before.  Stores are committed every commit_interval files, in
+    one transaction.  A catalog with an older schema is emptied.
+    '''
+
+    def __init__(self, db_path, commit_interval=COMMIT_INTERVAL):
+        '''Open or create the catalog database'''
+        self.conn = sqlite3.connect(db_path)
+        self.conn.text_factory = unicode
+        if self.conn.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            self.conn.execute('DROP TABLE IF EXISTS errors')
+            self.conn.execute('DROP TABLE IF EXISTS frames')
+            self.conn.execute('DROP TABLE IF EXISTS files')
+            self.conn.execute('PRAGMA user_version = {0:d}'.format(SCHEMA_VERSION))
+        for statement in SCHEMA:
+            self.conn.execute(statement)
+        self.commit_interval = commit_interval
+        self.pending = 0
+
+    def is_current(self, path, st):
+        '''Get whether a file is stored with its current size and modification time'''
+        row = self.conn.execute('SELECT size, mtime_ns FROM files WHERE path = ?',
+                                (to_db(os.path.abspath(path)),)).fetchone()
+        return row is not None and row[0] == st.st_size and row[1] == get_mtime_ns(st)
+
+    def __delete(self, paths):
+        '''Remove the stored files with paths, which are as stored'''
+        for path in paths:
+            row = self.conn.execute('SELECT id FROM files WHERE path = ?', (path,)).fetchone()
+            if row is not None:
+                self.conn.execute('DELETE FROM frames WHERE file_id = ?', row)
+                self.conn.execute('DELETE FROM errors WHERE file_id = ?', row)
+                self.conn.execute('DELETE FROM files WHERE id = ?', row)
+
+    def put(self, record):
+        '''Store a FileRecord, with its frames and errors'''
+        row = record.get_row()
+        self.__delete((row[0],))
+        cursor = self.conn.execute('INSERT INTO files (' + ', '.join(FILE_COLUMNS) + ') VALUES ('
+                                   + ', '.join('?' * len(row)) + ')', row)
+        file_id = cursor.lastrowid
+        self.conn.executemany('INSERT INTO frames VALUES (?, ?, ?, ?, ?)',
+                              ((file_id,) + frame for frame in record.frames))
+        self.conn.executemany('INSERT INTO errors VALUES (?, ?)',
+                              ((file_id, message) for message in record.errors))
+        self.pending += 1
+        if self.pending >= self.commit_interval:
+            self.commit()
+
+    def evict_missing(self, tree_top, seen_paths):
+        '''Remove the files under tree_top which are not in seen_paths'''
+        prefix = os.path.join(os.path.abspath(tree_top), '')
+        seen = set(os.path.abspath(path) for path in seen_paths)
+        rows = self.conn.execute('SELECT path FROM files WHERE substr(path, 1, ?) = ?',
+                                 (len(prefix), to_db(prefix))).fetchall()
+        missing = [row[0] for row in rows if from_db(row[0]) not in seen]
+        self.__delete(missing)
+        self.commit()
+        return len(missing)
+
+    def commit(self):
+        '''Commit stored files to the database'''
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        '''Commit and close the database'''
+        self.commit()
+        self.conn.close()
+
+class CatalogWriter(object):
+    '''A handler for the ID3v2 file parser that stores each file in a Catalog
+
+    Each file is stored when the next one starts; call close() after the
+    last file to store it.  If audio is set, the duration and average
+    bitrate of the MPEG audio are stored too.
+    '''
+
+    def __init__(self, catalog, audio=False):
+        self.catalog = catalog
+        self.record = None
+        self.frame_header = (None, None)
+        self.count = 0
+        if not audio:
+            # So the parser does not analyze the audio
+            self.on_mpeg_audio = None
+
+    def flush(self):
+        '''Store the previous file'''
+        if self.record is not None:
+            self.catalog.put(self.record)
+            self.count += 1
+        self.record = None
+
+    def close(self):
+        '''Store the last file and commit'''
+        self.flush()
+        self.catalog.commit()
+
+    def on_error(self, msg):
+        self.record.errors.append(msg)
+
+    def on_id3v2_header(self, version, revision, flags, size):
+        self.record.version = version
+        self.record.revision = revision
+        self.record.flags = flags
+        self.record.tag_size = size
+
+    def on_id3v2dot3_frame_header(self, frame_type, frame_size, frame_flags):
+        self.frame_header = (frame_size, frame_flags)
+
+    def on_id3v2dot3_frame(self, frame_type, frame_dict):
+        value = None
+        for field in VALUE_FIELDS:
+            if field in frame_dict:
+                value = to_text(frame_dict[field])
+                break
+        frame_size, frame_flags = self.frame_header
+        # The frames of ID3v1 tags have no header
+        self.frame_header = (None, None)
+        self.record.frames.append((frame_type, frame_size, frame_flags, value))
+
+    def on_mpeg_audio(self, audio_dict):
+        self.record.duration = audio_dict['duration']
+        self.record.bitrate = audio_dict['average_bitrate']
+
+    def on_path(self, path):
+        self.flush()
+        self.record = FileRecord(path, os.stat(path))
+
+def scan(catalog, tree_top, extensions=mp3_walk.DEFAULT_EXTENSIONS, full=False, audio=False, jobs=1,
+         parser_options=None, concurrency=0, timeout=None, scheduler=None):
+    '''Catalog the files in a tree with any of the extensions, returning the number of files parsed
+
+    Files stored with their current size and modification time are
+    skipped unless full is set, and files under tree_top which are no
+    longer in the tree are removed.  The files are parsed as by
+    walk_mp3_full.parse_mp3_files, in the order of a
+    mp3_read_schedule.ReadScheduler if given.
+    '''
+    seen_paths = []
+    changed = []
+    for entry in mp3_walk.walk_entries(tree_top, extensions):
+        seen_paths.append(entry.path)
+        if full or not catalog.is_current(entry.path, os.stat(entry.path)):
+            changed.append(entry)
+    catalog.evict_missing(tree_top, seen_paths)
+
+    if scheduler is not None:
+        paths = scheduler.schedule(changed)
+    else:
+        paths = (entry.path for entry in changed)
+
+    writer = CatalogWriter(catalog, audio)
+    walk_mp3_full.parse_mp3_files(paths, False, writer, jobs, False, parser_options, concurrency, timeout)
+    writer.close()
+    return writer.count
+
+# Characters which are wildcards in GLOB patterns
+GLOB_WILDCARDS = '*?['
+
+def get_condition(column, value):
+    '''Get the (condition, params) of a column matching a filter value, which may have GLOB wildcards
+
+    A pattern with a literal prefix is also bounded by the range of values
+    with that prefix, so an index on the column is searched rather than scanned.
+    '''
+    value = value.decode(sys.getfilesystemencoding() or 'utf-8')
+    wildcards = [value.index(ch) for ch in GLOB_WILDCARDS if ch in value]
+    if not wildcards:
+        return ('{0} = ?'.format(column), [value])
+    prefix = value[:min(wildcards)]
+    if not prefix:
+        return ('{0} GLOB ?'.format(column), [value])
+    upper = prefix[:-1] + unichr(ord(prefix[-1]) + 1)
+    return ('{0} >= ? AND {0} < ? AND {0} GLOB ?'.format(column), [prefix, upper, value])
+
+def build_query(args):
+    '''Build the (conditions, params) of the files matching the filters of the query subcommand'''
+    conditions = []
+    params = []
+    for column in ('artist', 'album', 'title', 'track'):
+        value = getattr(args, column)
+        if value is not None:
+            condition, condition_params = get_condition('files.' + column, value)
+            conditions.append(condition)
+            params.extend(condition_params)
+    for frame_type in args.frame_types:
+        conditions.append('files.id IN (SELECT file_id FROM frames WHERE frame_type = ?)')
+        params.append(frame_type)
+    for frame_type in args.missing_frame_types:
+        conditions.append('files.id NOT IN (SELECT file_id FROM frames WHERE frame_type = ?)')
+        params.append(frame_type)
+    for frame in args.frames:
+        frame_type, sep, value = frame.partition('=')
+        condition, condition_params = get_condition('value', value)
+        conditions.append('files.id IN (SELECT file_id FROM frames WHERE frame_type = ? AND ' + condition + ')')
+        params.append(frame_type)
+        params.extend(condition_params)
+    if args.art is not None:
+        conditions.append('files.pictures > 0' if args.art else 'files.pictures = 0')
+    if args.version is not None:
+        conditions.append('files.version = ?')
+        params.append(args.version)
+    if args.errors:
+        conditions.append('files.id IN (SELECT file_id FROM errors)')
+    if args.under is not None:
+        prefix = os.path.join(os.path.abspath(os.path.expanduser(args.under)), '')
+        conditions.append('substr(files.path, 1, ?) = ?')
+        params.extend((len(prefix), to_db(prefix)))
+    return (conditions, params)
+
+def query(catalog, args, out=None):
+    '''Print the files, or groups of files, matching the filters of the query subcommand'''
+    if out is None:
+        out = sys.stdout
+    conditions, params = build_query(args)
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+    if args.group_by == 'artist':
+        sql = 'SELECT artist, COUNT(*) FROM files' + where + ' GROUP BY artist ORDER BY artist'
+    elif args.group_by == 'album':
+        sql = 'SELECT artist, album, COUNT(*) FROM files' + where + ' GROUP BY artist, album ORDER BY artist, album'
+    elif args.count:
+        sql = 'SELECT COUNT(*) FROM files' + where
+    elif args.long:
+        sql = 'SELECT path, artist, album, track, title FROM files' + where + ' ORDER BY path'
+    else:
+        sql = 'SELECT path FROM files' + where + ' ORDER BY path'
+    if args.explain:
+        for row in catalog.conn.execute('EXPLAIN QUERY PLAN ' + sql, params):
+            print(*row, file=sys.stderr)
+    for row in catalog.conn.execute(sql, params):
+        print('\t'.join(to_output(from_db(value)) for value in row), file=out)
+
+def main():
+    parser = argparse.ArgumentParser(description='Catalog the tags of MP3 files in SQLite, and query the catalog')
+    subparsers = parser.add_subparsers(dest='command')
+
+    scan_parser = subparsers.add_parser('scan', help='Catalog the files in directory trees')
+    scan_parser.add_argument('catalog', help='Path of the SQLite catalog, created if need be')
+    scan_parser.add_argument('directories', metavar='directory', nargs='+', help='The directories to traverse')
+    workers = scan_parser.add_mutually_exclusive_group()
+    workers.add_argument('--jobs', type=int, default=1,
+                         help='Number of worker processes parsing files (0 is one per CPU, default is 1)')
+    workers.add_argument('--concurrency', type=int, default=0,
+                         help='Number of files to parse at once in threads, for network filesystems')
+    scan_parser.add_argument('--timeout', type=float,
+                             help='Seconds after which to skip a file when parsing with --concurrency')
+    scan_parser.add_argument('--extensions', default='mp3',
+                             help='Comma-separated extensions of the files to catalog, in any case (default is mp3)')
+    scan_parser.add_argument('--order', choices=mp3_read_schedule.ORDERS, default='walk',
+                             help='Read files in walk order (the default), or sorted by inode or disk extent, for spinning disks')
+    scan_parser.add_argument('--window', type=int, default=mp3_read_schedule.DEFAULT_WINDOW,
+                             help='Number of files sorted together with --order (default is %(default)s)')
+    scan_parser.add_argument('--whole-tag', action='store_true',
+                             help='Read each tag with a single read rather than frame by frame')
+    scan_parser.add_argument('--id3v1', choices=('never', 'fallback', 'always'), default='fallback',
+                             help='Read ID3v1 tags of files with no ID3v2 tag (the default), of all files, or never')
+    scan_parser.add_argument('--audio', action='store_true',
+                             help='Analyze the MPEG audio for its duration and bitrate')
+    scan_parser.add_argument('--full', action='store_true',
+                             help='Parse every file, not only those changed since the last scan')
+    scan_parser.add_argument('--batch', type=int, default=COMMIT_INTERVAL,
+                             help='Number of files stored in each transaction (default is %(default)s)')
+    scan_parser.add_argument('--stats', action='store_true',
+                             help='Print parser counters, byte accounting and timings to stderr at the end')
+
+    query_parser = subparsers.add_parser('query', help='List the catalogued files matching filters, all of them')
+    query_parser.add_argument('catalog', help='Path of the SQLite catalog')
+    query_parser.add_argument('--artist', help='Artist (TPE1, or else TPE2), which may have * and ? wildcards')
+    query_parser.add_argument('--album', help='Album, which may have * and ? wildcards')
+    query_parser.add_argument('--title', help='Title, which may have * and ? wildcards')
+    query_parser.add_argument('--track', help='Track number, which may have * and ? wildcards')
+    query_parser.add_argument('--frame-type', dest='frame_types', action='append', default=[], metavar='TYPE',
+                              help='Frame type the files have, such as COMM; may be repeated')
+    query_parser.add_argument('--missing-frame', dest='missing_frame_types', action='append', default=[],
+                              metavar='TYPE', help='Frame type the files do not have, such as TRCK; may be repeated')
+    query_parser.add_argument('--frame', dest='frames', action='append', default=[], metavar='TYPE=VALUE',
+                              help='Frame the files have with a value, which may have * and ? wildcards; may be repeated')
+    art = query_parser.add_mutually_exclusive_group()
+    art.add_argument('--art', dest='art', action='store_const', const=True,
+                     help='Files with attached pictures')
+    art.add_argument('--no-art', dest='art', action='store_const', const=False,
+                     help='Files without attached pictures')
+    query_parser.add_argument('--version', type=int, help='ID3v2 major version of the tags of the files')
+    query_parser.add_argument('--errors', action='store_true', help='Files with parse errors')
+    query_parser.add_argument('--under', metavar='DIRECTORY', help='Files under a directory')
+    output = query_parser.add_mutually_exclusive_group()
+    output.add_argument('--long', action='store_true',
+                        help='Print the artist, album, track and title after each path, tab-separated')
+    output.add_argument('--count', action='store_true', help='Print the number of files')
+    output.add_argument('--group-by', choices=('artist', 'album'),
+                        help='Print each artist, or artist and album, with its number of files')
+    query_parser.add_argument('--explain', action='store_true',
+                              help='Print the query plan and the time taken to stderr')
+    args = parser.parse_args()
+
+    start = time.time()
+    if args.command == 'scan':
+        catalog = Catalog(os.path.expanduser(args.catalog), args.batch)
+        parser_options = {'whole_tag': args.whole_tag, 'id3v1': None if args.id3v1 == 'never' else args.id3v1}
+        if args.stats:
+            parser_options['stats'] = mp3_stats.ParserStats()
+        scheduler = None
+        if args.order != 'walk':
+            scheduler = mp3_read_schedule.ReadScheduler(args.order, args.window)
+        for directory in args.directories:
+            directory = os.path.expanduser(directory)
+            if not os.path.isdir(directory):
+                print(directory + ' is not a directory', file=sys.stderr)
+                continue
+            count = scan(catalog, directory, args.extensions.split(','), args.full, args.audio, args.jobs,
+                         parser_options, args.concurrency, args.timeout, scheduler)
+            print(directory, ':', count, 'files catalogued', file=sys.stderr)
+        catalog.close()
+        if args.stats:
+            parser_options['stats'].print_summary(time.time() - start)
+    else:
+        if not os.path.exists(os.path.expanduser(args.catalog)):
+            print(args.catalog, ': no such catalog', file=sys.stderr)
+            sys.exit(1)
+        catalog = Catalog(os.path.expanduser(args.catalog))
+        query(catalog, args)
+        catalog.close()
+        if args.explain:
+            print('{0:.1f} ms'.format((time.time() - start) * 1000), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -1,182 +1,560 @@
-#!/usr/bin/env python
-#
-# Copyright (c) 2013, pynewb
-# All rights reserved.
-#
-# Redistribution and use in source and binary forms, with or without modification, are
-# permitted provided that the following conditions are met:
-#
-#   * Redistributions of source code must retain the above copyright notice, this list
-#     of conditions and the following disclaimer.
-#   * Redistributions in binary form must reproduce the above copyright notice, this
-#     list of conditions and the following disclaimer in the documentation and/or
-#     other materials provided with the distribution.
-#   * Neither the name of pynewb nor the names of its contributors may be used to endorse
-#     or promote products derived from this software without
-#     specific prior written permission.
-#
-# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
-# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
-# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
-# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
-# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
-# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
-# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
-# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
-# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
-
-from __future__ import print_function
-
-import argparse
-import os
-import re
-import sys
-
-import mp3_event_parser
-
-#top = "c:\\users\\snichol\\music\\itunes\\itunes media\\music"
-pattern = re.compile('.*\.(mp3)$', re.IGNORECASE)
-
-class FileInfo(object):
-    '''Identifying information about an MP3 file'''
-    
-    def __init__(self):
-        '''Initialize members to be populated'''
-        self.path = None
-        self.talb = ''
-        self.tit2 = ''
-        self.tpe1 = ''
-        self.tpe2 = ''
-        self.trck = ''
-
-    def get_key(self):
-        '''Get a key which should uniquely identify the file contents'''
-        return '|'.join((self.tpe1, self.tpe2, self.talb, self.trck, self.tit2))
-        
-    def get_artist_album_track(self):
-        '''Get the artist/album/track'''
-        return '|'.join((self.tpe1 or self.tpe2, self.talb, self.tit2))
-        
-    def get_artist_album_trknum(self):
-        '''Get the artist/album/trknum'''
-        m = re.match('^(\d+)', self.trck)
-        if m:
-            trknum = m.group(1)
-        else:
-            trknum = self.trck
-        return '|'.join((self.tpe1 or self.tpe2, self.talb, trknum, self.tit2))
-        
-    def __str__(self):
-        '''String representation of this instance'''
-        return 'key: {0} path: {1}'.format(self.get_key(), self.path)
-
-class FileInfoBuilder(object):
-    '''A handler for the ID3v2 file parser that builds a FileInfo'''
-
-    def __init__(self):
-        '''Initialize members'''
-        self.error = None
-        self.file_info = FileInfo()
-
-    def get_error(self):
-        return self.error
-
-    def get_file_info(self):
-        '''Get the FileInfo parsed from the file'''
-        return self.file_info
-
-    def on_error(self, msg):
-        self.error = msg
-
-    def on_id3v2dot3_frame(self, frame_type, frame_dict):
-        '''Handle a parsed frame'''
-        if frame_type == 'TALB':
-            self.file_info.talb = frame_dict['frame_string']
-        elif frame_type == 'TIT2':
-            self.file_info.tit2 = frame_dict['frame_string']
-        elif frame_type == 'TPE1':
-            self.file_info.tpe1 = frame_dict['frame_string']
-        elif frame_type == 'TPE2':
-            self.file_info.tpe2 = frame_dict['frame_string']
-        elif frame_type == 'TRCK':
-            self.file_info.trck = frame_dict['frame_string']
-
-    def on_path(self, path):
-        '''Handle a file path'''
-        self.file_info.path = path
-
-def find_in_tree(tree_top, match_pattern):
-    '''Find all files in a tree matching a pattern, returning a FileInfo for each'''
-    parser = mp3_event_parser.ID3v2Parser()
-    for root, dirnames, filenames in os.walk(tree_top):
-        for filename in filter(lambda name:match_pattern.match(name), filenames):
-            handler = FileInfoBuilder()
-            parser.parse_id3v2_file(os.path.join(root, filename), False, handler)
-            if not handler.get_error():
-                yield handler.get_file_info()
-
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser()
-    parser.add_argument("source_dir", help="Source directory root for comparison")
-    parser.add_argument("compare_dir", help="Directory root to which to compare")
-    args = parser.parse_args()
-
-    print('Collecting data from source directory tree', file=sys.stderr)
-    source_file_infos = {}
-    for file_info in find_in_tree(args.source_dir, pattern):
-        source_file_infos[file_info.get_key()] = file_info
-        if (len(source_file_infos) % 10) == 0:
-            print(len(source_file_infos), end='\r', file=sys.stderr)
-
-    print(len(source_file_infos), file=sys.stderr)
-
-    print('Collecting data from compare directory tree', file=sys.stderr)
-    compare_file_infos = {}
-    compare_file_infos_by_aan = {}
-    compare_file_infos_by_aat = {}
-    for file_info in find_in_tree(args.compare_dir, pattern):
-        compare_file_infos[file_info.get_key()] = file_info
-        artist_album_trknum = file_info.get_artist_album_trknum()
-        artist_album_track = file_info.get_artist_album_track()
-        if artist_album_trknum not in compare_file_infos_by_aan:
-            compare_file_infos_by_aan[artist_album_trknum] = file_info
-        else:
-            print('Artist/album/trknum {0} for {1} already exists for {2}'.format(artist_album_trknum, file_info.path, compare_file_infos_by_aan[artist_album_trknum].path), file=sys.stderr)
-        if artist_album_track not in compare_file_infos_by_aat:
-            compare_file_infos_by_aat[artist_album_track] = file_info
-        else:
-            pass
-#            print('Artist/album/track {0} for {1} already exists for {2}'.format(artist_album_track, file_info.path, compare_file_infos_by_aat[artist_album_track].path), file=sys.stderr)
-
-        if (len(compare_file_infos) % 10) == 0:
-            print(len(compare_file_infos), end='\r', file=sys.stderr)
-
-    print(len(compare_file_infos), file=sys.stderr)
-
-    for key in source_file_infos.keys():
-        source_info = source_file_infos[key]
-        artist_album_trknum = source_info.get_artist_album_trknum()
-        artist_album_track = source_info.get_artist_album_track()
-        if key in compare_file_infos:
-            compare_info = compare_file_infos[key]
-            # this is a most righteous match
-#            print('{0} is the same as {1}'.format(source_info.path, compare_info.path))
-        elif artist_album_trknum in compare_file_infos_by_aan:
-            compare_info = compare_file_infos_by_aan[artist_album_trknum]
-            # this is a righteous match
-#            print('{0} is the same artist/album/trknum as {1}'.format(source_info.path, compare_info.path))
-        elif artist_album_track in compare_file_infos_by_aat:
-            compare_info = compare_file_infos_by_aat[artist_album_track]
-            # this is a dubious match because of possible multiples
-            print('{0} is the same artist/album/track as {1}'.format(source_info.path, compare_info.path))
-        else:
-            print('{0} has no corresponding key {1} or artist/album/track {2} in compare'.format(source_info.path, key, artist_album_track))
-
-    print('Source keys')
-    for key in sorted(map(lambda s: repr(s), source_file_infos.keys())):
-        print(key)
-    
-    print('Compare keys')
-    for key in sorted(map(lambda s: repr(s), compare_file_infos.keys())):
-        print(key)
-    
+#!/usr/bin/env python
+#
+# Copyright (c) 2013, pynewb
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice, this list
+#     of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice, this
+#     list of conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution.
+#   * Neither the name of pynewb nor the names of its contributors may be used to endorse
+#     or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import print_function
+
+import argparse
+import itertools
+import os
+import re
+import sys
+import time
+
+import mp3_cache
+import mp3_concurrent_scan
+import mp3_content_hash
+import mp3_event_parser
+import mp3_external_sort
+import mp3_match
+import mp3_parallel
+import mp3_read_schedule
+import mp3_stats
+import mp3_walk
+
+# Records kept in memory across the sorts of compare_external, by default
+DEFAULT_SORT_RECORDS = 400000
+
+# Sorts holding records in memory at once in compare_external, which share its records
+EXTERNAL_SORTS = 6
+
+#top = "c:\\users\\snichol\\music\\itunes\\itunes media\\music"
+
+def to_text(value):
+    '''Convert an ISO-8859-1 byte string which is not ASCII to unicode, so it can be joined with unicode'''
+    if isinstance(value, str):
+        try:
+            value.decode('ascii')
+        except UnicodeDecodeError:
+            return value.decode('latin-1')
+    return value
+
+# Tag values which repeat across files, such as artists and albums, by type and value
+shared_values = {}
+
+# FileInfo fields whose values repeat across files
+SHARED_FIELDS = frozenset(('talb', 'tpe1', 'tpe2', 'trck'))
+
+def share(value):
+    '''Get the one copy of a tag value kept for all of the files with that value'''
+    # Equal byte strings and unicode are kept apart, so each file keeps the type it was given
+    return shared_values.setdefault((type(value), value), value)
+
+class FileInfo(object):
+    '''Identifying information about an MP3 file'''
+
+    __slots__ = ('path', 'talb', 'tit2', 'tpe1', 'tpe2', 'trck', 'duration', 'bitrate')
+
+    def __init__(self):
+        '''Initialize members to be populated'''
+        self.path = None
+        self.talb = ''
+        self.tit2 = ''
+        self.tpe1 = ''
+        self.tpe2 = ''
+        self.trck = ''
+        self.duration = None
+        self.bitrate = None
+
+    def get_key(self):
+        '''Get a key which should uniquely identify the file contents'''
+        return '|'.join((self.tpe1, self.tpe2, self.talb, self.trck, self.tit2))
+        
+    def get_artist_album_track(self):
+        '''Get the artist/album/track'''
+        return '|'.join((self.tpe1 or self.tpe2, self.talb, self.tit2))
+        
+    def get_artist_album_trknum(self):
+        '''Get the artist/album/trknum'''
+        m = re.match('^(\d+)', self.trck)
+        if m:
+            trknum = m.group(1)
+        else:
+            trknum = self.trck
+        return '|'.join((self.tpe1 or self.tpe2, self.talb, trknum, self.tit2))
+        
+    def __str__(self):
+        '''String representation of this instance'''
+        return 'key: {0} path: {1}'.format(self.get_key(), self.path)
+
+class FileInfoBuilder(object):
+    '''A handler for the ID3v2 file parser that builds a FileInfo'''
+
+    # The frame types used to build a FileInfo
+    frame_types = ('TALB', 'TIT2', 'TPE1', 'TPE2', 'TRCK')
+
+    def __init__(self, audio=False):
+        '''Initialize members
+
+        The duration and bitrate are only parsed from the audio if audio is set.
+        '''
+        self.error = None
+        self.file_info = FileInfo()
+        if not audio:
+            # So the parser does not analyze the audio
+            self.on_mpeg_audio = None
+
+    def get_error(self):
+        return self.error
+
+    def get_file_info(self):
+        '''Get the FileInfo parsed from the file'''
+        return self.file_info
+
+    def on_error(self, msg):
+        self.error = msg
+
+    def on_id3v2dot3_frame(self, frame_type, frame_dict):
+        '''Handle a parsed frame'''
+        if frame_type == 'TALB':
+            self.file_info.talb = share(to_text(frame_dict['frame_string']))
+        elif frame_type == 'TIT2':
+            self.file_info.tit2 = to_text(frame_dict['frame_string'])
+        elif frame_type == 'TPE1':
+            self.file_info.tpe1 = share(to_text(frame_dict['frame_string']))
+        elif frame_type == 'TPE2':
+            self.file_info.tpe2 = share(to_text(frame_dict['frame_string']))
+        elif frame_type == 'TRCK':
+            self.file_info.trck = share(to_text(frame_dict['frame_string']))
+
+    def on_mpeg_audio(self, audio_dict):
+        '''Handle the properties of the audio'''
+        self.file_info.duration = audio_dict['duration']
+        self.file_info.bitrate = audio_dict['average_bitrate']
+
+    def on_path(self, path):
+        '''Handle a file path'''
+        self.file_info.path = path
+
+def get_match_tiers(audio_tier):
+    '''Get the tiers for matching source files to compare files, from exact tag keys to fuzzy matches
+
+    audio_tier is a PathTier of files matched by their audio.
+    '''
+    return [mp3_match.KeyTier('key', lambda file_info, keys: file_info.get_key()),
+            mp3_match.KeyTier('artist/album/trknum', lambda file_info, keys: file_info.get_artist_album_trknum()),
+            # this is a dubious match because of possible multiples
+            mp3_match.KeyTier('artist/album/track', lambda file_info, keys: file_info.get_artist_album_track(),
+                              '{0} is the same artist/album/track as {1}'),
+            audio_tier] + mp3_match.get_normalized_tiers()
+
+def parse_files(paths, jobs=1, ordered=False, parser_options=None, concurrency=0, timeout=None, audio=False):
+    '''Parse files, yielding a tuple of (path, FileInfo, error) for each
+
+    If jobs is other than 1, the files are parsed by a pool of that many
+    worker processes (0 meaning one per CPU), in path order if ordered is set.
+    Parsers are created with the keyword arguments in parser_options, and
+    only parse the frame types used by FileInfoBuilder, falling back to
+    ID3v1 tags for files with no ID3v2 tag, unless otherwise set.  The
+    audio is only analyzed for its duration and bitrate if audio is set.
+
+    If concurrency is set, the files are instead parsed by that many
+    threads, and a file taking more than timeout seconds is yielded with
+    a FileInfo of None.
+    '''
+    parser_options = dict(parser_options or {})
+    parser_options.setdefault('frame_types', FileInfoBuilder.frame_types)
+    parser_options.setdefault('id3v1', 'fallback')
+
+    if concurrency:
+        event_names = mp3_parallel.get_handler_events(FileInfoBuilder(audio))
+        scanner = mp3_concurrent_scan.ConcurrentScanner(False, event_names, concurrency, timeout, parser_options)
+        for path, events in scanner.scan(paths):
+            if events is None:
+                yield (path, None, 'Timed out')
+                continue
+            handler = FileInfoBuilder(audio)
+            mp3_parallel.replay_events(events, handler)
+            yield (path, handler.get_file_info(), handler.get_error())
+        return
+
+    if jobs != 1:
+        event_names = mp3_parallel.get_handler_events(FileInfoBuilder(audio))
+        for path, events in mp3_parallel.parse_files(paths, False, event_names, jobs,
+                                                         ordered=ordered, parser_options=parser_options):
+            handler = FileInfoBuilder(audio)
+            mp3_parallel.replay_events(events, handler)
+            yield (path, handler.get_file_info(), handler.get_error())
+        return
+
+    parser = mp3_event_parser.ID3v2Parser(**parser_options)
+    for path in paths:
+        handler = FileInfoBuilder(audio)
+        parser.parse_id3v2_file(path, False, handler)
+        yield (path, handler.get_file_info(), handler.get_error())
+
+def get_cache_options(parser_options=None, audio=False):
+    '''Get a string of the options of parse_files which affect a FileInfo, under which it is cached'''
+    parser_options = parser_options or {}
+    frame_types = parser_options.get('frame_types', FileInfoBuilder.frame_types)
+    return 'frame_types={0} id3v1={1} audio={2:d}'.format(','.join(sorted(frame_types or ())),
+                                                          parser_options.get('id3v1', 'fallback'), bool(audio))
+
+def find_in_tree(tree_top, extensions=mp3_walk.DEFAULT_EXTENSIONS, jobs=1, ordered=False, cache=None, parser_options=None,
+                 concurrency=0, timeout=None, scheduler=None, audio=False):
+    '''Find all files in a tree with any of the extensions, returning a FileInfo for each
+
+    If jobs is other than 1, the files are parsed by a pool of that many
+    worker processes (0 meaning one per CPU), in walk order if ordered is set.
+
+    If a FileInfoCache is given, unchanged files cached with the same
+    options (see get_cache_options) are served from it without being
+    opened, and only new or changed files are parsed (after all of
+    the cached files have been returned).  Cache entries for files no
+    longer in the tree are evicted.
+
+    Parsers are created with the keyword arguments in parser_options.
+
+    If concurrency is set, the files are instead parsed by that many
+    threads, and files taking more than timeout seconds are skipped
+    (and not cached).
+
+    If a mp3_read_schedule.ReadScheduler is given, the files are parsed in
+    its order.  The audio is analyzed as by parse_files if audio is set.
+    '''
+    entries = mp3_walk.walk_entries(tree_top, extensions)
+
+    if cache is not None:
+        cache_options = get_cache_options(parser_options, audio)
+        seen_paths = []
+        stats = {}
+        uncached = []
+        for entry in entries:
+            path = entry.path
+            seen_paths.append(path)
+            st = os.stat(path)
+            cached = cache.get(path, st, cache_options)
+            if cached is None:
+                stats[path] = st
+                uncached.append(entry)
+                continue
+            values, error = cached
+            if not error:
+                file_info = FileInfo()
+                file_info.path = path
+                for field, value in zip(mp3_cache.FIELDS, values):
+                    setattr(file_info, field, share(value) if field in SHARED_FIELDS else value)
+                yield file_info
+        cache.evict_missing(tree_top, seen_paths)
+        entries = uncached
+
+    if scheduler is not None:
+        paths = scheduler.schedule(entries)
+    else:
+        paths = (entry.path for entry in entries)
+
+    for path, file_info, error in parse_files(paths, jobs, ordered, parser_options, concurrency, timeout, audio):
+        if cache is not None and file_info is not None:
+            cache.put(path, stats[path], file_info, error, cache_options)
+        if not error:
+            yield file_info
+
+    if cache is not None:
+        cache.commit()
+
+def get_external_tiers():
+    '''Get the tiers of get_match_tiers which match on equal keys, as used by compare_external'''
+    return [tier for tier in get_match_tiers(None) if isinstance(tier, mp3_match.KeyTier)]
+
+def first_per_key(records, tier):
+    '''Yield the first (key, path) of each key in compare records sorted by (key, seq, path)
+
+    Later files with the same artist/album/trknum are reported, as main reports them.
+    '''
+    for key, group in itertools.groupby(records, lambda record: record[0]):
+        first_path = next(group)[2]
+        if key is None:
+            continue
+        if tier.name == 'artist/album/trknum':
+            for record in group:
+                print('Artist/album/trknum {0} for {1} already exists for {2}'.format(key, record[2], first_path), file=sys.stderr)
+        yield (key, first_path)
+
+def join_tier(sources, compares, tier):
+    '''Merge-join source records sorted by their key in a tier with the first compare (key, path) of each key
+
+    sources are (key, seq, path, tier keys) records, and compares are
+    (key, path) in key order.  Yields (source record, compare path), with a
+    compare path of None for source records with no match in the tier.
+    '''
+    compares = iter(compares)
+    current = next(compares, None)
+    for record in sources:
+        key = record[0]
+        if key is not None:
+            while current is not None and current[0] < key:
+                current = next(compares, None)
+            if current is not None and current[0] == key:
+                yield (record, current[1])
+                continue
+        yield (record, None)
+    # Read the remaining compare records for their reports
+    for current in compares:
+        pass
+
+def compare_external(source_file_infos, compare_file_infos, sort_records=DEFAULT_SORT_RECORDS, temp_dir=None, out=None):
+    '''Compare the FileInfos of two trees as main does, with memory bounded by sort_records
+
+    Rather than holding the trees in dicts, (key, path) records are sorted
+    through run files in temp_dir, and the source files are merge-joined with
+    the compare files tier by tier, for the tiers of get_external_tiers.  The
+    source files are reported in key order, and the source and compare keys
+    are listed in order without sorting them in memory.
+    '''
+    if out is None:
+        out = sys.stdout
+    tiers = get_external_tiers()
+    track_tier = [tier.name for tier in tiers].index('artist/album/track')
+    normalized = {}
+    buffer_records = max(sort_records // EXTERNAL_SORTS, 1)
+
+    def get_tier_keys(file_info):
+        keys = mp3_match.MatchKeys(file_info, normalized)
+        return tuple(tier.get_key(file_info, keys) for tier in tiers)
+
+    def new_sorter():
+        return mp3_external_sort.ExternalSorter(buffer_records, temp_dir)
+
+    sorters = []
+    try:
+        print('Collecting data from source directory tree', file=sys.stderr)
+        sources = new_sorter()
+        sorters.append(sources)
+        for file_info in source_file_infos:
+            tier_keys = get_tier_keys(file_info)
+            sources.add((tier_keys[0], sources.count, file_info.path, tier_keys))
+            if (sources.count % 10) == 0:
+                print(sources.count, end='\r', file=sys.stderr)
+        print(sources.count, file=sys.stderr)
+
+        print('Collecting data from compare directory tree', file=sys.stderr)
+        compares = mp3_external_sort.RecordSpool(temp_dir)
+        sorters.append(compares)
+        compare_reprs = new_sorter()
+        sorters.append(compare_reprs)
+        for file_info in compare_file_infos:
+            tier_keys = get_tier_keys(file_info)
+            compares.add((compares.count, file_info.path, tier_keys))
+            compare_reprs.add(repr(tier_keys[0]))
+            if (compares.count % 10) == 0:
+                print(compares.count, end='\r', file=sys.stderr)
+        print(compares.count, file=sys.stderr)
+
+        # Of source files with the same key, the last file is kept under the first file's key, as in a dict
+        source_reprs = new_sorter()
+        sorters.append(source_reprs)
+
+        def get_unique_sources():
+            for key, group in itertools.groupby(sources, lambda record: record[0]):
+                first = last = next(group)
+                for last in group:
+                    pass
+                source_reprs.add(repr(first[0]))
+                yield (first[0], first[1], last[2], (first[0],) + last[3][1:])
+
+        results = new_sorter()
+        sorters.append(results)
+        unmatched = get_unique_sources()
+        for index, tier in enumerate(tiers):
+            tier_compares = new_sorter()
+            sorters.append(tier_compares)
+            for seq, path, tier_keys in compares:
+                tier_compares.add((tier_keys[index], seq, path))
+            next_unmatched = new_sorter()
+            sorters.append(next_unmatched)
+            for record, compare_path in join_tier(unmatched, first_per_key(tier_compares, tier), tier):
+                key, seq, path, tier_keys = record
+                if compare_path is None:
+                    if index + 1 < len(tiers):
+                        next_unmatched.add((tier_keys[index + 1], seq, path, tier_keys))
+                    else:
+                        results.add((tier_keys[0], seq, '{0} has no corresponding key {1} or artist/album/track {2} in compare'.format(path, tier_keys[0], tier_keys[track_tier])))
+                elif tier.message is not None:
+                    results.add((tier_keys[0], seq, tier.message.format(path, compare_path, 1.0, tier.name)))
+            tier_compares.close()
+            unmatched = next_unmatched
+
+        for key, seq, line in results:
+            print(line, file=out)
+
+        print('Source keys', file=out)
+        for key in source_reprs:
+            print(key, file=out)
+
+        print('Compare keys', file=out)
+        for key, group in itertools.groupby(compare_reprs):
+            print(key, file=out)
+    finally:
+        for sorter in sorters:
+            sorter.close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source_dir", help="Source directory root for comparison")
+    parser.add_argument("compare_dir", help="Directory root to which to compare")
+    workers = parser.add_mutually_exclusive_group()
+    workers.add_argument("--jobs", type=int, default=1,
+                         help="Number of worker processes parsing files (0 is one per CPU, default is 1)")
+    workers.add_argument("--concurrency", type=int, default=0,
+                         help="Number of files to parse at once in threads, for network filesystems")
+    parser.add_argument("--extensions", default="mp3",
+                        help="Comma-separated extensions of the files to compare, in any case (default is mp3)")
+    parser.add_argument("--order", choices=mp3_read_schedule.ORDERS, default="walk",
+                        help="Read files in walk order (the default), or sorted by inode or disk extent, for spinning disks")
+    parser.add_argument("--window", type=int, default=mp3_read_schedule.DEFAULT_WINDOW,
+                        help="Number of files sorted together with --order (default is %(default)s)")
+    parser.add_argument("--timeout", type=float,
+                        help="Seconds after which to skip a file when parsing with --concurrency")
+    parser.add_argument("--ordered", action="store_true",
+                        help="Collect files in walk order when parsing with multiple jobs")
+    parser.add_argument("--cache", metavar="PATH",
+                        help="Cache file information in the SQLite database at PATH")
+    parser.add_argument("--whole-tag", action="store_true",
+                        help="Read each tag with a single read rather than frame by frame")
+    parser.add_argument("--id3v1", choices=("never", "fallback", "always"), default="fallback",
+                        help="Read ID3v1 tags of files with no ID3v2 tag (the default), of all files, or never")
+    parser.add_argument("--stats", action="store_true",
+                        help="Print parser counters, byte accounting and timings to stderr at the end")
+    parser.add_argument("--audio", action="store_true",
+                        help="Analyze the MPEG audio of each file for its duration and bitrate, which are cached")
+    parser.add_argument("--content-hash", action="store_true",
+                        help="Match files on a hash of their audio, skipping tags, and list files with the same audio")
+    parser.add_argument("--external", action="store_true",
+                        help="Compare through sorted run files, with bounded memory, on exact and normalized keys only")
+    parser.add_argument("--sort-records", type=int, default=DEFAULT_SORT_RECORDS,
+                        help="Number of records kept in memory with --external (default is %(default)s)")
+    parser.add_argument("--temp-dir", metavar="DIRECTORY",
+                        help="Directory for the run files of --external (default is the system temporary directory)")
+    args = parser.parse_args()
+    if args.external and args.content_hash:
+        parser.error("--content-hash cannot be used with --external")
+
+    extensions = args.extensions.split(',')
+    cache = None
+    if args.cache:
+        cache = mp3_cache.FileInfoCache(os.path.expanduser(args.cache))
+    scheduler = None
+    if args.order != 'walk':
+        scheduler = mp3_read_schedule.ReadScheduler(args.order, args.window)
+    parser_options = {'whole_tag': args.whole_tag, 'id3v1': None if args.id3v1 == 'never' else args.id3v1}
+    if args.stats:
+        parser_options['stats'] = mp3_stats.ParserStats()
+    start = time.time()
+
+    if args.external:
+        compare_external(find_in_tree(args.source_dir, extensions, args.jobs, args.ordered, cache, parser_options,
+                                      args.concurrency, args.timeout, scheduler, args.audio),
+                         find_in_tree(args.compare_dir, extensions, args.jobs, args.ordered, cache, parser_options,
+                                      args.concurrency, args.timeout, scheduler, args.audio),
+                         args.sort_records, args.temp_dir)
+        if cache is not None:
+            cache.close()
+        if args.stats:
+            parser_options['stats'].print_summary(time.time() - start)
+        return
+
+    print('Collecting data from source directory tree', file=sys.stderr)
+    source_file_infos = {}
+    source_paths = []
+    for file_info in find_in_tree(args.source_dir, extensions, args.jobs, args.ordered, cache, parser_options,
+                                  args.concurrency, args.timeout, scheduler, args.audio):
+        source_file_infos[file_info.get_key()] = file_info
+        source_paths.append(file_info.path)
+        if (len(source_file_infos) % 10) == 0:
+            print(len(source_file_infos), end='\r', file=sys.stderr)
+
+    print(len(source_file_infos), file=sys.stderr)
+
+    print('Collecting data from compare directory tree', file=sys.stderr)
+    audio_tier = mp3_match.PathTier('same audio', '{0} has the same audio as {1}')
+    matcher = mp3_match.Matcher(get_match_tiers(audio_tier))
+    for file_info in find_in_tree(args.compare_dir, extensions, args.jobs, args.ordered, cache, parser_options,
+                                  args.concurrency, args.timeout, scheduler, args.audio):
+        for tier, existing in matcher.add(file_info):
+            if tier.name == 'artist/album/trknum':
+                print('Artist/album/trknum {0} for {1} already exists for {2}'.format(file_info.get_artist_album_trknum(), file_info.path, existing.path), file=sys.stderr)
+
+        if (len(matcher.file_infos) % 10) == 0:
+            print(len(matcher.file_infos), end='\r', file=sys.stderr)
+
+    print(len(matcher.file_infos), file=sys.stderr)
+
+    audio_groups = []
+    if args.content_hash:
+        print('Hashing audio', file=sys.stderr)
+        compare_rows_by_path = dict((file_info.path, row) for row, file_info in enumerate(matcher.file_infos))
+        audio_groups = mp3_content_hash.find_duplicates(source_paths + compare_rows_by_path.keys(),
+                                                        args.concurrency or args.jobs, cache)
+        for group in audio_groups:
+            in_compare = [path for path in group if path in compare_rows_by_path]
+            for path in group:
+                others = [other for other in in_compare if other != path]
+                if others:
+                    audio_tier.matches[path] = compare_rows_by_path[others[0]]
+
+    for key in source_file_infos.keys():
+        source_info = source_file_infos[key]
+        tier, compare_info, score = matcher.match(source_info)
+        if tier is None:
+            print('{0} has no corresponding key {1} or artist/album/track {2} in compare'.format(source_info.path, key, source_info.get_artist_album_track()))
+        elif tier.message is not None:
+            print(tier.message.format(source_info.path, compare_info.path, score, tier.name))
+
+    print('Source keys')
+    for key in sorted(map(lambda s: repr(s), source_file_infos.keys())):
+        print(key)
+    
+    print('Compare keys')
+    for key in sorted(set(repr(file_info.get_key()) for file_info in matcher.file_infos)):
+        print(key)
+
+    if args.content_hash:
+        source_path_set = set(source_paths)
+        print('Same audio')
+        for group in audio_groups:
+            print('---')
+            for path in group:
+                trees = [name for name, path_set in (('source', source_path_set), ('compare', compare_rows_by_path))
+                         if path in path_set]
+                print('{0}: {1}'.format(' and '.join(trees), path))
+
+    if cache is not None:
+        cache.close()
+    if args.stats:
+        parser_options['stats'].print_summary(time.time() - start)
+
+if __name__ == '__main__':
+    main()
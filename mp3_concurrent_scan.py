@@ -0,0 +1,206 @@
+# Copyright (c) 2013, pynewb
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice, this list
+#     of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice, this
+#     list of conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution.
+#   * Neither the name of pynewb nor the names of its contributors may be used to endorse
+#     or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import print_function
+
+import Queue
+import sys
+import threading
+import time
+
+import mp3_event_parser
+import mp3_parallel
+import mp3_stats
+
+DEFAULT_CONCURRENCY = 128
+
+# Seconds between checks for timed out files while waiting for results
+POLL_INTERVAL = 0.1
+
+# Seconds to wait for workers to exit at the end of a scan
+EXIT_WAIT = 1.0
+
+class ConcurrentScanner(object):
+    '''Parses files with many opens and reads in flight at once
+
+    This is for filesystems such as NFS, where each open and first read
+    waits on the network far longer than it takes to parse a tag.  A
+    bounded set of worker threads, each with its own ID3v2Parser, parses
+    files while the blocking calls of the others are outstanding, and the
+    recorded events are passed back through an iterator.
+
+    A file that is not parsed within timeout seconds is reported as timed
+    out and its worker is replaced, so one stalled file does not hold up
+    the scan.  The stalled worker's result is discarded if it ever arrives.
+
+    If parser_options include stats, each worker counts into a ParserStats
+    of its own, which is merged into it after each file.
+    '''
+
+    def __init__(self, aatpath, event_names, concurrency=DEFAULT_CONCURRENCY, timeout=None, parser_options=None,
+                 unreadable_errors=False):
+        '''Initialize the scanner options
+
+        Files which cannot be read are reported as errors if
+        unreadable_errors is set, as by mp3_parallel.parse_file, rather
+        than raised by scan.
+        '''
+        self.aatpath = aatpath
+        self.unreadable_errors = unreadable_errors
+        self.event_names = event_names
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.parser_options = parser_options or {}
+
+    def __feed(self, paths):
+        '''Queue paths for the workers, in a thread of its own
+
+        An exception raised by the paths iterator is kept to be raised by scan.
+        '''
+        try:
+            for path in paths:
+                if self.stopped:
+                    return
+                self.tasks.put(path)
+                with self.lock:
+                    self.submitted += 1
+        except Exception:
+            with self.lock:
+                self.feed_error = sys.exc_info()
+        finally:
+            with self.lock:
+                self.fed_all = True
+
+    def __work(self):
+        '''Parse queued files until told to stop or abandoned, in a worker thread'''
+        stats = self.parser_options.get('stats')
+        if stats is not None:
+            parser = mp3_event_parser.ID3v2Parser(**dict(self.parser_options, stats=mp3_stats.ParserStats()))
+        else:
+            parser = mp3_event_parser.ID3v2Parser(**self.parser_options)
+        while True:
+            path = self.tasks.get()
+            if path is None or self.stopped:
+                return
+            with self.lock:
+                self.in_flight[path] = time.time()
+            recorder = mp3_parallel.EventRecorder(self.event_names)
+            try:
+                mp3_parallel.parse_file(parser, path, self.aatpath, recorder, self.unreadable_errors)
+                result = (path, recorder.events, None)
+            except Exception:
+                result = (path, None, sys.exc_info())
+            with self.lock:
+                if self.in_flight.pop(path, None) is None:
+                    # Timed out and replaced by another worker
+                    return
+                if stats is not None:
+                    stats.merge(parser.stats)
+            if stats is not None:
+                parser.stats = mp3_stats.ParserStats()
+            self.results.put(result)
+
+    def __start_worker(self):
+        '''Start a worker thread'''
+        worker = threading.Thread(target=self.__work)
+        worker.daemon = True
+        worker.start()
+        self.workers.append(worker)
+
+    def __timed_out(self):
+        '''Get the paths of files in flight for longer than the timeout, abandoning them'''
+        if self.timeout is None:
+            return []
+        expired = time.time() - self.timeout
+        with self.lock:
+            paths = [path for path, started in self.in_flight.items() if started < expired]
+            for path in paths:
+                del self.in_flight[path]
+        return paths
+
+    def scan(self, paths):
+        '''Parse files, yielding (path, events) for each in order of completion
+
+        events is a list of recorded (method, args) parser events, or None
+        if the file timed out.  Paths are consumed lazily, from a thread, and
+        an exception raised by the paths iterator is raised here once the
+        files before it are done.
+        '''
+        self.tasks = Queue.Queue(self.concurrency * 2)
+        self.results = Queue.Queue()
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.submitted = 0
+        self.fed_all = False
+        self.feed_error = None
+        self.stopped = False
+        self.workers = []
+
+        feeder = threading.Thread(target=self.__feed, args=(paths,))
+        feeder.daemon = True
+        feeder.start()
+        for i in range(self.concurrency):
+            self.__start_worker()
+
+        completed = 0
+        last_check = time.time()
+        try:
+            while True:
+                with self.lock:
+                    feed_error = self.feed_error
+                    done = self.fed_all and completed == self.submitted
+                if done:
+                    if feed_error is not None:
+                        # After the files queued before the error, as a sequential scan would
+                        raise feed_error[0], feed_error[1], feed_error[2]
+                    break
+                try:
+                    path, events, exc_info = self.results.get(True, POLL_INTERVAL)
+                    if exc_info is not None:
+                        raise exc_info[0], exc_info[1], exc_info[2]
+                    completed += 1
+                    yield (path, events)
+                except Queue.Empty:
+                    pass
+
+                if time.time() - last_check >= POLL_INTERVAL:
+                    last_check = time.time()
+                    for path in self.__timed_out():
+                        print(path, ':', 'Timed out after {0} seconds'.format(self.timeout), file=sys.stderr)
+                        self.__start_worker()
+                        completed += 1
+                        yield (path, None)
+        finally:
+            # Stop the workers; stalled ones are daemons and die with the process
+            self.stopped = True
+            for i in range(self.concurrency):
+                try:
+                    self.tasks.put_nowait(None)
+                except Queue.Full:
+                    break
+            # Let idle workers exit before the interpreter can shut down under them
+            deadline = time.time() + EXIT_WAIT
+            for worker in self.workers:
+                worker.join(max(0, deadline - time.time()))
@@ -0,0 +1,164 @@
+# Copyright (c) 2013, pynewb
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice, this list
+#     of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice, this
+#     list of conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution.
+#   * Neither the name of pynewb nor the names of its contributors may be used to endorse
+#     or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import print_function
+
+import collections
+import hashlib
+import multiprocessing
+import multiprocessing.pool
+import os
+import struct
+import sys
+
+import mp3_event_parser
+
+# Bytes hashed per read
+HASH_CHUNK_SIZE = 1 << 20
+
+def get_audio_span(f, file_size):
+    '''Get the (start, end) offsets of the audio of an open file, leaving out any ID3v2 tag and ID3v1 trailer'''
+    start = 0
+    header = f.read(10)
+    if len(header) == 10 and header[0:3] == 'ID3':
+        version, flags, size = struct.unpack('>xxxBxBI', header)
+        start = mp3_event_parser.unsynchsafe(size) + 10
+        if version == 4 and (flags & 0x10) != 0:
+            start += 10
+        start = min(start, file_size)
+    end = file_size
+    if end - start >= 128:
+        f.seek(-128, os.SEEK_END)
+        if f.read(3) == 'TAG':
+            end -= 128
+    return (start, end)
+
+def hash_span(f, start, end, chunk_size=HASH_CHUNK_SIZE):
+    '''Get the SHA-1 hex digest of the bytes of an open file from start to end'''
+    digest = hashlib.sha1()
+    f.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = f.read(min(chunk_size, remaining))
+        if not chunk:
+            break
+        digest.update(chunk)
+        remaining -= len(chunk)
+    return digest.hexdigest()
+
+def _span_task(path_st):
+    '''Get (path, st, span, error) for a file in a worker thread'''
+    path, st = path_st
+    try:
+        with open(path, 'rb', 0) as f:
+            return (path, st, get_audio_span(f, st.st_size), None)
+    except (IOError, OSError) as e:
+        return (path, st, None, str(e))
+
+def _hash_task(path_st_span):
+    '''Get (path, st, span, digest, error) for a file in a worker thread'''
+    path, st, span = path_st_span
+    try:
+        with open(path, 'rb', 0) as f:
+            return (path, st, span, hash_span(f, span[0], span[1]), None)
+    except (IOError, OSError) as e:
+        return (path, st, span, None, str(e))
+
+def find_duplicates(paths, jobs=1, cache=None):
+    '''Find files with identical audio, returning a list of groups of two or more paths
+
+    Only the audio is compared, so files which differ only in their tags
+    are duplicates.  Files are first grouped by the size of their audio,
+    and only the files in groups of two or more are hashed, so most files
+    are only opened to find their tags.  The files are read by a pool of
+    jobs threads (0 meaning one per CPU), since reading and hashing
+    release the GIL.
+
+    If a FileInfoCache is given, the audio span and hash of each file are
+    served from it while the file is unchanged, and stored in it.
+    '''
+    if not jobs:
+        jobs = multiprocessing.cpu_count()
+    pool = multiprocessing.pool.ThreadPool(jobs) if jobs != 1 else None
+    imap = pool.imap_unordered if pool is not None else map
+
+    try:
+        stats = {}
+        spans = {}
+        digests = {}
+        todo = []
+        for path in sorted(set(paths)):
+            try:
+                st = os.stat(path)
+            except OSError as e:
+                print(path + ' : ' + str(e), file=sys.stderr)
+                continue
+            stats[path] = st
+            cached = cache.get_audio_hash(path, st) if cache is not None else None
+            if cached is None:
+                todo.append((path, st))
+                continue
+            spans[path], digests[path] = (cached[0], cached[1]), cached[2]
+        for path, st, span, error in imap(_span_task, todo):
+            if error:
+                print(path + ' : ' + error, file=sys.stderr)
+                continue
+            spans[path] = span
+            if cache is not None:
+                cache.put_audio_hash(path, st, span, None)
+
+        by_size = collections.defaultdict(list)
+        for path, (start, end) in spans.iteritems():
+            by_size[end - start].append(path)
+
+        todo = []
+        for size, size_paths in by_size.iteritems():
+            if len(size_paths) < 2:
+                continue
+            for path in size_paths:
+                if digests.get(path) is None:
+                    todo.append((path, stats[path], spans[path]))
+        for path, st, span, digest, error in imap(_hash_task, todo):
+            if error:
+                print(path + ' : ' + error, file=sys.stderr)
+                continue
+            digests[path] = digest
+            if cache is not None:
+                cache.put_audio_hash(path, st, span, digest)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if cache is not None:
+            cache.commit()
+
+    groups = collections.defaultdict(list)
+    for size, size_paths in by_size.iteritems():
+        if len(size_paths) < 2:
+            continue
+        for path in size_paths:
+            if digests.get(path) is not None:
+                groups[(size, digests[path])].append(path)
+    return sorted(sorted(group) for group in groups.itervalues() if len(group) > 1)
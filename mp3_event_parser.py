@@ -25,14 +25,95 @@
 
 from __future__ import print_function
 
+import os
+import os.path
+import re
 import struct
 import sys
+import time
+import zlib
+
+import mp3_audio
+import mp3_stats
+
+# Events a handler for ID3v2Parser can implement
+HANDLER_EVENTS = (
+    'on_error',
+    'on_path',
+    'on_aatpath',
+    'on_raw_id3v2_header',
+    'on_id3v2_header',
+    'on_raw_id3v2dot3_frame_header',
+    'on_id3v2dot3_frame_header',
+    'on_id3v2dot3_frame_offset',
+    'on_raw_id3v2dot3_frame',
+    'on_id3v2dot3_frame',
+    'on_mpeg_audio',
+    'on_mpeg_validation',
+)
+
+# Number of bytes read with the header when reading whole tags
+WHOLE_TAG_FIRST_READ = 16384
+
+# ID3v2.3 frame types of the ID3v2.2 frame types
+ID3V2DOT2_FRAME_TYPES = {
+    'BUF': 'RBUF', 'CNT': 'PCNT', 'COM': 'COMM', 'CRA': 'AENC', 'ETC': 'ETCO',
+    'EQU': 'EQUA', 'GEO': 'GEOB', 'IPL': 'IPLS', 'LNK': 'LINK', 'MCI': 'MCDI',
+    'MLL': 'MLLT', 'PIC': 'APIC', 'POP': 'POPM', 'REV': 'RVRB', 'RVA': 'RVAD',
+    'SLT': 'SYLT', 'STC': 'SYTC', 'TAL': 'TALB', 'TBP': 'TBPM', 'TCM': 'TCOM',
+    'TCO': 'TCON', 'TCR': 'TCOP', 'TDA': 'TDAT', 'TDY': 'TDLY', 'TEN': 'TENC',
+    'TFT': 'TFLT', 'TIM': 'TIME', 'TKE': 'TKEY', 'TLA': 'TLAN', 'TLE': 'TLEN',
+    'TMT': 'TMED', 'TOA': 'TOPE', 'TOF': 'TOFN', 'TOL': 'TOLY', 'TOR': 'TORY',
+    'TOT': 'TOAL', 'TP1': 'TPE1', 'TP2': 'TPE2', 'TP3': 'TPE3', 'TP4': 'TPE4',
+    'TPA': 'TPOS', 'TPB': 'TPUB', 'TRC': 'TSRC', 'TRD': 'TRDA', 'TRK': 'TRCK',
+    'TSI': 'TSIZ', 'TSS': 'TSSE', 'TT1': 'TIT1', 'TT2': 'TIT2', 'TT3': 'TIT3',
+    'TXT': 'TEXT', 'TXX': 'TXXX', 'TYE': 'TYER', 'UFI': 'UFID', 'ULT': 'USLT',
+    'WAF': 'WOAF', 'WAR': 'WOAR', 'WAS': 'WOAS', 'WCM': 'WCOM', 'WCP': 'WCOP',
+    'WPB': 'WPUB', 'WXX': 'WXXX',
+}
+
+# Genres of ID3v1 tags, by genre number, including the Winamp extensions
+ID3V1_GENRES = (
+    'Blues', 'Classic Rock', 'Country', 'Dance', 'Disco', 'Funk', 'Grunge', 'Hip-Hop',
+    'Jazz', 'Metal', 'New Age', 'Oldies', 'Other', 'Pop', 'R&B', 'Rap',
+    'Reggae', 'Rock', 'Techno', 'Industrial', 'Alternative', 'Ska', 'Death Metal', 'Pranks',
+    'Soundtrack', 'Euro-Techno', 'Ambient', 'Trip-Hop', 'Vocal', 'Jazz+Funk', 'Fusion', 'Trance',
+    'Classical', 'Instrumental', 'Acid', 'House', 'Game', 'Sound Clip', 'Gospel', 'Noise',
+    'AlternRock', 'Bass', 'Soul', 'Punk', 'Space', 'Meditative', 'Instrumental Pop', 'Instrumental Rock',
+    'Ethnic', 'Gothic', 'Darkwave', 'Techno-Industrial', 'Electronic', 'Pop-Folk', 'Eurodance', 'Dream',
+    'Southern Rock', 'Comedy', 'Cult', 'Gangsta', 'Top 40', 'Christian Rap', 'Pop/Funk', 'Jungle',
+    'Native American', 'Cabaret', 'New Wave', 'Psychadelic', 'Rave', 'Showtunes', 'Trailer', 'Lo-Fi',
+    'Tribal', 'Acid Punk', 'Acid Jazz', 'Polka', 'Retro', 'Musical', 'Rock & Roll', 'Hard Rock',
+    'Folk', 'Folk-Rock', 'National Folk', 'Swing', 'Fast Fusion', 'Bebob', 'Latin', 'Revival',
+    'Celtic', 'Bluegrass', 'Avantgarde', 'Gothic Rock', 'Progressive Rock', 'Psychedelic Rock', 'Symphonic Rock', 'Slow Rock',
+    'Big Band', 'Chorus', 'Easy Listening', 'Acoustic', 'Humour', 'Speech', 'Chanson', 'Opera',
+    'Chamber Music', 'Sonata', 'Symphony', 'Booty Bass', 'Primus', 'Porn Groove', 'Satire', 'Slow Jam',
+    'Club', 'Tango', 'Samba', 'Folklore', 'Ballad', 'Power Ballad', 'Rhythmic Soul', 'Freestyle',
+    'Duet', 'Punk Rock', 'Drum Solo', 'A capella', 'Euro-House', 'Dance Hall',
+)
+
+# Fields of the decoded frames holding the payloads streamed to an art store, by frame type
+STORED_FRAME_FIELDS = {'APIC': 'picture_data', 'GEOB': 'binary_data'}
+
+# Number of bytes read from the start of a frame streamed to an art store, to decode the fields before its payload
+STORED_FRAME_FIRST_READ = 1024
+
+# Python codecs of the ID3v2 text encodings other than ISO-8859-1
+TEXT_CODECS = {1: 'utf-16', 2: 'utf-16-be', 3: 'utf-8'}
+
+id3v2dot3_frame_header = struct.Struct('>4sIH')
 
 class ID3v2Parser(object):
     '''Parses an ID3v2 file, such as a non-ancient MP3 file
     
     This is an event-based parser, a la SAX, that parses the
     file and invokes user callbacks for particular file parts
+
+    The frames of ID3v2.2, ID3v2.3 and ID3v2.4 tags are passed to the same
+    events, with ID3v2.2 frame types given as their ID3v2.3 equivalents.
+    Frames are unsynchronized, decompressed and stripped of their group
+    and data length bytes before they are decoded; encrypted frames are
+    not decoded.
     
     A handler for this parser can have any of the following methods:
     
@@ -43,44 +124,178 @@ class ID3v2Parser(object):
     on_id3v2_header(version, revision, flags, size)
     on_raw_id3v2dot3_frame_header(self, frame_header)
     on_id3v2dot3_frame_header(frame_type, frame_size, frame_flags)
+    on_id3v2dot3_frame_offset(frame_type, frame_flags, offset, frame_size)
     on_raw_id3v2dot3_frame(frame_type, frame_data)
     on_id3v2dot3_frame(frame_type, frame_data)
+    on_mpeg_audio(audio_dict)
+    on_mpeg_validation(validation_dict)
+
+    The handler's methods are looked up once when it is first passed to
+    parse_id3v2_file, and the parser does no work for events the handler
+    does not implement: frames are only decoded for on_id3v2dot3_frame,
+    frame payloads are only read for that or on_raw_id3v2dot3_frame, and
+    the frames are only walked if the handler implements a frame event.
+
+    Frames are decoded by the function registered for the frame type in
+    frame_decoders; see register_frame_decoder.  Binary payloads in the
+    decoded frames, such as picture_data and private_data, are memoryviews
+    of the frame data rather than copies.
+
+    If frame_types is given, only frames of those types are read and
+    parsed; the payloads of other frames are skipped over, and the parser
+    stops walking the tag once it has seen every one of the frame types.
+
+    on_id3v2dot3_frame_offset gives the offset of each frame's data in the
+    file, so the frame can be read later without parsing the tag again;
+    see mp3_frame_index.  It is not called for the frames of ID3v2.2 and
+    ID3v2.3 tags unsynchronized as a whole, or of ID3v1 tags, whose frame
+    data is not stored as is in the file.
+
+    If whole_tag is set, the parser reads the entire tag, usually with the
+    same read as the header, and walks its frames in memory rather than
+    reading each frame header and frame from the file.  The events are
+    the same either way.
+
+    If id3v1 is 'fallback', a file with no ID3v2 tag is checked for an
+    ID3v1 or ID3v1.1 tag in its last 128 bytes, and if it has one, the
+    title, artist, album, year, comment, track and genre are passed to the
+    frame events as TIT2, TPE1, TALB, TYER, COMM, TRCK and TCON frames.
+    If it is 'always', files with an ID3v2 tag are checked too, and the
+    ID3v1 fields fill in frame types the ID3v2 tag does not have.  This
+    costs one read at most.
+
+    After the tag, if the handler implements on_mpeg_audio, the parser
+    finds the first MPEG audio frame and passes the stream properties
+    from mp3_audio.analyze_mpeg_audio, including the duration and average
+    bitrate.  In whole tag mode, these usually come from the same read as
+    the tag.
+
+    If the handler implements on_mpeg_validation, the parser then reads
+    the whole audio stream in chunks, following it frame by frame, and
+    passes the junk, CRC errors and truncation found by
+    mp3_audio.validate_mpeg_audio.
+
+    If art_store, a mp3_art_store.ArtStore, is given, the payloads of APIC
+    and GEOB frames passed to on_id3v2dot3_frame are streamed from the
+    file to the store rather than read, and their decoded frames have the
+    hex digest of the payload as digest, and its length as
+    picture_data_length or binary_data_length, in place of the payload.
+    These frames are not passed to on_raw_id3v2dot3_frame.  In whole tag
+    mode, a tag too large for the first read is walked frame by frame.
+
+    If stats, a mp3_stats.ParserStats, is given, the parser counts the
+    files, bytes, frames and errors it sees in it and times its opens,
+    reads and frame decoding.  Without it, none of this is done.
 
     The ID3v2 specification is at http://id3.org
     '''
 
-    def __call_handler(self, method, *args):
-        '''Call the handler method, if the handler has implemented it'''
-        if hasattr(self.handler, method):
-            cb = getattr(self.handler, method)
-            if callable(cb):
-                cb(*args)
+    def __init__(self, whole_tag=False, frame_types=None, stats=None, id3v1=None, art_store=None):
+        '''Initialize the parser options'''
+        self.whole_tag = whole_tag
+        self.art_store = art_store
+        self.id3v1 = id3v1
+        self.stats = stats
+        if frame_types:
+            self.frame_types = frozenset(frame_types)
+        else:
+            self.frame_types = None
+        self.unseen_frame_types = None
+        self.seen_frame_types = None
+        self.truncated_tag_size = None
+        self.handler = None
+        for name in HANDLER_EVENTS:
+            setattr(self, name + '_cb', None)
+        self.read_frames = False
+        self.walk_frames = False
+
+    def __bind_handler(self, handler):
+        '''Look up the callbacks a handler implements'''
+        if handler is self.handler:
+            return
+        self.handler = handler
+        for name in HANDLER_EVENTS:
+            cb = getattr(handler, name, None)
+            setattr(self, name + '_cb', cb if callable(cb) else None)
+        self.read_frames = bool(self.on_raw_id3v2dot3_frame_cb or self.on_id3v2dot3_frame_cb)
+        self.walk_frames = bool(self.read_frames or self.on_raw_id3v2dot3_frame_header_cb
+                                or self.on_id3v2dot3_frame_header_cb or self.on_id3v2dot3_frame_offset_cb)
+
+    def __is_wanted_frame(self, frame_type):
+        '''Get whether a frame type should be read and parsed'''
+        return self.read_frames and (self.frame_types is None or frame_type in self.frame_types)
+
+    def __frame_seen(self, frame_type):
+        '''Note that a frame was parsed, returning False once all wanted frame types have been seen'''
+        if self.seen_frame_types is not None:
+            self.seen_frame_types.add(frame_type)
+        if self.unseen_frame_types is None:
+            return True
+        self.unseen_frame_types.discard(frame_type)
+        return len(self.unseen_frame_types) > 0
+
+    @classmethod
+    def register_frame_decoder(cls, frame_type, decoder):
+        '''Register the decoder for a frame type
 
-    def __print_error(self, msg):
+        The decoder is called as decoder(parser, frame_data) and returns a
+        dict of the decoded fields, which is passed to on_id3v2dot3_frame.
+        It can report errors with parser.print_error(msg).
+        '''
+        cls.frame_decoders[frame_type] = decoder
+
+    def print_error(self, msg):
         '''Print an error to stderr'''
         print(self.path, ':', msg, file=sys.stderr)
-        self.__call_handler('on_error', msg)
+        if self.stats is not None:
+            self.stats.add_error(msg)
+        if self.on_error_cb:
+            self.on_error_cb(msg)
 
     def parse_apic_frame(self, frame_data):
         '''Parses an ID3v2.3 attached picture frame'''
         frame_encoding = ord(frame_data[0])
-        mime_len, mime_type = unpack_string(frame_data[1:])
+        mime_len, mime_type = unpack_string(frame_data, 1)
         picture_type = ord(frame_data[1 + mime_len])
+        offset = 2 + mime_len
     
         if frame_encoding == 0:
-            description_len, description_string = unpack_string(frame_data[2 + mime_len:])
-            picture_data = frame_data[2 + mime_len + description_len:]
-        elif frame_encoding == 1:
-            description_len, description_string = unpack_unicode(frame_data[2 + mime_len:])
-            picture_data = frame_data[2 + mime_len + description_len:]
+            description_len, description_string = unpack_string(frame_data, offset)
+        elif frame_encoding in TEXT_CODECS:
+            description_len, description_string = unpack_text(frame_encoding, frame_data, offset)
         else:
-            self.__print_error("Unknown frame encoding {0:02x}".format(frame_encoding))
+            self.print_error("Unknown frame encoding {0:02x}".format(frame_encoding))
             return {}
 
         frame_dict = dict()
         frame_dict['mime_type'] = mime_type
         frame_dict['description_string'] = description_string
-        frame_dict['picture_data'] = bytearray(picture_data)
+        frame_dict['picture_data'] = memoryview(frame_data)[offset + description_len:]
+
+        return frame_dict
+
+    def parse_pic_frame(self, frame_data):
+        '''Parses an ID3v2.2 attached picture frame, like an ID3v2.3 one'''
+        frame_encoding = ord(frame_data[0])
+        image_format = frame_data[1:4]
+        picture_type = ord(frame_data[4])
+        offset = 5
+
+        if frame_encoding == 0:
+            description_len, description_string = unpack_string(frame_data, offset)
+        elif frame_encoding in TEXT_CODECS:
+            description_len, description_string = unpack_text(frame_encoding, frame_data, offset)
+        else:
+            self.print_error("Unknown frame encoding {0:02x}".format(frame_encoding))
+            return {}
+
+        frame_dict = dict()
+        if image_format.upper() == 'JPG':
+            frame_dict['mime_type'] = 'image/jpeg'
+        else:
+            frame_dict['mime_type'] = 'image/' + image_format.lower()
+        frame_dict['description_string'] = description_string
+        frame_dict['picture_data'] = memoryview(frame_data)[offset + description_len:]
 
         return frame_dict
 
@@ -90,13 +305,13 @@ class ID3v2Parser(object):
         if language[0] == '\0':
             language = ''
         if frame_encoding == 0:
-            descriptor_len, descriptor_string = unpack_string(frame_data[4:])
+            descriptor_len, descriptor_string = unpack_string(frame_data, 4)
             comment_string = frame_data[4 + descriptor_len:]
-        elif frame_encoding == 1:
-            descriptor_len, descriptor_string = unpack_unicode(frame_data[4:])
-            comment_string = frame_data[4 + descriptor_len:].decode('utf-16')
+        elif frame_encoding in TEXT_CODECS:
+            descriptor_len, descriptor_string = unpack_text(frame_encoding, frame_data, 4)
+            comment_string = frame_data[4 + descriptor_len:].decode(TEXT_CODECS[frame_encoding])
         else:
-            self.__print_error("Unknown frame encoding {0:02x}".format(frame_encoding))
+            self.print_error("Unknown frame encoding {0:02x}".format(frame_encoding))
             return {}
 
         frame_dict = dict()
@@ -109,43 +324,43 @@ class ID3v2Parser(object):
     def parse_geob_frame(self, frame_data):
         '''Parses an ID3v2.3 general encapsulated object frame'''    
         frame_encoding = ord(frame_data[0])
-        mime_len, mime_type = unpack_string(frame_data[1:])
+        mime_len, mime_type = unpack_string(frame_data, 1)
+        offset = 1 + mime_len
     
         if frame_encoding == 0:
-            description_len, description_string = unpack_string(frame_data[1 + mime_len:])
-            filename_len, filename_string = unpack_string(frame_data[1 + mime_len + description_len:])
-            binary_data = frame_data[1 + mime_len + description_len + filename_len:]
-        elif frame_encoding == 1:
-            description_len, description_string = unpack_unicode(frame_data[1 + mime_len:])
-            filename_len, filename_string = unpack_unicode(frame_data[1 + mime_len + description_len:])
-            binary_data = frame_data[1 + mime_len + description_len + filename_len:]
+            description_len, description_string = unpack_string(frame_data, offset)
+            offset += description_len
+            filename_len, filename_string = unpack_string(frame_data, offset)
+        elif frame_encoding in TEXT_CODECS:
+            description_len, description_string = unpack_text(frame_encoding, frame_data, offset)
+            offset += description_len
+            filename_len, filename_string = unpack_text(frame_encoding, frame_data, offset)
         else:
-            self.__print_error("Unknown frame encoding {0:02x}".format(frame_encoding))
+            self.print_error("Unknown frame encoding {0:02x}".format(frame_encoding))
             return {}
     
         frame_dict = dict()
         frame_dict['mime_type'] = mime_type
         frame_dict['description_string'] = description_string
         frame_dict['filename_string'] = filename_string
-        frame_dict['binary_data'] = bytearray(binary_data)
+        frame_dict['binary_data'] = memoryview(frame_data)[offset + filename_len:]
 
         return frame_dict
 
     def parse_mcdi_frame(self, frame_data):
         '''Parses an ID3v2.3 music CD identifier frame'''
         frame_dict = dict()
-        frame_dict['identifier_data'] = bytearray(frame_data)
+        frame_dict['identifier_data'] = memoryview(frame_data)
         
         return frame_dict
     
     def parse_priv_frame(self, frame_data):
         '''Parses an ID3v2.3 private frame'''
         owner_len, owner_string = unpack_string(frame_data)
-        private_data = frame_data[owner_len:]
         
         frame_dict = dict()
         frame_dict['owner_string'] = owner_string
-        frame_dict['private_data'] = bytearray(private_data)
+        frame_dict['private_data'] = memoryview(frame_data)[owner_len:]
         
         return frame_dict
             
@@ -154,10 +369,10 @@ class ID3v2Parser(object):
         frame_encoding = ord(frame_data[0])
         if frame_encoding == 0:
             frame_string = frame_data[1:]
-        elif frame_encoding == 1:
-            frame_string = frame_data[1:].decode('utf-16')
+        elif frame_encoding in TEXT_CODECS:
+            frame_string = frame_data[1:].decode(TEXT_CODECS[frame_encoding])
         else:
-            self.__print_error("Unknown frame encoding {0:02x}".format(frame_encoding))
+            self.print_error("Unknown frame encoding {0:02x}".format(frame_encoding))
             return {}
         
         frame_dict = dict()
@@ -171,13 +386,13 @@ class ID3v2Parser(object):
         if language[0] == '\0':
             language = ''
         if frame_encoding == 0:
-            descriptor_len, descriptor_string = unpack_string(frame_data[4:])
+            descriptor_len, descriptor_string = unpack_string(frame_data, 4)
             lyrics_string = frame_data[4 + descriptor_len:]
-        elif frame_encoding == 1:
-            descriptor_len, descriptor_string = unpack_unicode(frame_data[4:])
-            lyrics_string = frame_data[4 + descriptor_len:].decode('utf-16')
+        elif frame_encoding in TEXT_CODECS:
+            descriptor_len, descriptor_string = unpack_text(frame_encoding, frame_data, 4)
+            lyrics_string = frame_data[4 + descriptor_len:].decode(TEXT_CODECS[frame_encoding])
         else:
-            self.__print_error("Unknown frame encoding {0:02x}".format(frame_encoding))
+            self.print_error("Unknown frame encoding {0:02x}".format(frame_encoding))
             return {}
     
         frame_dict = dict()
@@ -187,99 +402,306 @@ class ID3v2Parser(object):
 
         return frame_dict
 
-    def parse_id3v2dot3_frame_data(self, frame_type, frame_data):
-        if frame_type == 'APIC':
-            frame_dict = self.parse_apic_frame(frame_data)
-        elif frame_type == 'COMM':
-            frame_dict = self.parse_comm_frame(frame_data)
-        elif frame_type == 'GEOB':
-            frame_dict = self.parse_geob_frame(frame_data)
-        elif frame_type == 'MCDI':
-            frame_dict = self.parse_mcdi_frame(frame_data)
-        elif frame_type == 'PRIV':
-            frame_dict = self.parse_priv_frame(frame_data)
-        elif frame_type == 'TALB':
-            frame_dict = self.parse_text_info_frame(frame_data)
-        elif frame_type == 'TBPM':
-            frame_dict = self.parse_text_info_frame(frame_data)
-        elif frame_type == 'TCOM':
-            frame_dict = self.parse_text_info_frame(frame_data)
-        elif frame_type == 'TCON':
-            frame_dict = self.parse_text_info_frame(frame_data)
-        elif frame_type == 'TCOP':
-            frame_dict = self.parse_text_info_frame(frame_data)
-        elif frame_type == 'TENC':
-            frame_dict = self.parse_text_info_frame(frame_data)
-        elif frame_type == 'TFLT':
-            frame_dict = self.parse_text_info_frame(frame_data)
-        elif frame_type == 'TIT1':
-            frame_dict = self.parse_text_info_frame(frame_data)
-        elif frame_type == 'TIT2':
-            frame_dict = self.parse_text_info_frame(frame_data)
-        elif frame_type == 'TIT3':
-            frame_dict = self.parse_text_info_frame(frame_data)
-        elif frame_type == 'TLEN':
-            frame_dict = self.parse_text_info_frame(frame_data)
-        elif frame_type == 'TPE1':
-            frame_dict = self.parse_text_info_frame(frame_data)
-        elif frame_type == 'TPE2':
-            frame_dict = self.parse_text_info_frame(frame_data)
-        elif frame_type == 'TPE3':
-            frame_dict = self.parse_text_info_frame(frame_data)
-        elif frame_type == 'TPOS':
-            frame_dict = self.parse_text_info_frame(frame_data)
-        elif frame_type == 'TPUB':
-            frame_dict = self.parse_text_info_frame(frame_data)
-        elif frame_type == 'TRCK':
-            frame_dict = self.parse_text_info_frame(frame_data)
-        elif frame_type == 'TXXX':
-            frame_dict = self.parse_text_info_frame(frame_data)
-        elif frame_type == 'TYER':
-            frame_dict = self.parse_text_info_frame(frame_data)
-        elif frame_type == 'USLT':
-            frame_dict = self.parse_uslt_frame(frame_data)
+    # Decoders for each frame type, called as decoder(parser, frame_data)
+    frame_decoders = {
+        'APIC': parse_apic_frame,
+        'COMM': parse_comm_frame,
+        'GEOB': parse_geob_frame,
+        'MCDI': parse_mcdi_frame,
+        'PRIV': parse_priv_frame,
+        'TALB': parse_text_info_frame,
+        'TBPM': parse_text_info_frame,
+        'TCOM': parse_text_info_frame,
+        'TCON': parse_text_info_frame,
+        'TCOP': parse_text_info_frame,
+        'TDOR': parse_text_info_frame,
+        'TDRC': parse_text_info_frame,
+        'TDRL': parse_text_info_frame,
+        'TENC': parse_text_info_frame,
+        'TFLT': parse_text_info_frame,
+        'TIT1': parse_text_info_frame,
+        'TIT2': parse_text_info_frame,
+        'TIT3': parse_text_info_frame,
+        'TKEY': parse_text_info_frame,
+        'TLAN': parse_text_info_frame,
+        'TLEN': parse_text_info_frame,
+        'TMOO': parse_text_info_frame,
+        'TOAL': parse_text_info_frame,
+        'TOPE': parse_text_info_frame,
+        'TPE1': parse_text_info_frame,
+        'TPE2': parse_text_info_frame,
+        'TPE3': parse_text_info_frame,
+        'TPOS': parse_text_info_frame,
+        'TPUB': parse_text_info_frame,
+        'TRCK': parse_text_info_frame,
+        'TSOA': parse_text_info_frame,
+        'TSOP': parse_text_info_frame,
+        'TSOT': parse_text_info_frame,
+        'TSRC': parse_text_info_frame,
+        'TSSE': parse_text_info_frame,
+        'TXXX': parse_text_info_frame,
+        'TYER': parse_text_info_frame,
+        'USLT': parse_uslt_frame,
+    }
+
+    def unpack_frame_data(self, frame_type, frame_data, frame_flags):
+        '''Undoes the unsynchronization, compression and extra header bytes of a frame's data
+
+        This returns None if the frame cannot be decoded.
+        '''
+        if self.version == 3:
+            compressed = (frame_flags & 0x0080) != 0
+            encrypted = (frame_flags & 0x0040) != 0
+            grouped = (frame_flags & 0x0020) != 0
+            unsynchronized = False
+            data_length = compressed
+        elif self.version == 4:
+            grouped = (frame_flags & 0x0040) != 0
+            compressed = (frame_flags & 0x0008) != 0
+            encrypted = (frame_flags & 0x0004) != 0
+            unsynchronized = (frame_flags & 0x0002) != 0 or self.unsynchronized_frames
+            data_length = (frame_flags & 0x0001) != 0
+        else:
+            return frame_data
+
+        if encrypted:
+            self.print_error("Frame {0} is encrypted".format(frame_type))
+            return None
+
+        offset = 0
+        if grouped:
+            offset += 1
+        if encrypted:
+            offset += 1
+        if data_length:
+            offset += 4
+        if offset:
+            frame_data = frame_data[offset:]
+        if unsynchronized:
+            frame_data = frame_data.replace('\xff\x00', '\xff')
+        if compressed:
+            try:
+                frame_data = zlib.decompress(frame_data)
+            except zlib.error:
+                self.print_error("Cannot decompress frame {0}".format(frame_type))
+                return None
+        return frame_data
+
+    def parse_id3v2dot3_frame_data(self, frame_type, frame_data, frame_flags=0):
+        '''Decodes a frame and passes it to the handler'''
+        frame_dict = self.__decode_frame(frame_type, frame_data, frame_flags)
+        if frame_dict is None:
+            return
+        if self.art_store is not None and frame_type in STORED_FRAME_FIELDS:
+            self.pass_stored_frame(frame_type, frame_dict)
+        else:
+            self.on_id3v2dot3_frame_cb(frame_type, frame_dict)
+
+    def __decode_frame(self, frame_type, frame_data, frame_flags):
+        '''Unpacks and decodes a frame of the current tag, returning None if it cannot be decoded'''
+        decoder = self.tag_frame_decoders.get(frame_type)
+        if decoder is None:
+            self.print_error("Do not know frame type {0}".format(frame_type))
+            return None
+
+        if frame_flags or self.unsynchronized_frames:
+            frame_data = self.unpack_frame_data(frame_type, frame_data, frame_flags)
+            if frame_data is None:
+                return None
+
+        return self.decode_frame_data(decoder, frame_data)
+
+    def decode_frame(self, path, version, frame_type, frame_data, frame_flags=0, unsynchronization=False):
+        '''Decodes a frame read apart from a parse, such as through a frame index, returning its fields
+
+        version and unsynchronization are those of the frame's tag.  This
+        returns None if the frame cannot be decoded, reporting why with
+        print_error.
+        '''
+        self.path = path
+        self.__set_tag_version(version, unsynchronization)
+        return self.__decode_frame(frame_type, frame_data, frame_flags)
+
+    def decode_frame_data(self, decoder, frame_data):
+        '''Decodes a frame's data with a decoder, timing it if there are stats'''
+        if self.stats is None:
+            return decoder(self, frame_data)
+        start = time.time()
+        frame_dict = decoder(self, frame_data)
+        self.stats.decode_seconds += time.time() - start
+        return frame_dict
+
+    def store_frame(self, frame_type, frame_size, frame_flags):
+        '''Streams the payload of the frame at the file position to the art store and passes the frame to the handler
+
+        Frames whose data is compressed, encrypted or otherwise not stored
+        as is are read whole instead.  The file is left at the next frame.
+        '''
+        offset = self.f.tell()
+        if self.version == 3:
+            transform_flags = 0x00e0
+        elif self.version == 4:
+            transform_flags = 0x004f
         else:
-            self.__print_error("Do not know frame type {0}".format(frame_type))
+            transform_flags = 0
+        if (frame_flags & transform_flags) != 0 or self.unsynchronized_frames:
+            self.parse_id3v2dot3_frame_data(frame_type, self.f.read(frame_size), frame_flags)
             return
 
-        self.__call_handler('on_id3v2dot3_frame', frame_type, frame_dict)
+        frame_data = self.f.read(min(frame_size, STORED_FRAME_FIRST_READ))
+        frame_dict = self.decode_frame_data(self.tag_frame_decoders[frame_type], frame_data)
+        payload = frame_dict.get(STORED_FRAME_FIELDS[frame_type])
+        if payload is not None:
+            payload_offset = len(frame_data) - len(payload)
+            if payload_offset == len(frame_data) < frame_size:
+                # The fields before the payload may run past the first read
+                self.f.seek(offset)
+                self.parse_id3v2dot3_frame_data(frame_type, self.f.read(frame_size), frame_flags)
+                return
+            self.pass_stored_frame(frame_type, frame_dict, offset + payload_offset, frame_size - payload_offset)
+        self.f.seek(offset + frame_size)
+
+    def pass_stored_frame(self, frame_type, frame_dict, payload_offset=None, payload_length=None):
+        '''Stores the payload of a decoded frame in the art store and passes the frame to the handler
+
+        The payload is streamed from payload_length bytes at payload_offset
+        in the file, if given, and otherwise taken from the decoded frame.
+        The handler is passed the payload's digest and length in its place.
+        '''
+        field = STORED_FRAME_FIELDS[frame_type]
+        payload = frame_dict.pop(field, None)
+        if payload is None:
+            # The frame could not be decoded
+            return
+        try:
+            if payload_offset is None:
+                payload_length = len(payload)
+                digest = self.art_store.put_buffer(payload, frame_dict['mime_type'])
+            else:
+                digest = self.art_store.put_file(self.f, payload_offset, payload_length, frame_dict['mime_type'])
+        except (IOError, OSError) as e:
+            self.print_error("Cannot store frame {0}: {1}".format(frame_type, e))
+            return
+        frame_dict['digest'] = digest
+        frame_dict[field + '_length'] = payload_length
+        self.on_id3v2dot3_frame_cb(frame_type, frame_dict)
 
     def parse_id3v2dot3_frame(self):
     
-        if self.f.tell() + 10 >= self.id3v2_size:
+        if self.f.tell() + self.frame_header_size >= self.id3v2_size:
             return False
         
-        frame_header = self.f.read(10)
+        frame_header = self.f.read(self.frame_header_size)
 
-        self.__call_handler('on_raw_id3v2dot3_frame_header', frame_header)
+        if self.on_raw_id3v2dot3_frame_header_cb:
+            self.on_raw_id3v2dot3_frame_header_cb(frame_header)
 
-        if (len(frame_header) <> 10):
-            self.__print_error("Frame header not 10 bytes")
+        if (len(frame_header) <> self.frame_header_size):
+            self.print_error("Frame header not {0:d} bytes".format(self.frame_header_size))
             return False
     
-        frame_type, frame_size, frame_flags = struct.unpack_from(">4sIH", frame_header)
+        frame_type, frame_size, frame_flags = self.unpack_frame_header(frame_header)
     
-        if frame_type == '\x00\x00\x00\x00':
+        if frame_type == self.padding_frame_type:
             return False
 
         if frame_size == 0:
             return False
 
-        self.__call_handler('on_id3v2dot3_frame_header', frame_type, frame_size, frame_flags)    
+        if self.stats is not None:
+            self.stats.add_frame(frame_type, frame_size)
+
+        if self.on_id3v2dot3_frame_header_cb:
+            self.on_id3v2dot3_frame_header_cb(frame_type, frame_size, frame_flags)
+
+        if self.on_id3v2dot3_frame_offset_cb:
+            self.on_id3v2dot3_frame_offset_cb(frame_type, frame_flags, self.f.tell(), frame_size)
+
+        if not self.__is_wanted_frame(frame_type):
+            self.f.seek(frame_size, os.SEEK_CUR)
+            return True
+
+        if self.art_store is not None and frame_type in STORED_FRAME_FIELDS and self.on_id3v2dot3_frame_cb:
+            self.store_frame(frame_type, frame_size, frame_flags)
+            return self.__frame_seen(frame_type)
 
         frame_data = self.f.read(frame_size)
         
-        self.__call_handler('on_raw_id3v2dot3_frame', frame_type, frame_data)
+        if self.on_raw_id3v2dot3_frame_cb:
+            self.on_raw_id3v2dot3_frame_cb(frame_type, frame_data)
 
-        self.parse_id3v2dot3_frame_data(frame_type, frame_data)
+        if self.on_id3v2dot3_frame_cb:
+            self.parse_id3v2dot3_frame_data(frame_type, frame_data, frame_flags)
         
-        return True
+        return self.__frame_seen(frame_type)
+
+    def parse_id3v2dot3_frame_at(self, tag, offset):
+        '''Parses a frame at an offset in a tag read whole
+
+        The offset is relative to the end of the ID3v2 header.  This returns
+        the offset of the next frame, or None at the end of the frames.
+        '''
+        if offset + self.frame_header_size >= len(tag):
+            if self.truncated_tag_size is not None and offset + self.frame_header_size < self.truncated_tag_size:
+                # The file ends before the tag, as the frame by frame walk finds when it reads the header
+                self.print_error("Frame header not {0:d} bytes".format(self.frame_header_size))
+            return None
+
+        frame_header = tag[offset:offset + self.frame_header_size]
+
+        if self.on_raw_id3v2dot3_frame_header_cb:
+            self.on_raw_id3v2dot3_frame_header_cb(frame_header)
+
+        frame_type, frame_size, frame_flags = self.unpack_frame_header(tag, offset)
+
+        if frame_type == self.padding_frame_type:
+            return None
+
+        if frame_size == 0:
+            return None
+
+        if self.stats is not None:
+            self.stats.add_frame(frame_type, frame_size)
+
+        if self.on_id3v2dot3_frame_header_cb:
+            self.on_id3v2dot3_frame_header_cb(frame_type, frame_size, frame_flags)
+
+        offset += self.frame_header_size
+        if self.on_id3v2dot3_frame_offset_cb and self.tag_file_offset is not None:
+            self.on_id3v2dot3_frame_offset_cb(frame_type, frame_flags, self.tag_file_offset + offset, frame_size)
+        if not self.__is_wanted_frame(frame_type):
+            return offset + frame_size
+
+        frame_data = tag[offset:offset + frame_size]
+
+        stored = self.art_store is not None and frame_type in STORED_FRAME_FIELDS and self.on_id3v2dot3_frame_cb
+        if self.on_raw_id3v2dot3_frame_cb and not stored:
+            self.on_raw_id3v2dot3_frame_cb(frame_type, frame_data)
+
+        if self.on_id3v2dot3_frame_cb:
+            self.parse_id3v2dot3_frame_data(frame_type, frame_data, frame_flags)
+
+        if not self.__frame_seen(frame_type):
+            return None
+        return offset + frame_size
 
     def parse_id3v2_file(self, path, aatpath, handler):
+        if self.stats is None:
+            self.__parse_id3v2_file(path, aatpath, handler)
+            return
+        start = time.time()
+        try:
+            self.__parse_id3v2_file(path, aatpath, handler)
+        finally:
+            self.stats.files += 1
+            self.stats.parse_seconds += time.time() - start
+
+    def __parse_id3v2_file(self, path, aatpath, handler):
         self.path = path
-        self.handler = handler
+        self.__bind_handler(handler)
         
-        self.__call_handler('on_path', path)
+        if self.on_path_cb:
+            self.on_path_cb(path)
     
         if aatpath:
             track = os.path.basename(path)
@@ -288,82 +710,291 @@ class ID3v2Parser(object):
             album = os.path.basename(toppath)
             toppath = os.path.dirname(toppath)
             artist = os.path.basename(toppath)
-            self.__call_handler('on_aatpath', artist, album, track)
+            if self.on_aatpath_cb:
+                self.on_aatpath_cb(artist, album, track)
     
-        with open(path, 'rb', 4096) as self.f:
+        # Unbuffered for whole tags, so the first read fetches the header and usually the whole tag
+        buffering = 0 if self.whole_tag else 4096
+        if self.stats is not None:
+            self.f = self.stats.open(path, 'rb', buffering)
+        else:
+            self.f = open(path, 'rb', buffering)
+
+        with self.f:
+            self.head = ''
+            self.audio_offset = 0
+            self.unseen_frame_types = None
+            self.seen_frame_types = set() if self.id3v1 == 'always' else None
+            self.id3v1_checked = False
+            self.__parse_id3v2_tag()
+            if (self.seen_frame_types is not None and self.walk_frames and not self.id3v1_checked
+                    and self.unseen_frame_types != set()):
+                self.parse_id3v1_tag()
+            if self.on_mpeg_audio_cb:
+                self.parse_mpeg_audio()
+            if self.on_mpeg_validation_cb:
+                self.validate_mpeg_audio()
+            self.head = None
+
+    def __parse_id3v2_tag(self):
+        '''Parses the ID3v2 tag at the start of the open file'''
+        if self.whole_tag:
+            self.head = self.f.read(WHOLE_TAG_FIRST_READ)
+            header = self.head[0:10]
+        else:
             header = self.f.read(10)
-    
-            self.__call_handler('on_raw_id3v2_header', header)
-            
-            if len(header) <> 10:
-                self.__print_error("No ID3v2 header")
-                return
-    
-            file_identifier, version, revision, flags = struct.unpack_from('3sbbb', header[0:6])
-            
-            if file_identifier != 'ID3':
-                self.__print_error("No ID3v2 identifier")
-                return
-            
-            if version == 255 or revision == 255:
-                self.__print_error("Invalid ID3v2 version")
-                return
-            
-            unsynchronization = False
-            compressed = False
-            extended_header = False
-            experimental = False
-            if version == 2:
-                unsynchronization = (flags & 0x80) != 0
-                compressed = (flags & 0x40) != 0
-            elif version == 3:
-                unsynchronization = (flags & 0x80) != 0
-                extended_header = (flags & 0x40) != 0
-                experimental = (flags & 0x20) != 0
-    
-            # Since just bytes are being unpacked, consider using ord()
-            size_bytes = struct.unpack('bbbb', header[6:10])
-            size = 0
-            for byte in size_bytes:
-                if byte > 127:
-                    self.__print_error("Invalid ID3v2 size byte")
-                    return
-                size = (size << 7) + byte
 
-            self.id3v2_size = size + 10
+        if self.on_raw_id3v2_header_cb:
+            self.on_raw_id3v2_header_cb(header)
+        
+        if len(header) <> 10:
+            self.__no_id3v2_tag("No ID3v2 header")
+            return
 
-            self.__call_handler('on_id3v2_header', version, revision, flags, size)
+        file_identifier, version, revision, flags = struct.unpack_from('3sbbb', header[0:6])
+        
+        if file_identifier != 'ID3':
+            self.__no_id3v2_tag("No ID3v2 identifier")
+            return
+        
+        if version == 255 or revision == 255:
+            self.print_error("Invalid ID3v2 version")
+            return
+        
+        unsynchronization = False
+        compressed = False
+        extended_header = False
+        experimental = False
+        if version == 2:
+            unsynchronization = (flags & 0x80) != 0
+            compressed = (flags & 0x40) != 0
+        elif version >= 3:
+            unsynchronization = (flags & 0x80) != 0
+            extended_header = (flags & 0x40) != 0
+            experimental = (flags & 0x20) != 0
 
-            if version <> 3:
-                self.__print_error("Version {0} is not 3".format(version))
+        # Since just bytes are being unpacked, consider using ord()
+        size_bytes = struct.unpack('BBBB', header[6:10])
+        size = 0
+        for byte in size_bytes:
+            if byte > 127:
+                self.print_error("Invalid ID3v2 size byte")
                 return
-            
+            size = (size << 7) + byte
+
+        self.id3v2_size = size + 10
+        self.audio_offset = self.id3v2_size
+        if version == 4 and (flags & 0x10) != 0:
+            # ID3v2.4 footer
+            self.audio_offset += 10
+        if self.stats is not None:
+            self.stats.add_tag(size)
+        if self.frame_types is not None:
+            self.unseen_frame_types = set(self.frame_types)
+
+        if self.on_id3v2_header_cb:
+            self.on_id3v2_header_cb(version, revision, flags, size)
+
+        if version < 2 or version > 4:
+            self.print_error("Version {0} is not 2, 3 or 4".format(version))
+            return
+
+        if compressed:
+            self.print_error("ID3v2.2 tag is compressed")
+            return
+
+        if not self.walk_frames:
+            return
+
+        self.__set_tag_version(version, unsynchronization)
+
+        in_memory = self.whole_tag or (unsynchronization and version < 4)
+        if (in_memory and self.art_store is not None and not (unsynchronization and version < 4)
+                and len(self.head) < 10 + size):
+            # Stream the payloads to the art store rather than reading the whole tag
+            in_memory = False
+            self.f.seek(10)
+
+        if in_memory:
+            # Offsets in the tag are 10 bytes from those in the file, unless the tag is unsynchronized
+            self.tag_file_offset = None if unsynchronization and version < 4 else 10
+            tag = self.head[10:10 + size]
+            if len(tag) < size:
+                tag += self.f.read(size - len(tag))
+            # The declared size of a tag cut short by the end of the file, whose frames are walked until the end
+            self.truncated_tag_size = size if len(tag) < size else None
+            if unsynchronization and version < 4:
+                tag = tag.replace('\xff\x00', '\xff')
+            offset = 0
+            if extended_header:
+                offset = get_extended_header_size(version, tag[0:4])
+            while offset is not None:
+                offset = self.parse_id3v2dot3_frame_at(tag, offset)
+        else:
+            if extended_header:
+                self.f.seek(get_extended_header_size(version, self.f.read(4)) - 4, os.SEEK_CUR)
             while self.parse_id3v2dot3_frame():
                 pass
 
-def unpack_string(bytes):
-    '''Unpacks a nul-terminated string
-    
+    def __set_tag_version(self, version, unsynchronization=False):
+        '''Set up the frame walking for a version of tag'''
+        self.version = version
+        # An ID3v2.4 tag is unsynchronized frame by frame, and older tags as a whole
+        self.unsynchronized_frames = unsynchronization and version == 4
+        if version == 2:
+            self.frame_header_size = 6
+            self.unpack_frame_header = unpack_id3v2dot2_frame_header
+            self.padding_frame_type = '\x00\x00\x00'
+            self.tag_frame_decoders = dict(self.frame_decoders)
+            self.tag_frame_decoders['APIC'] = ID3v2Parser.parse_pic_frame
+        else:
+            self.frame_header_size = 10
+            if version == 3:
+                self.unpack_frame_header = id3v2dot3_frame_header.unpack_from
+            else:
+                self.unpack_frame_header = unpack_id3v2dot4_frame_header
+            self.padding_frame_type = '\x00\x00\x00\x00'
+            self.tag_frame_decoders = self.frame_decoders
+
+    def __no_id3v2_tag(self, msg):
+        '''Falls back to an ID3v1 tag for a file with no ID3v2 tag, reporting msg if it has neither'''
+        if self.id3v1 and self.walk_frames:
+            if self.frame_types is not None:
+                self.unseen_frame_types = set(self.frame_types)
+            if self.parse_id3v1_tag():
+                return
+        self.print_error(msg)
+
+    def parse_id3v1_tag(self):
+        '''Parses an ID3v1 tag at the end of the file, passing its fields as ID3v2.3 frames
+
+        This returns whether the file has an ID3v1 tag.
+        '''
+        self.id3v1_checked = True
+        if 0 < len(self.head) < WHOLE_TAG_FIRST_READ:
+            # The first read was short, so it has the whole file
+            trailer = self.head[-128:]
+        else:
+            try:
+                self.f.seek(-128, os.SEEK_END)
+            except IOError:
+                return False
+            trailer = self.f.read(128)
+        if len(trailer) <> 128 or trailer[0:3] != 'TAG':
+            return False
+
+        tag = unpack_id3v1_tag(trailer, self.seen_frame_types)
+        self.tag_file_offset = None
+        self.truncated_tag_size = None
+        self.__set_tag_version(3)
+        offset = 0
+        while offset is not None:
+            offset = self.parse_id3v2dot3_frame_at(tag, offset)
+        return True
+
+    def parse_mpeg_audio(self):
+        '''Analyzes the MPEG audio following the tag and passes it to the handler'''
+        audio_dict = mp3_audio.analyze_mpeg_audio(self.f, self.audio_offset, self.head[self.audio_offset:])
+        if audio_dict is None:
+            self.print_error("No MPEG audio frame")
+            return
+        self.on_mpeg_audio_cb(audio_dict)
+
+    def validate_mpeg_audio(self):
+        '''Validates the whole MPEG audio stream following the tag and passes the findings to the handler'''
+        self.on_mpeg_validation_cb(mp3_audio.validate_mpeg_audio(self.f, self.audio_offset))
+
+def unpack_id3v1_tag(trailer, exclude_frame_types=None):
+    '''Unpacks an ID3v1 or ID3v1.1 tag into ID3v2.3 text, comment and genre frames
+
+    Empty fields, and fields of the frame types in exclude_frame_types,
+    are left out.  This returns the frames, in ID3v2.3 form.
+    '''
+    title, artist, album, year, comment, genre = struct.unpack_from('30s30s30s4s30sB', trailer, 3)
+    fields = [('TIT2', title), ('TPE1', artist), ('TALB', album), ('TYER', year)]
+    if comment[28] == '\x00' and comment[29] != '\x00':
+        # ID3v1.1 track number
+        fields.append(('TRCK', str(ord(comment[29]))))
+        comment = comment[0:28]
+    if genre < len(ID3V1_GENRES):
+        fields.append(('TCON', ID3V1_GENRES[genre]))
+
+    frames = []
+    for frame_type, value in fields:
+        value = value.split('\x00', 1)[0].rstrip(' ')
+        if value and not (exclude_frame_types and frame_type in exclude_frame_types):
+            frames.append(id3v2dot3_frame_header.pack(frame_type, len(value) + 1, 0) + '\x00' + value)
+    comment = comment.split('\x00', 1)[0].rstrip(' ')
+    if comment and not (exclude_frame_types and 'COMM' in exclude_frame_types):
+        frames.append(id3v2dot3_frame_header.pack('COMM', len(comment) + 5, 0) + '\x00XXX\x00' + comment)
+    return ''.join(frames)
+
+def unsynchsafe(value):
+    '''Decode a synchsafe integer, with 7 bits in each byte'''
+    return (value & 0x7f) | ((value >> 1) & 0x3f80) | ((value >> 2) & 0x1fc000) | ((value >> 3) & 0xfe00000)
+
+def synchsafe(value):
+    '''Encode a synchsafe integer, with 7 bits in each byte, undoing unsynchsafe'''
+    return (value & 0x7f) | ((value & 0x3f80) << 1) | ((value & 0x1fc000) << 2) | ((value & 0xfe00000) << 3)
+
+def get_extended_header_size(version, size_bytes):
+    '''Get the size of an extended header, including its size, from its size bytes'''
+    if len(size_bytes) < 4:
+        return len(size_bytes)
+    size = struct.unpack('>I', size_bytes)[0]
+    if version == 3:
+        return size + 4
+    return unsynchsafe(size)
+
+def unpack_id3v2dot2_frame_header(bytes, offset=0):
+    '''Unpacks an ID3v2.2 frame header, returning (frame_type, frame_size, frame_flags)
+
+    The frame type is given as the equivalent ID3v2.3 frame type, if any,
+    and the flags, which ID3v2.2 does not have, as 0.
+    '''
+    frame_type, size_high, size_low = struct.unpack_from('>3sBH', bytes, offset)
+    return (ID3V2DOT2_FRAME_TYPES.get(frame_type, frame_type), (size_high << 16) | size_low, 0)
+
+def unpack_id3v2dot4_frame_header(bytes, offset=0):
+    '''Unpacks an ID3v2.4 frame header, with its synchsafe size, returning (frame_type, frame_size, frame_flags)'''
+    frame_type, frame_size, frame_flags = id3v2dot3_frame_header.unpack_from(bytes, offset)
+    return (frame_type, unsynchsafe(frame_size), frame_flags)
+
+def unpack_text(encoding, bytes, offset=0):
+    '''Unpacks a nul-terminated string in an ID3v2 text encoding starting at an offset
+
+    ISO-8859-1 strings are returned as byte strings and others as unicode.
     This returns a tuple of (number-of-bytes-consumed, string)
     '''
-    i = 0
-    while i < len(bytes):
-        if ord(bytes[i]) == 0:
-            return (i + 1, bytes[0:i])
-        i += 1
-        
-    return (len(bytes), '')
+    if encoding == 0:
+        return unpack_string(bytes, offset)
+    if encoding == 3:
+        consumed, string = unpack_string(bytes, offset)
+        return (consumed, string.decode('utf-8'))
+    return unpack_unicode(bytes, offset, TEXT_CODECS[encoding])
 
-def unpack_unicode(bytes):
-    '''Unpacks a nul-terminated unicode string
+def unpack_string(bytes, offset=0):
+    '''Unpacks a nul-terminated string starting at an offset
     
     This returns a tuple of (number-of-bytes-consumed, string)
     '''
-    i = 0
-    while i + 1 < len(bytes):
-        uch = struct.unpack_from('<H', bytes[i:i+2])[0]
-        if uch == 0:
-            return (i + 2, bytes[0:i].decode('utf-16'))
-        i += 2
+    end = bytes.find('\0', offset)
+    if end < 0:
+        return (len(bytes) - offset, '')
+
+    return (end + 1 - offset, bytes[offset:end])
+
+def unpack_unicode(bytes, offset=0, codec='utf-16'):
+    '''Unpacks a nul-terminated unicode string starting at an offset
     
-    return (len(bytes), u'')
+    The terminator is a pair of nul bytes at an even distance from the
+    offset.  The string is UTF-16 with a byte order mark unless another
+    codec is given.  This returns a tuple of (number-of-bytes-consumed, string)
+    '''
+    end = bytes.find('\0\0', offset)
+    while end >= 0 and (end - offset) % 2 != 0:
+        end = bytes.find('\0\0', end + 1)
+    if end < 0:
+        return (len(bytes) - offset, u'')
+
+    return (end + 2 - offset, bytes[offset:end].decode(codec))
@@ -0,0 +1,157 @@
+# Copyright (c) 2013, pynewb
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice, this list
+#     of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice, this
+#     list of conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution.
+#   * Neither the name of pynewb nor the names of its contributors may be used to endorse
+#     or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''Sorts and spools more records than fit in memory, through temporary run files
+
+An ExternalSorter keeps records in memory up to a limit, then sorts them
+and writes them to a run file, and merges the runs as the records are
+read back, so memory use is bounded by the limit rather than the number
+of records.  Records are tuples of strings, numbers and None, as written
+by marshal, and are sorted in their natural order.
+'''
+
+from __future__ import print_function
+
+import heapq
+import marshal
+import os
+import tempfile
+
+# Records kept in memory by a sorter before they are written to a run
+DEFAULT_BUFFER_RECORDS = 100000
+
+# Most runs merged at once; more are first merged into longer runs
+MAX_MERGE_RUNS = 64
+
+def write_records(records, temp_dir=None):
+    '''Write records to a new temporary file, returning its path'''
+    fd, path = tempfile.mkstemp(prefix='mp3sort', suffix='.run', dir=temp_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for record in records:
+                marshal.dump(record, f)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+def read_records(path):
+    '''Yield the records of a file written by write_records'''
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                record = marshal.load(f)
+            except EOFError:
+                return
+            yield record
+
+class RecordSpool(object):
+    '''Records written to a temporary file as they are added, to be read back in order, any number of times'''
+
+    def __init__(self, temp_dir=None):
+        fd, self.path = tempfile.mkstemp(prefix='mp3spool', suffix='.run', dir=temp_dir)
+        self.f = os.fdopen(fd, 'wb')
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, record):
+        '''Add a record'''
+        marshal.dump(record, self.f)
+        self.count += 1
+
+    def __iter__(self):
+        '''Yield the records in the order they were added'''
+        if not self.f.closed:
+            self.f.close()
+        return read_records(self.path)
+
+    def close(self):
+        '''Remove the file'''
+        if not self.f.closed:
+            self.f.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+class ExternalSorter(object):
+    '''Sorts records, keeping at most buffer_records of them in memory
+
+    Add the records, then iterate over the sorter once for them in order.
+    Records fewer than buffer_records are sorted in memory.  Close the
+    sorter to remove its run files.
+    '''
+
+    def __init__(self, buffer_records=DEFAULT_BUFFER_RECORDS, temp_dir=None):
+        self.buffer_records = max(buffer_records, 1)
+        self.temp_dir = temp_dir
+        self.buffer = []
+        self.runs = []
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, record):
+        '''Add a record'''
+        self.buffer.append(record)
+        self.count += 1
+        if len(self.buffer) >= self.buffer_records:
+            self.__spill()
+
+    def __spill(self):
+        '''Sort the records in memory and write them to a run'''
+        self.buffer.sort()
+        self.runs.append(write_records(self.buffer, self.temp_dir))
+        self.buffer = []
+
+    def __iter__(self):
+        '''Yield the records in order'''
+        if not self.runs:
+            self.buffer.sort()
+            records, self.buffer = self.buffer, []
+            return iter(records)
+        if self.buffer:
+            self.__spill()
+        while len(self.runs) > MAX_MERGE_RUNS:
+            runs, self.runs = self.runs[:MAX_MERGE_RUNS], self.runs[MAX_MERGE_RUNS:]
+            self.runs.append(write_records(heapq.merge(*[read_records(run) for run in runs]), self.temp_dir))
+            for run in runs:
+                os.unlink(run)
+        return heapq.merge(*[read_records(run) for run in self.runs])
+
+    def close(self):
+        '''Remove the run files'''
+        for run in self.runs:
+            if os.path.exists(run):
+                os.unlink(run)
+        self.runs = []
+        self.buffer = []
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2013, pynewb
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice, this list
+#     of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice, this
+#     list of conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution.
+#   * Neither the name of pynewb nor the names of its contributors may be used to endorse
+#     or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''Indexes the frames of ID3v2 tags by offset, so their data can be read later without parsing
+
+A frame index lists the type, flags, offset in the file and size of each
+frame of a file's tag.  It is built by parsing the tag with ID3v2Parser
+for on_id3v2dot3_frame_offset events, which skips over the frame data,
+and can be kept in a mp3_cache.FileInfoCache while the file is unchanged.
+The frames of an index are LazyFrames, which read their data with a
+positioned read, and decode it, only when it is first wanted.
+
+Run as a script to index the files in directory trees:
+
+    python mp3_frame_index.py ~/Music --cache ~/mp3.db --frame-types APIC,USLT
+'''
+
+from __future__ import print_function
+
+import argparse
+import os
+import os.path
+import sys
+
+import mp3_cache
+import mp3_event_parser
+import mp3_walk
+
+def pread(fd, size, offset):
+    '''Read size bytes at an offset of a file descriptor, without using its position where the platform allows'''
+    if hasattr(os, 'pread'):
+        return os.pread(fd, size, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    chunks = []
+    while size > 0:
+        chunk = os.read(fd, size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size -= len(chunk)
+    return ''.join(chunks)
+
+class LazyFrame(object):
+    '''A frame of a FrameIndex, whose data is read and decoded on first access'''
+
+    __slots__ = ('index', 'frame_type', 'frame_flags', 'offset', 'size', '_data', '_frame_dict', '_decoded')
+
+    def __init__(self, index, frame_type, frame_flags, offset, size):
+        self.index = index
+        self.frame_type = frame_type
+        self.frame_flags = frame_flags
+        self.offset = offset
+        self.size = size
+        self._data = None
+        self._frame_dict = None
+        self._decoded = False
+
+    @property
+    def data(self):
+        '''The frame data as stored in the file'''
+        if self._data is None:
+            self._data = self.index.read(self.offset, self.size)
+        return self._data
+
+    @property
+    def frame_dict(self):
+        '''The decoded frame, as passed to on_id3v2dot3_frame, or None if it cannot be decoded'''
+        if not self._decoded:
+            self._frame_dict = self.index.decode(self)
+            self._decoded = True
+        return self._frame_dict
+
+    def __repr__(self):
+        return 'LazyFrame({0!r}, {1:#06x}, {2:d}, {3:d})'.format(self.frame_type, self.frame_flags, self.offset, self.size)
+
+class FrameIndex(object):
+    '''The frames of the tag of a file, by offset
+
+    entries is a list of (frame_type, frame_flags, offset, frame_size),
+    and frames a LazyFrame for each.  version and flags are those of the
+    tag, and are None for a file with no ID3v2 tag.  The file is opened
+    on the first read of frame data and kept open until close().
+    '''
+
+    def __init__(self, path, version, flags, entries):
+        self.path = path
+        self.version = version
+        self.flags = flags
+        self.entries = entries
+        self.frames = [LazyFrame(self, *entry) for entry in entries]
+        self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def get_frames(self, frame_type):
+        '''Get the frames of a type'''
+        return [frame for frame in self.frames if frame.frame_type == frame_type]
+
+    def read(self, offset, size):
+        '''Read size bytes at an offset of the file'''
+        if self.fd is None:
+            self.fd = os.open(self.path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        data = pread(self.fd, size, offset)
+        if len(data) != size:
+            raise IOError("{0} ends {1:d} bytes short of a frame".format(self.path, size - len(data)))
+        return data
+
+    def decode(self, frame):
+        '''Decode the data of a frame, returning None if it cannot be decoded'''
+        global _decoder
+        if _decoder is None:
+            _decoder = mp3_event_parser.ID3v2Parser()
+        unsynchronization = self.version == 4 and (self.flags & 0x80) != 0
+        return _decoder.decode_frame(self.path, self.version, frame.frame_type, frame.data, frame.frame_flags,
+                                     unsynchronization)
+
+    def close(self):
+        '''Close the file, if it was opened to read frame data'''
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+_decoder = None
+
+class FrameIndexBuilder(object):
+    '''A handler for the ID3v2 file parser that builds a FrameIndex
+
+    The frames of ID3v2.2 and ID3v2.3 tags unsynchronized as a whole are
+    not stored as is, so are left out of the index.
+    '''
+
+    def __init__(self):
+        '''Initialize members'''
+        self.path = None
+        self.version = None
+        self.flags = None
+        self.entries = []
+        self.errors = []
+
+    def get_frame_index(self):
+        '''Get the FrameIndex of the file'''
+        return FrameIndex(self.path, self.version, self.flags, self.entries)
+
+    def on_error(self, msg):
+        self.errors.append(msg)
+
+    def on_id3v2_header(self, version, revision, flags, size):
+        self.version = version
+        self.flags = flags & 0xff
+
+    def on_id3v2dot3_frame_offset(self, frame_type, frame_flags, offset, frame_size):
+        self.entries.append((frame_type, frame_flags, offset, frame_size))
+
+    def on_path(self, path):
+        self.path = path
+
+def build_frame_index(path, parser=None):
+    '''Parse the tag of a file for its FrameIndex, skipping over the frame data'''
+    if parser is None:
+        parser = mp3_event_parser.ID3v2Parser()
+    builder = FrameIndexBuilder()
+    parser.parse_id3v2_file(path, False, builder)
+    return builder.get_frame_index()
+
+def get_frame_index(path, cache=None, parser=None):
+    '''Get the FrameIndex of a file, from a FileInfoCache while the file is unchanged
+
+    If a cache is given, an index built by parsing the file is stored in it.
+    '''
+    if cache is None:
+        return build_frame_index(path, parser)
+    st = os.stat(path)
+    cached = cache.get_frame_index(path, st)
+    if cached is not None:
+        return FrameIndex(path, *cached)
+    index = build_frame_index(path, parser)
+    cache.put_frame_index(path, st, index.version, index.flags, index.entries)
+    return index
+
+def main():
+    parser = argparse.ArgumentParser(description='Index the frames of the ID3v2 tags of MP3 files by offset')
+    parser.add_argument('directories', metavar='directory', nargs='+',
+                        help='The directories to traverse')
+    parser.add_argument('--extensions', default='mp3',
+                        help='Comma-separated extensions of the files to index, in any case (default is mp3)')
+    parser.add_argument('--cache', metavar='PATH',
+                        help='Keep the frame indexes in the SQLite database at PATH')
+    parser.add_argument('--frame-types', default='',
+                        help='Frame types to list (default is all)')
+    parser.add_argument('--decode', action='store_true',
+                        help='Read and decode the listed frames')
+    args = parser.parse_args()
+
+    cache = None
+    if args.cache:
+        cache = mp3_cache.FileInfoCache(os.path.expanduser(args.cache))
+    frame_types = frozenset(args.frame_types.split(',')) if args.frame_types else None
+    index_parser = mp3_event_parser.ID3v2Parser()
+    for directory in args.directories:
+        for path in mp3_walk.walk_files(os.path.expanduser(directory), args.extensions.split(',')):
+            with get_frame_index(path, cache, index_parser) as index:
+                print(path)
+                for frame in index:
+                    if frame_types is not None and frame.frame_type not in frame_types:
+                        continue
+                    print("type: {0} flags: {1:04x} offset: {2:d} size: {3:d}".format(
+                        frame.frame_type, frame.frame_flags, frame.offset, frame.size))
+                    if args.decode and frame.frame_dict is not None:
+                        for key, value in sorted(frame.frame_dict.iteritems()):
+                            if isinstance(value, memoryview):
+                                value = '<{0:d} bytes>'.format(len(value))
+                            print("{0:>40s} : {1!r}".format(key, value))
+    if cache is not None:
+        cache.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+# Copyright (c) 2013, pynewb
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice, this list
+#     of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice, this
+#     list of conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution.
+#   * Neither the name of pynewb nor the names of its contributors may be used to endorse
+#     or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import print_function
+
+import array
+import difflib
+import re
+import unicodedata
+
+# Lowest score of a fuzzy match
+MIN_FUZZY_SCORE = 0.85
+
+# Blocks with more files than this, such as those of common words, are not searched
+MAX_BLOCK_SIZE = 1000
+
+# Most candidates scored for a fuzzy match
+MAX_CANDIDATES = 64
+
+# Factor applied to the score of a fuzzy match with a different track number
+TRACK_MISMATCH_FACTOR = 0.8
+
+featuring_pattern = re.compile(r'\s*[\(\[]?\b(?:feat|ft|featuring)\b.*$', re.UNICODE)
+non_word_pattern = re.compile(r'[\W_]+', re.UNICODE)
+track_pattern = re.compile(r'\s*0*(\d+)')
+
+def normalize_text(value):
+    '''Normalize a tag value for matching
+
+    Case, accents, punctuation, runs of whitespace, NUL padding, a leading
+    "The " and any "feat." suffix are dropped.
+    '''
+    if isinstance(value, str):
+        value = value.decode('latin-1')
+    value = value.replace(u'\x00', u' ').lower()
+    try:
+        value.encode('ascii')
+    except UnicodeError:
+        value = unicodedata.normalize('NFKD', value)
+        value = u''.join(c for c in value if not unicodedata.combining(c))
+    value = featuring_pattern.sub(u'', value.replace(u'&', u' and '))
+    value = non_word_pattern.sub(u' ', value).strip()
+    if value.startswith(u'the '):
+        value = value[4:]
+    return value
+
+def normalize_track(value):
+    '''Normalize a track number for matching, so "03" and "3/12" are both "3"'''
+    if isinstance(value, str):
+        value = value.decode('latin-1')
+    m = track_pattern.match(value)
+    if m:
+        return m.group(1)
+    return value.strip()
+
+# Weights of the fields in the score of a fuzzy match, most distinguishing first
+SCORE_WEIGHTS = (('title', 0.4), ('album', 0.3), ('artist', 0.3))
+
+def get_normalized(normalized, function, value):
+    '''Get a normalized value from a dict of those already normalized, adding it if new'''
+    key = (function, value)
+    result = normalized.get(key)
+    if result is None:
+        result = normalized[key] = function(value)
+    return result
+
+class MatchKeys(object):
+    '''The normalized fields of a FileInfo, computed once for all of the tiers'''
+
+    __slots__ = ('artist', 'album', 'title', 'trknum')
+
+    def __init__(self, file_info, normalized=None):
+        '''Normalize the fields of a FileInfo
+
+        The artist, album and track number repeat across files, so they are
+        looked up in a dict of (function, value) to normalized value, if
+        given, and the normalized values are shared.
+        '''
+        if normalized is None:
+            normalized = {}
+        self.artist = get_normalized(normalized, normalize_text, file_info.tpe1 or file_info.tpe2)
+        self.album = get_normalized(normalized, normalize_text, file_info.talb)
+        self.title = normalize_text(file_info.tit2)
+        self.trknum = get_normalized(normalized, normalize_track, file_info.trck)
+
+    def get_block_tokens(self):
+        '''Get the tokens under which a file is indexed for fuzzy matching'''
+        tokens = set(u'a:' + token for token in (self.artist + u' ' + self.album).split())
+        tokens.update(u't:' + token for token in self.title.split())
+        return tokens
+
+class Scorer(object):
+    '''Scores the similarity of files to one file, from 0 to 1
+
+    Each field is compared with a SequenceMatcher which keeps the field of
+    the one file as its indexed second sequence, and a candidate is given
+    up as soon as the cheap upper bounds of the matcher show it cannot
+    reach the score it needs.
+    '''
+
+    def __init__(self, keys):
+        '''Set up a matcher for each field of the MatchKeys of a file'''
+        self.keys = keys
+        self.fields = [(name, weight, difflib.SequenceMatcher(None, u'', getattr(keys, name)))
+                       for name, weight in SCORE_WEIGHTS]
+
+    def score(self, other, min_score):
+        '''Get the score of the MatchKeys of another file, or None if it is below min_score'''
+        factor = 1.0
+        if self.keys.trknum and other.trknum and self.keys.trknum != other.trknum:
+            factor = TRACK_MISMATCH_FACTOR
+        needed = min_score / factor
+        score = 0.0
+        remaining = 1.0
+        for name, weight, matcher in self.fields:
+            remaining -= weight
+            value = getattr(other, name)
+            if value == matcher.b:
+                score += weight
+                continue
+            floor = (needed - score - remaining) / weight
+            matcher.set_seq1(value)
+            if floor > 0 and (matcher.real_quick_ratio() < floor or matcher.quick_ratio() < floor):
+                return None
+            score += weight * matcher.ratio()
+            if score + remaining < needed:
+                return None
+        return score * factor
+
+class KeyTier(object):
+    '''A match tier for files with equal keys
+
+    get_key is called with a FileInfo and its MatchKeys, and returns None
+    for a file which cannot be matched in this tier.  The first file added
+    with a key is the one matched.  Rows are indexed by the hash of their
+    key, and the key is computed again from the row to confirm a match,
+    so the keys of the compare files are not kept.
+    '''
+
+    def __init__(self, name, get_key, message=None):
+        '''Initialize the index
+
+        message is a format for reporting a match, of the source path, the
+        matched path, the score and the tier name, or None to not report it.
+        '''
+        self.name = name
+        self.get_key = get_key
+        self.message = message
+        self.index = {}
+        # Rows by key, for keys whose hash is taken by a different key
+        self.collisions = {}
+
+    def __get_row_key(self, matcher, row):
+        '''Get the key of a row'''
+        return self.get_key(matcher.file_infos[row], matcher.keys[row])
+
+    def add(self, matcher, row):
+        '''Index a row, returning the row already indexed with the same key, if any'''
+        key = self.__get_row_key(matcher, row)
+        if key is None:
+            return None
+        existing = self.index.setdefault(hash(key), row)
+        if existing == row:
+            return None
+        if self.__get_row_key(matcher, existing) != key:
+            existing = self.collisions.setdefault(key, row)
+            if existing == row:
+                return None
+        return existing
+
+    def match(self, matcher, file_info, keys):
+        '''Get a (row, score) match for a file, or None'''
+        key = self.get_key(file_info, keys)
+        if key is None:
+            return None
+        row = self.index.get(hash(key))
+        if row is None:
+            return None
+        if self.__get_row_key(matcher, row) != key:
+            row = self.collisions.get(key)
+            if row is None:
+                return None
+        return (row, 1.0)
+
+class PathTier(object):
+    '''A match tier for files matched by some other means, such as their audio'''
+
+    def __init__(self, name, message=None):
+        '''Initialize the matches, of source paths to rows'''
+        self.name = name
+        self.message = message
+        self.matches = {}
+
+    def add(self, matcher, row):
+        '''Rows are not indexed'''
+        return None
+
+    def match(self, matcher, file_info, keys):
+        '''Get a (row, score) match for a file, or None'''
+        row = self.matches.get(file_info.path)
+        if row is None:
+            return None
+        return (row, 1.0)
+
+class FuzzyTier(object):
+    '''A match tier for files with similar fields
+
+    Rows are indexed in blocks by the words of their artist, album and
+    title, and a file is only scored against the rows in its smallest
+    blocks, so matching stays near-linear in the number of files.
+    '''
+
+    def __init__(self, name, min_score=MIN_FUZZY_SCORE, message=None):
+        '''Initialize the blocks'''
+        self.name = name
+        self.min_score = min_score
+        self.message = message
+        self.blocks = {}
+
+    def add(self, matcher, row):
+        '''Index a row in its blocks'''
+        for token in matcher.keys[row].get_block_tokens():
+            block = self.blocks.get(token)
+            if block is None:
+                block = self.blocks[token] = array.array('l')
+            block.append(row)
+        return None
+
+    def match(self, matcher, file_info, keys):
+        '''Get the best (row, score) match for a file with at least the minimum score, or None'''
+        blocks = sorted((self.blocks[token] for token in keys.get_block_tokens() if token in self.blocks), key=len)
+        scorer = Scorer(keys)
+        best = None
+        best_score = self.min_score
+        scored = set()
+        for block in blocks:
+            if len(block) > MAX_BLOCK_SIZE or len(scored) >= MAX_CANDIDATES:
+                break
+            for row in block:
+                if len(scored) >= MAX_CANDIDATES:
+                    break
+                if row in scored:
+                    continue
+                scored.add(row)
+                score = scorer.score(matcher.keys[row], best_score)
+                if score is not None and score >= best_score:
+                    best, best_score = row, score
+        if best is None:
+            return None
+        return (best, best_score)
+
+class Matcher(object):
+    '''A pipeline of match tiers, tried in order, matching source files to compare files
+
+    The compare files are kept in rows, of their FileInfo and MatchKeys,
+    and the tiers index them by row number.
+    '''
+
+    def __init__(self, tiers):
+        '''Initialize with a list of tiers'''
+        self.tiers = tiers
+        self.file_infos = []
+        self.keys = []
+        self.normalized = {}
+
+    def add(self, file_info):
+        '''Index a compare file in every tier, returning a list of (tier, file_info) for files it collides with'''
+        row = len(self.file_infos)
+        self.file_infos.append(file_info)
+        self.keys.append(MatchKeys(file_info, self.normalized))
+        collisions = []
+        for tier in self.tiers:
+            existing = tier.add(self, row)
+            if existing is not None:
+                collisions.append((tier, self.file_infos[existing]))
+        return collisions
+
+    def match(self, file_info):
+        '''Match a source file, returning (tier, file_info, score), or (None, None, None) if nothing matches'''
+        keys = MatchKeys(file_info, self.normalized)
+        for tier in self.tiers:
+            found = tier.match(self, file_info, keys)
+            if found is not None:
+                return (tier, self.file_infos[found[0]], found[1])
+        return (None, None, None)
+
+def get_normalized_artist_album_trknum(file_info, keys):
+    '''Get the normalized artist/album/trknum/title, or None without a title'''
+    if not keys.title:
+        return None
+    return (keys.artist, keys.album, keys.trknum, keys.title)
+
+def get_normalized_artist_album_track(file_info, keys):
+    '''Get the normalized artist/album/title, or None without a title'''
+    if not keys.title:
+        return None
+    return (keys.artist, keys.album, keys.title)
+
+def get_normalized_tiers():
+    '''Get the tiers matching normalized fields, from exact to fuzzy'''
+    message = '{0} matches {1} on {3} with score {2:.2f}'
+    return [KeyTier('normalized artist/album/trknum', get_normalized_artist_album_trknum, message),
+            KeyTier('normalized artist/album/track', get_normalized_artist_album_track, message),
+            FuzzyTier('fuzzy artist/album/track', message=message)]
@@ -0,0 +1,227 @@
+# Copyright (c) 2013, pynewb
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice, this list
+#     of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice, this
+#     list of conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution.
+#   * Neither the name of pynewb nor the names of its contributors may be used to endorse
+#     or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import print_function
+
+import collections
+import multiprocessing
+import Queue
+import traceback
+
+import mp3_event_parser
+import mp3_stats
+
+DEFAULT_BATCH_SIZE = 32
+
+# Seconds between checks for failed batches, which never call back, while waiting for unordered results
+FAILED_BATCH_POLL_INTERVAL = 1.0
+
+class PickledView(str):
+    '''The bytes of a memoryview in a recorded frame dict, which can be pickled'''
+
+def pack_args(args):
+    '''Copy memoryviews in frame dict arguments into PickledViews'''
+    packed = []
+    for arg in args:
+        if isinstance(arg, dict):
+            arg = dict((key, PickledView(value.tobytes()) if isinstance(value, memoryview) else value)
+                       for key, value in arg.iteritems())
+        packed.append(arg)
+    return tuple(packed)
+
+def unpack_args(args):
+    '''Restore memoryviews in frame dict arguments from PickledViews'''
+    unpacked = []
+    for arg in args:
+        if isinstance(arg, dict):
+            arg = dict((key, memoryview(str(value)) if isinstance(value, PickledView) else value)
+                       for key, value in arg.iteritems())
+        unpacked.append(arg)
+    return tuple(unpacked)
+
+class EventRecorder(object):
+    '''A handler for the ID3v2 file parser that records the events it receives
+
+    The recorded events are a list of (method, args) tuples which can be
+    sent back to another process and replayed to a real handler.  Any
+    memoryviews in the arguments are copied so they can be pickled.
+    '''
+
+    def __init__(self, event_names):
+        '''Implement only the named events so the parser skips the others'''
+        self.events = []
+        for name in event_names:
+            setattr(self, name, self.__recorder(name))
+
+    def __recorder(self, name):
+        '''Make a callback which records the named event'''
+        def record(*args):
+            self.events.append((name, pack_args(args)))
+        return record
+
+def get_handler_events(handler):
+    '''Get the names of the events a handler implements'''
+    return tuple(name for name in mp3_event_parser.HANDLER_EVENTS if callable(getattr(handler, name, None)))
+
+def replay_events(events, handler):
+    '''Replay recorded events to a handler'''
+    for name, args in events:
+        cb = getattr(handler, name, None)
+        if callable(cb):
+            cb(*unpack_args(args))
+
+def parse_file(parser, path, aatpath, handler, unreadable_errors=False):
+    '''Parse a file, passing an IOError or OSError from opening or reading it to on_error if unreadable_errors is set
+
+    Otherwise the error is raised, as by the parser.
+    '''
+    try:
+        parser.parse_id3v2_file(path, aatpath, handler)
+    except (IOError, OSError) as e:
+        if not unreadable_errors:
+            raise
+        on_error = getattr(handler, 'on_error', None)
+        if callable(on_error):
+            on_error(e.strerror or str(e))
+
+_parser = None
+
+def _init_worker(parser_options):
+    '''Create the parser used by a worker process'''
+    global _parser
+    if parser_options.get('stats') is not None:
+        # Each worker counts from zero; its counts are merged in the parent
+        parser_options = dict(parser_options, stats=mp3_stats.ParserStats())
+    _parser = mp3_event_parser.ID3v2Parser(**parser_options)
+
+def _parse_batch(paths, aatpath, event_names, unreadable_errors=False):
+    '''Parse a batch of files in a worker process
+
+    This returns a tuple of (results, error, stats), where results is a
+    list of (path, events), error is a formatted traceback if the batch
+    failed and stats is the parser's ParserStats for the batch, if any
+    '''
+    results = []
+    error = None
+    try:
+        for path in paths:
+            recorder = EventRecorder(event_names)
+            parse_file(_parser, path, aatpath, recorder, unreadable_errors)
+            results.append((path, recorder.events))
+    except Exception:
+        error = traceback.format_exc()
+    stats = _parser.stats
+    if stats is not None:
+        _parser.stats = mp3_stats.ParserStats()
+    return (results, error, stats)
+
+def _batches(paths, batch_size):
+    '''Group an iterable of paths into lists of at most batch_size'''
+    batch = []
+    for path in paths:
+        batch.append(path)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _check_batch(batch_result, stats):
+    '''Get the results of a batch, raising if the worker failed'''
+    results, error, batch_stats = batch_result
+    if stats is not None and batch_stats is not None:
+        stats.merge(batch_stats)
+    if error:
+        raise RuntimeError('Worker failed parsing batch:\n' + error)
+    return results
+
+def parse_files(paths, aatpath, event_names, jobs=None, batch_size=DEFAULT_BATCH_SIZE, ordered=False, window=None, parser_options=None,
+                unreadable_errors=False):
+    '''Parse files in a pool of worker processes
+
+    This is a generator of (path, events) tuples, where events are the
+    recorded parser events for the file.  Paths are consumed lazily and at
+    most window batches are in flight at once.  If ordered is set, results
+    are yielded in the order of paths, holding completed batches in a
+    reorder buffer no larger than window; otherwise they are yielded as
+    soon as each batch completes.  The workers' parsers are created with
+    the keyword arguments in parser_options.  If those include stats, the
+    workers' statistics are merged into it as batches complete.  Files
+    which cannot be read are reported as errors if unreadable_errors is
+    set, as by parse_file, rather than failing their batch.
+    '''
+    if not jobs:
+        jobs = multiprocessing.cpu_count()
+    if not window:
+        window = jobs * 4
+
+    parser_options = parser_options or {}
+    stats = parser_options.get('stats')
+    pool = multiprocessing.Pool(jobs, _init_worker, (parser_options,))
+    pending = collections.deque()
+    # Unordered batches in flight by number, and the (number, result) of those done
+    unordered = {}
+    completed = Queue.Queue()
+    in_flight = 0
+
+    def next_batch():
+        if ordered:
+            return _check_batch(pending.popleft().get(), stats)
+        while True:
+            try:
+                # A timeout keeps the wait interruptible
+                number, batch_result = completed.get(True, FAILED_BATCH_POLL_INTERVAL)
+            except Queue.Empty:
+                # A batch which raised, or whose result could not be pickled, never calls back; get() raises its error
+                for async_result in unordered.itervalues():
+                    if async_result.ready() and not async_result.successful():
+                        async_result.get()
+                continue
+            del unordered[number]
+            return _check_batch(batch_result, stats)
+
+    try:
+        for number, batch in enumerate(_batches(paths, batch_size)):
+            args = (batch, aatpath, event_names, unreadable_errors)
+            if ordered:
+                pending.append(pool.apply_async(_parse_batch, args))
+            else:
+                unordered[number] = pool.apply_async(
+                    _parse_batch, args, callback=lambda batch_result, number=number: completed.put((number, batch_result)))
+            in_flight += 1
+            if in_flight >= window:
+                for result in next_batch():
+                    yield result
+                in_flight -= 1
+
+        while in_flight > 0:
+            for result in next_batch():
+                yield result
+            in_flight -= 1
+    finally:
+        # terminate() can deadlock in Python 2 while a worker is writing a
+        # result, so let the batches in flight, at most window, finish
+        pool.close()
+        pool.join()
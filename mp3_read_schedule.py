@@ -0,0 +1,225 @@
+# Copyright (c) 2013, pynewb
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice, this list
+#     of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice, this
+#     list of conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution.
+#   * Neither the name of pynewb nor the names of its contributors may be used to endorse
+#     or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''Orders the reads of a scan by where the files are on disk
+
+Reading tags in walk order sends a spinning disk seeking back and forth
+across the archive.  A ReadScheduler takes the files of a walk a window
+at a time and hands them on sorted by inode number, which on most
+filesystems follows where the files were allocated, or by the physical
+offset of each file's first extent, from the FIEMAP ioctl on Linux.  As
+it hands on each file, it asks the kernel to read ahead the headers of
+the files a little further on, with posix_fadvise(POSIX_FADV_WILLNEED),
+so the disk works through them in order while earlier files are parsed.
+'''
+
+from __future__ import print_function
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import sys
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import mp3_event_parser
+import mp3_walk
+
+# Orders in which files can be read
+ORDERS = ('walk', 'inode', 'extent')
+
+# Files sorted together
+DEFAULT_WINDOW = 1024
+
+# Files whose headers are read ahead of the file being read
+DEFAULT_READAHEAD = 32
+
+# Bytes read ahead at the start of each file, enough for most tags
+READAHEAD_BYTES = mp3_event_parser.WHOLE_TAG_FIRST_READ
+
+# posix_fadvise advice, as in fcntl.h
+POSIX_FADV_WILLNEED = 3
+POSIX_FADV_DONTNEED = 4
+
+# The FIEMAP ioctl, as in linux/fs.h and linux/fiemap.h
+FS_IOC_FIEMAP = 0xc020660b
+fiemap = struct.Struct('=QQIIII')
+fiemap_extent = struct.Struct('=QQQ2QI3I')
+
+def load_fadvise():
+    '''Get a posix_fadvise(fd, offset, length, advice) function, or None if the platform has none'''
+    if hasattr(os, 'posix_fadvise'):
+        return os.posix_fadvise
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc_fadvise = libc.posix_fadvise64
+    except (OSError, AttributeError):
+        return None
+    libc_fadvise.argtypes = [ctypes.c_int, ctypes.c_int64, ctypes.c_int64, ctypes.c_int]
+    libc_fadvise.restype = ctypes.c_int
+
+    def posix_fadvise(fd, offset, length, advice):
+        # posix_fadvise returns the error number rather than setting errno
+        error = libc_fadvise(fd, offset, length, advice)
+        if error:
+            raise OSError(error, os.strerror(error))
+    return posix_fadvise
+
+posix_fadvise = load_fadvise()
+
+def advise(path, advice, length=READAHEAD_BYTES):
+    '''Give the kernel advice about the first length bytes of a file, returning whether it could be given'''
+    if posix_fadvise is None:
+        return False
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        # The parser will report it
+        return False
+    try:
+        posix_fadvise(fd, 0, length, advice)
+        return True
+    except OSError:
+        return False
+    finally:
+        os.close(fd)
+
+def get_physical_offset(path):
+    '''Get the physical offset on disk of the start of a file, from FIEMAP
+
+    This returns None if the file has no extents or cannot be opened, and
+    raises IOError if the filesystem does not support FIEMAP.
+    '''
+    if fcntl is None:
+        raise IOError(errno.ENOTTY, 'FIEMAP is not available')
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        request = fiemap.pack(0, 1, 0, 0, 1, 0) + '\x00' * fiemap_extent.size
+        result = fcntl.ioctl(fd, FS_IOC_FIEMAP, request)
+    finally:
+        os.close(fd)
+    if fiemap.unpack_from(result)[3] == 0:
+        return None
+    return fiemap_extent.unpack_from(result, fiemap.size)[1]
+
+def get_inode(entry):
+    '''Get the inode number of a directory entry or path, or 0 if it cannot be stat'ed'''
+    if isinstance(entry, basestring):
+        try:
+            return os.lstat(entry).st_ino
+        except OSError:
+            return 0
+    try:
+        return entry.inode()
+    except OSError:
+        return 0
+
+def get_path(entry):
+    '''Get the path of a directory entry or path'''
+    if isinstance(entry, basestring):
+        return entry
+    return entry.path
+
+class ReadScheduler(object):
+    '''Orders files for reading, a window at a time, reading ahead their headers
+
+    order is 'walk', to keep the order the files are given in, 'inode' or
+    'extent', which falls back to inode order on filesystems without
+    FIEMAP.  Each window of files is sorted on its own, so the order is
+    only partly sorted, but files are handed on without waiting for the
+    whole walk.  readahead is the number of files beyond the one handed on
+    whose headers are read ahead, or 0 for none.
+    '''
+
+    def __init__(self, order='inode', window=DEFAULT_WINDOW, readahead=DEFAULT_READAHEAD):
+        if order not in ORDERS:
+            raise ValueError("Order {0} is not one of {1}".format(order, ', '.join(ORDERS)))
+        self.order = order
+        self.window = max(window, 1)
+        self.readahead = readahead
+        self.fiemap = order == 'extent'
+
+    def sort(self, entries):
+        '''Sort a window of directory entries or paths, returning their paths'''
+        if self.order == 'walk':
+            return [get_path(entry) for entry in entries]
+        keyed = sorted((get_inode(entry), get_path(entry)) for entry in entries)
+        if not self.fiemap:
+            return [path for inode, path in keyed]
+
+        # The inodes are read in order to find the extents
+        extents = []
+        for inode, path in keyed:
+            try:
+                physical = get_physical_offset(path) if self.fiemap else None
+            except IOError as e:
+                if e.errno not in (errno.ENOTTY, errno.EOPNOTSUPP, errno.EINVAL):
+                    raise
+                # Not supported by the filesystem, so inode order it is
+                self.fiemap = False
+                physical = None
+            # Files with no extents go last
+            extents.append((physical is None, physical, inode, path))
+        extents.sort()
+        return [extent[3] for extent in extents]
+
+    def schedule(self, entries):
+        '''Yield the paths of directory entries or paths in the order to read them'''
+        window = []
+        for entry in entries:
+            window.append(entry)
+            if len(window) >= self.window:
+                for path in self.__read_window(window):
+                    yield path
+                window = []
+        for path in self.__read_window(window):
+            yield path
+
+    def __read_window(self, window):
+        '''Sort a window, yielding its paths, with their headers read ahead'''
+        paths = self.sort(window)
+        ahead = 0
+        for i, path in enumerate(paths):
+            while ahead < len(paths) and ahead <= i + self.readahead:
+                if self.readahead:
+                    advise(paths[ahead], POSIX_FADV_WILLNEED)
+                ahead += 1
+            yield path
+
+def walk_scheduled(top, extensions=mp3_walk.DEFAULT_EXTENSIONS, scheduler=None):
+    '''Walk a directory tree as mp3_walk.walk_files does, yielding paths in the order of a ReadScheduler, if given'''
+    if scheduler is None:
+        return mp3_walk.walk_files(top, extensions)
+    return scheduler.schedule(mp3_walk.walk_entries(top, extensions))
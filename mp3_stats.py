@@ -0,0 +1,158 @@
+# Copyright (c) 2013, pynewb
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice, this list
+#     of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice, this
+#     list of conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution.
+#   * Neither the name of pynewb nor the names of its contributors may be used to endorse
+#     or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import print_function
+
+import collections
+import re
+import sys
+import time
+
+def size_bucket(size):
+    '''Get the power of two at or above a size, for histograms'''
+    bucket = 1
+    while bucket < size:
+        bucket <<= 1
+    return bucket
+
+def error_class(msg):
+    '''Get the class of an error message, with standalone numbers replaced by #'''
+    return re.sub(r'\b[0-9]+\b', '#', msg)
+
+class TimedFile(object):
+    '''A wrapper for a file which adds its reads and seeks to ParserStats'''
+
+    def __init__(self, f, stats):
+        self.f = f
+        self.stats = stats
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.f.close()
+
+    def read(self, size=-1):
+        start = time.time()
+        data = self.f.read(size)
+        self.stats.read_seconds += time.time() - start
+        self.stats.bytes_read += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        start = time.time()
+        self.f.seek(offset, whence)
+        self.stats.read_seconds += time.time() - start
+
+    def tell(self):
+        return self.f.tell()
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def close(self):
+        self.f.close()
+
+class ParserStats(object):
+    '''Counters, byte accounting and timings collected by ID3v2Parser
+
+    Pass an instance as the stats option of ID3v2Parser to collect them.
+    Parsers without one do no accounting at all.
+    '''
+
+    def __init__(self):
+        self.files = 0
+        self.bytes_read = 0
+        self.parse_seconds = 0.0
+        self.open_seconds = 0.0
+        self.read_seconds = 0.0
+        self.decode_seconds = 0.0
+        self.frame_types = collections.Counter()
+        self.errors = collections.Counter()
+        self.tag_sizes = collections.Counter()
+        self.frame_sizes = collections.Counter()
+
+    def open(self, path, mode, buffering):
+        '''Open a file, timing the open and wrapping it to time reads'''
+        start = time.time()
+        f = open(path, mode, buffering)
+        self.open_seconds += time.time() - start
+        return TimedFile(f, self)
+
+    def add_error(self, msg):
+        self.errors[error_class(msg)] += 1
+
+    def add_frame(self, frame_type, frame_size):
+        self.frame_types[frame_type] += 1
+        self.frame_sizes[size_bucket(frame_size)] += 1
+
+    def add_tag(self, size):
+        self.tag_sizes[size_bucket(size)] += 1
+
+    def merge(self, other):
+        '''Add the counts and timings of another ParserStats to these'''
+        self.files += other.files
+        self.bytes_read += other.bytes_read
+        self.parse_seconds += other.parse_seconds
+        self.open_seconds += other.open_seconds
+        self.read_seconds += other.read_seconds
+        self.decode_seconds += other.decode_seconds
+        self.frame_types.update(other.frame_types)
+        self.errors.update(other.errors)
+        self.tag_sizes.update(other.tag_sizes)
+        self.frame_sizes.update(other.frame_sizes)
+
+    def print_summary(self, elapsed=None, file=sys.stderr):
+        '''Print a summary of the statistics
+
+        If the elapsed time of the whole run is given, the time outside the
+        parser, such as walking directories and handling events, is shown.
+        Times of parallel workers are summed, so may exceed elapsed, in which
+        case the time outside the parser is not known.
+        '''
+        print('{0:>30s} : {1:d}'.format('Files parsed', self.files), file=file)
+        print('{0:>30s} : {1:d}'.format('Bytes read', self.bytes_read), file=file)
+        other_seconds = self.parse_seconds - self.open_seconds - self.read_seconds - self.decode_seconds
+        print('{0:>30s} : {1:.3f}'.format('Parse seconds', self.parse_seconds), file=file)
+        print('{0:>30s} : {1:.3f}'.format('Open seconds', self.open_seconds), file=file)
+        print('{0:>30s} : {1:.3f}'.format('Read and seek seconds', self.read_seconds), file=file)
+        print('{0:>30s} : {1:.3f}'.format('Decode seconds', self.decode_seconds), file=file)
+        print('{0:>30s} : {1:.3f}'.format('Other parse seconds', other_seconds), file=file)
+        if elapsed is not None:
+            print('{0:>30s} : {1:.3f}'.format('Elapsed seconds', elapsed), file=file)
+            if elapsed >= self.parse_seconds:
+                print('{0:>30s} : {1:.3f}'.format('Outside parser seconds', elapsed - self.parse_seconds), file=file)
+        print('Frames by type', file=file)
+        for frame_type, count in sorted(self.frame_types.items()):
+            print('{0:>30s} : {1:d}'.format(repr(frame_type), count), file=file)
+        print('Errors by class', file=file)
+        for msg, count in sorted(self.errors.items()):
+            print('{0:>30s} : {1:d}'.format(msg, count), file=file)
+        print('Tag sizes', file=file)
+        for bucket, count in sorted(self.tag_sizes.items()):
+            print('{0:>30s} : {1:d}'.format('<= {0:d}'.format(bucket), count), file=file)
+        print('Frame sizes', file=file)
+        for bucket, count in sorted(self.frame_sizes.items()):
+            print('{0:>30s} : {1:d}'.format('<= {0:d}'.format(bucket), count), file=file)
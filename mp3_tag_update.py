@@ -0,0 +1,474 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2013, pynewb
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice, this list
+#     of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice, this
+#     list of conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution.
+#   * Neither the name of pynewb nor the names of its contributors may be used to endorse
+#     or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''Updates the text frames of ID3v2 tags, rewriting only the tag where it can
+
+A file's tag is read with ID3v2Parser and its frames are rebuilt with
+the edits.  If the new frames fit in the space of the old tag, including
+its padding, the new tag is written over the old one and the audio is
+not touched.  Otherwise the file is rewritten through a temporary file
+in the same directory, with the new tag, fresh padding for later edits
+and then the audio, and the temporary file is renamed over the original.
+
+A write in place is made safe against crashes with an undo journal: the
+old tag is saved next to the file, and synced, before it is overwritten,
+and the journal is removed once the new tag is synced.  A journal left
+over by a crash is played back, restoring the old tag, the next time the
+file is updated or by recover_tree().
+
+Run as a script to set frames of files, or to apply a CSV file of edits
+across a tree with a pool of worker processes:
+
+    python mp3_tag_update.py --set TPE2='Various Artists' --set TALB=Hits *.mp3
+    python mp3_tag_update.py --csv edits.csv --root ~/Music --jobs 0
+
+The CSV file has a header row of path and the frame types to set, such
+as path,TPE2,TALB, and a row per file.  Paths are relative to the root,
+values are UTF-8 and empty cells leave frames as they are.
+'''
+
+from __future__ import print_function
+
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+import os.path
+import shutil
+import struct
+import sys
+import tempfile
+
+import mp3_event_parser
+import mp3_walk
+
+# Bytes of padding given to a tag when its file is rewritten, so later edits fit in place
+REWRITE_PADDING = 4096
+
+# Bytes copied at a time when rewriting a file
+COPY_CHUNK_SIZE = 1 << 20
+
+# Suffix of the undo journal kept next to a file while its tag is overwritten
+JOURNAL_SUFFIX = '.tagundo'
+
+# Suffix of the temporary files written before they are renamed into place
+TEMP_SUFFIX = '.tagtmp'
+
+# Files given to each worker process at a time in batch mode
+BATCH_CHUNK_SIZE = 16
+
+# Parse errors of files with no ID3v2 tag, which are given one
+NO_TAG_ERRORS = ('No ID3v2 identifier', 'No ID3v2 header')
+
+class TagFrameCollector(object):
+    '''A handler for the ID3v2 file parser that collects the frames of a tag as they are stored'''
+
+    def __init__(self):
+        '''Initialize members'''
+        self.header = None
+        self.frames = []
+        self.errors = []
+        self.frame_header = None
+        # The raw header the frame walk stopped at, if it stopped before the end of the tag
+        self.stop_header = None
+
+    def get_unwalked_frame(self):
+        '''Get the type of a frame the parser stopped walking the tag at, or None if it reached the padding or end'''
+        if self.stop_header is None or self.stop_header[0:4].strip('\x00') == '':
+            return None
+        return self.stop_header[0:4]
+
+    def on_error(self, msg):
+        self.errors.append(msg)
+
+    def on_raw_id3v2dot3_frame_header(self, frame_header):
+        # Cleared by on_id3v2dot3_frame_header unless the walk stops at this header
+        self.stop_header = frame_header
+
+    def on_id3v2_header(self, version, revision, flags, size):
+        self.header = (version, revision, flags, size)
+
+    def on_id3v2dot3_frame_header(self, frame_type, frame_size, frame_flags):
+        self.frame_header = (frame_size, frame_flags)
+        self.stop_header = None
+
+    def on_raw_id3v2dot3_frame(self, frame_type, frame_data):
+        frame_size, frame_flags = self.frame_header
+        if len(frame_data) != frame_size:
+            self.errors.append("Frame {0} is truncated".format(frame_type))
+            return
+        self.frames.append((frame_type, frame_flags, frame_data))
+
+def check_edits(edits):
+    '''Check that edits only set text info frames, raising ValueError if not'''
+    for frame_type in edits:
+        if len(frame_type) != 4 or frame_type[0] != 'T' or frame_type == 'TXXX' or not frame_type.isalnum():
+            raise ValueError("Cannot set frame type {0}; only text info frames can be set".format(frame_type))
+
+def pack_frame(version, frame_type, frame_flags, frame_data):
+    '''Pack an ID3v2.3 or ID3v2.4 frame'''
+    frame_size = len(frame_data)
+    if version == 4:
+        frame_size = mp3_event_parser.synchsafe(frame_size)
+    return mp3_event_parser.id3v2dot3_frame_header.pack(frame_type, frame_size, frame_flags) + frame_data
+
+def pack_text_info_frame(version, frame_type, value):
+    '''Pack a text info frame, in ISO-8859-1 if it can be, or else UTF-16 in ID3v2.3 and UTF-8 in ID3v2.4'''
+    if isinstance(value, unicode):
+        try:
+            frame_data = '\x00' + value.encode('latin-1')
+        except UnicodeEncodeError:
+            if version == 4:
+                frame_data = '\x03' + value.encode('utf-8')
+            else:
+                frame_data = '\x01' + value.encode('utf-16')
+    else:
+        frame_data = '\x00' + value
+    return pack_frame(version, frame_type, 0, frame_data)
+
+def pack_tag_header(version, revision, flags, size):
+    '''Pack an ID3v2 header for a tag of size bytes after the header'''
+    return struct.pack('>3sBBBI', 'ID3', version, revision, flags, mp3_event_parser.synchsafe(size))
+
+def build_frames(version, frames, edits, frame_flags_mask=0):
+    '''Build the frames of a tag with edits made
+
+    frames is a list of (frame_type, frame_flags, frame_data) as stored,
+    which are kept, with frame_flags_mask set in their flags.  edits is a
+    dict of frame type to new text, or None to remove the frame.  An edited
+    frame replaces the first frame of its type, later ones being dropped,
+    and frames of types not in the tag are added at the end.
+    '''
+    packed = []
+    done = set()
+    for frame_type, frame_flags, frame_data in frames:
+        if frame_type not in edits:
+            packed.append(pack_frame(version, frame_type, frame_flags | frame_flags_mask, frame_data))
+        elif frame_type not in done:
+            done.add(frame_type)
+            if edits[frame_type] is not None:
+                packed.append(pack_text_info_frame(version, frame_type, edits[frame_type]))
+    for frame_type in sorted(edits):
+        if frame_type not in done and edits[frame_type] is not None:
+            packed.append(pack_text_info_frame(version, frame_type, edits[frame_type]))
+    return ''.join(packed)
+
+def get_journal_path(path):
+    '''Get the path of the undo journal of a file'''
+    dirpath, name = os.path.split(path)
+    return os.path.join(dirpath, '.' + name + JOURNAL_SUFFIX)
+
+def get_journaled_path(journal_path):
+    '''Get the path of the file of an undo journal'''
+    dirpath, name = os.path.split(journal_path)
+    return os.path.join(dirpath, name[1:-len(JOURNAL_SUFFIX)])
+
+def sync_dir(dirpath):
+    '''Sync a directory, so renames and removals in it survive a crash, where the platform allows'''
+    try:
+        fd = os.open(dirpath or os.curdir, os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0))
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def write_temp_file(path, data_files):
+    '''Write a synced temporary file next to a file, returning its path
+
+    data_files is an iterable of strings and open files, which are copied
+    from their current positions to their ends.
+    '''
+    dirpath, name = os.path.split(path)
+    fd, temp_path = tempfile.mkstemp(prefix='.' + name + '.', suffix=TEMP_SUFFIX, dir=dirpath or os.curdir)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for data in data_files:
+                if isinstance(data, str):
+                    out.write(data)
+                else:
+                    shutil.copyfileobj(data, out, COPY_CHUNK_SIZE)
+            out.flush()
+            os.fsync(out.fileno())
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return temp_path
+
+def recover_file(path):
+    '''Play back the undo journal of a file, if a crash left one, returning whether there was one'''
+    journal_path = get_journal_path(path)
+    try:
+        with open(journal_path, 'rb') as journal:
+            old_tag = journal.read()
+    except IOError:
+        return False
+    with open(path, 'r+b') as f:
+        f.write(old_tag)
+        f.flush()
+        os.fsync(f.fileno())
+    os.unlink(journal_path)
+    sync_dir(os.path.dirname(path))
+    return True
+
+def recover_tree(top):
+    '''Play back the undo journals, and remove the temporary files, left in a tree by crashes
+
+    This returns the paths of the files whose old tags were restored.
+    '''
+    recovered = []
+    for path in mp3_walk.walk_files(top, (JOURNAL_SUFFIX, TEMP_SUFFIX)):
+        if path.endswith(TEMP_SUFFIX):
+            os.unlink(path)
+        elif recover_file(get_journaled_path(path)):
+            recovered.append(get_journaled_path(path))
+    return recovered
+
+def write_in_place(f, tag, journal=True):
+    '''Write a tag over the start of an open file, no longer than the old tag, through an undo journal'''
+    journal_path = None
+    if journal:
+        f.seek(0)
+        temp_path = write_temp_file(f.name, (f.read(len(tag)),))
+        journal_path = get_journal_path(f.name)
+        os.rename(temp_path, journal_path)
+        sync_dir(os.path.dirname(f.name))
+    f.seek(0)
+    f.write(tag)
+    f.flush()
+    os.fsync(f.fileno())
+    if journal_path is not None:
+        os.unlink(journal_path)
+
+def rewrite_file(f, tag, audio_offset):
+    '''Rewrite an open file with a new tag followed by its audio, renaming a synced copy over it'''
+    f.seek(audio_offset)
+    temp_path = write_temp_file(f.name, (tag, f))
+    try:
+        shutil.copymode(f.name, temp_path)
+        os.rename(temp_path, f.name)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    sync_dir(os.path.dirname(f.name))
+
+def update_tag(path, edits, padding=REWRITE_PADDING, journal=True, parser=None):
+    '''Update the text frames of the ID3v2 tag of a file, returning 'unchanged', 'in place' or 'rewritten'
+
+    edits is a dict of frame type to new text, or None to remove the
+    frame, as for build_frames.  The tag is written in place if the new
+    frames fit in the old tag and its padding, and otherwise the file is
+    rewritten with padding bytes of padding.  A file with no ID3v2 tag is
+    given an ID3v2.3 one.  Extended headers and footers are dropped, and
+    unsynchronization is undone.
+
+    This raises ValueError for tags it cannot update, including corrupt
+    or truncated ones and those with frames after a frame of size 0,
+    which the parser does not walk, and IOError or OSError if the file cannot be read
+    or written.
+    '''
+    check_edits(edits)
+    if journal:
+        recover_file(path)
+    if parser is None:
+        parser = mp3_event_parser.ID3v2Parser(whole_tag=True)
+    collector = TagFrameCollector()
+    st = os.stat(path)
+    parser.parse_id3v2_file(path, False, collector)
+
+    frame_flags_mask = 0
+    if collector.header is None:
+        errors = [msg for msg in collector.errors if msg not in NO_TAG_ERRORS]
+        if errors:
+            raise ValueError(errors[0])
+        with open(path, 'rb') as f:
+            if f.read(3) == 'ID3':
+                raise ValueError("ID3v2 header is truncated")
+        # No tag, so one is added
+        version, revision, flags, size = (3, 0, 0, 0)
+        audio_offset = 0
+    else:
+        if collector.errors:
+            raise ValueError(collector.errors[0])
+        unwalked_frame = collector.get_unwalked_frame()
+        if unwalked_frame is not None:
+            # The frames from it on would be lost in rewriting the tag
+            raise ValueError("Frame {0!r} has a size of 0, so the frames after it cannot be read".format(unwalked_frame))
+        version, revision, flags, size = collector.header
+        if version not in (3, 4):
+            raise ValueError("Cannot update an ID3v2.{0} tag".format(version))
+        audio_offset = size + 10
+        if version == 4 and (flags & 0x10) != 0:
+            # The footer's space becomes padding
+            audio_offset += 10
+        if st.st_size < audio_offset:
+            raise ValueError("Tag of {0:d} bytes is longer than the file".format(audio_offset))
+        if version == 4 and (flags & 0x80) != 0:
+            # Every frame of the tag is unsynchronized, so say so frame by frame
+            frame_flags_mask = 0x0002
+        flags &= 0xff & ~(0x80 | 0x40 | 0x10)
+
+    old_frames = build_frames(version, collector.frames, {})
+    frames = build_frames(version, collector.frames, edits, frame_flags_mask)
+    if collector.header is not None and frames == old_frames and flags == collector.header[2]:
+        return 'unchanged'
+
+    with open(path, 'r+b') as f:
+        current = os.fstat(f.fileno())
+        if current.st_size != st.st_size or current.st_mtime != st.st_mtime:
+            raise ValueError("File changed while its tag was being updated")
+        if collector.header is not None and 10 + len(frames) <= audio_offset:
+            size = audio_offset - 10
+            write_in_place(f, pack_tag_header(version, revision, flags, size) + frames.ljust(size, '\x00'), journal)
+            return 'in place'
+        size = len(frames) + padding
+        rewrite_file(f, pack_tag_header(version, revision, flags, size) + frames.ljust(size, '\x00'), audio_offset)
+        return 'rewritten'
+
+def read_edits(csv_path, root=None):
+    '''Read a CSV file of edits, returning a list of (path, edits) for each row
+
+    The header row is path and the frame types to set.  Paths are joined
+    to root, if given, and values are decoded from UTF-8.  Empty cells
+    are left out of the edits.  This raises ValueError if the header row
+    is not valid.
+    '''
+    path_edits = []
+    with open(csv_path, 'rb') as f:
+        reader = csv.reader(f)
+        columns = next(reader, None)
+        if not columns or columns[0] != 'path':
+            raise ValueError("{0} does not start with a path column".format(csv_path))
+        check_edits(columns[1:])
+        for row in reader:
+            if not row:
+                continue
+            path = row[0]
+            if root is not None:
+                path = os.path.join(root, path)
+            edits = dict((frame_type, value.decode('utf-8'))
+                         for frame_type, value in zip(columns[1:], row[1:]) if value)
+            path_edits.append((path, edits))
+    return path_edits
+
+_parser = None
+
+def _update_task(args):
+    '''Update the tag of a file, returning (path, result, error), in a worker process'''
+    global _parser
+    path, edits, padding = args
+    if _parser is None:
+        _parser = mp3_event_parser.ID3v2Parser(whole_tag=True)
+    try:
+        return (path, update_tag(path, edits, padding, parser=_parser), None)
+    except (IOError, OSError, ValueError) as e:
+        return (path, None, str(e))
+
+def update_tags(path_edits, jobs=1, padding=REWRITE_PADDING):
+    '''Update the tags of files, yielding (path, result, error) for each as it is done
+
+    path_edits is an iterable of (path, edits), as from read_edits.  If
+    jobs is other than 1, the files are updated by a pool of that many
+    worker processes (0 meaning one per CPU).
+    '''
+    tasks = ((path, edits, padding) for path, edits in path_edits)
+    if jobs == 1:
+        for result in itertools.imap(_update_task, tasks):
+            yield result
+        return
+
+    pool = multiprocessing.Pool(jobs or None)
+    try:
+        for result in pool.imap_unordered(_update_task, tasks, BATCH_CHUNK_SIZE):
+            yield result
+    finally:
+        # Let the files being written finish, so none is left half done
+        pool.close()
+        pool.join()
+
+def parse_set(value):
+    '''Parse a --set FRAME=TEXT argument into (frame type, text), with empty text removing the frame'''
+    frame_type, sep, text = value.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError("{0} is not FRAME=TEXT".format(value))
+    return (frame_type, text.decode('utf-8') if text else None)
+
+def main():
+    parser = argparse.ArgumentParser(description='Update the text frames of ID3v2 tags, in place where they fit')
+    parser.add_argument('files', metavar='file', nargs='*',
+                        help='The files to update with --set')
+    parser.add_argument('--set', dest='sets', metavar='FRAME=TEXT', action='append', type=parse_set, default=[],
+                        help='Set a text frame, such as TPE2=Artist, or remove it with TPE2= (can be repeated)')
+    parser.add_argument('--csv', metavar='PATH',
+                        help='Apply the edits in a CSV file with a header row of path and frame types')
+    parser.add_argument('--root', default=None,
+                        help='Directory to which the paths in the CSV file are relative')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Number of worker processes updating files (0 is one per CPU, default is 1)')
+    parser.add_argument('--padding', type=int, default=REWRITE_PADDING,
+                        help='Bytes of padding for tags of rewritten files (default is %(default)s)')
+    parser.add_argument('--recover', metavar='DIRECTORY',
+                        help='Restore the tags of files left half written by a crash in a tree, and exit')
+    args = parser.parse_args()
+
+    if args.recover:
+        for path in recover_tree(os.path.expanduser(args.recover)):
+            print(path, ': restored')
+        return
+
+    path_edits = []
+    try:
+        if args.files:
+            if not args.sets:
+                parser.error('files need --set')
+            edits = dict(args.sets)
+            check_edits(edits)
+            path_edits = [(path, edits) for path in args.files]
+        elif not args.csv:
+            parser.error('give files and --set, or --csv')
+        if args.csv:
+            root = os.path.expanduser(args.root) if args.root else None
+            path_edits += read_edits(os.path.expanduser(args.csv), root)
+    except ValueError as e:
+        parser.error(str(e))
+
+    counts = {}
+    for path, result, error in update_tags(path_edits, args.jobs, args.padding):
+        if error:
+            print(path, ':', error, file=sys.stderr)
+            result = 'failed'
+        else:
+            print(path, ':', result)
+        counts[result] = counts.get(result, 0) + 1
+    print(', '.join('{0:d} {1}'.format(counts[result], result) for result in sorted(counts)), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+# Copyright (c) 2013, pynewb
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice, this list
+#     of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice, this
+#     list of conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution.
+#   * Neither the name of pynewb nor the names of its contributors may be used to endorse
+#     or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''Walks directory trees for the files with given extensions
+
+The walk reads each directory once with scandir and tells directories
+from files by the type in the directory entry, so entries are not
+stat'ed.  Where os.scandir and the scandir package are missing, entries
+are read with readdir through ctypes on Linux, and as a last resort
+with listdir and an lstat of each entry.
+'''
+
+from __future__ import print_function
+
+import ctypes
+import ctypes.util
+import os
+import os.path
+import stat
+import sys
+
+# Extensions of the files walked for by default
+DEFAULT_EXTENSIONS = ('mp3',)
+
+# Directory entry types, as in dirent.h
+DT_UNKNOWN = 0
+DT_DIR = 4
+DT_REG = 8
+DT_LNK = 10
+
+def get_extension_set(extensions):
+    '''Get the set of lowercase file extensions, with their dots, to match, or None to match all files'''
+    if extensions is None:
+        return None
+    return frozenset('.' + extension.lower().lstrip('.') for extension in extensions)
+
+def get_extension(name):
+    '''Get the lowercase extension of a file name, with its dot, as os.path.splitext would'''
+    dot = name.rfind('.')
+    if dot <= 0 or name[:dot].strip('.') == '':
+        return ''
+    return name[dot:].lower()
+
+class DirEntry(object):
+    '''A directory entry like os.DirEntry, which stats the entry only when its type is not known'''
+
+    __slots__ = ('name', 'path', 'd_type', 'd_ino', '_stat', '_lstat')
+
+    def __init__(self, path, name, d_type=DT_UNKNOWN, d_ino=None):
+        '''Initialize the entry'''
+        self.name = name
+        self.path = path
+        self.d_type = d_type
+        self.d_ino = d_ino
+        self._stat = None
+        self._lstat = None
+
+    def inode(self):
+        '''Get the inode number of the entry, from the directory entry if it was read with one'''
+        if self.d_ino is None:
+            self.d_ino = self.stat(follow_symlinks=False).st_ino
+        return self.d_ino
+
+    def stat(self, follow_symlinks=True):
+        '''Get the stat result of the entry, cached'''
+        if not follow_symlinks:
+            if self._lstat is None:
+                self._lstat = os.lstat(self.path)
+            return self._lstat
+        if self._stat is None:
+            if self.is_symlink():
+                self._stat = os.stat(self.path)
+            else:
+                self._stat = self.stat(follow_symlinks=False)
+        return self._stat
+
+    def is_symlink(self):
+        '''Get whether the entry is a symbolic link'''
+        if self.d_type != DT_UNKNOWN:
+            return self.d_type == DT_LNK
+        return stat.S_ISLNK(self.stat(follow_symlinks=False).st_mode)
+
+    def __is_type(self, d_type, follow_symlinks, is_mode):
+        '''Get whether the entry is of a type, stat'ing it only if it is a link or of unknown type'''
+        if self.d_type != DT_UNKNOWN and (self.d_type != DT_LNK or not follow_symlinks):
+            return self.d_type == d_type
+        try:
+            return is_mode(self.stat(follow_symlinks).st_mode)
+        except OSError:
+            return False
+
+    def is_dir(self, follow_symlinks=True):
+        '''Get whether the entry is a directory'''
+        return self.__is_type(DT_DIR, follow_symlinks, stat.S_ISDIR)
+
+    def is_file(self, follow_symlinks=True):
+        '''Get whether the entry is a regular file'''
+        return self.__is_type(DT_REG, follow_symlinks, stat.S_ISREG)
+
+def listdir_scandir(dirpath):
+    '''Get the DirEntrys of a directory from listdir, leaving their types to be found by lstat'''
+    prefix = os.path.join(dirpath, '')
+    return [DirEntry(prefix + name, name) for name in os.listdir(dirpath)]
+
+class Dirent64(ctypes.Structure):
+    '''The Linux struct dirent64'''
+    _fields_ = [('d_ino', ctypes.c_uint64),
+                ('d_off', ctypes.c_int64),
+                ('d_reclen', ctypes.c_ushort),
+                ('d_type', ctypes.c_ubyte),
+                ('d_name', ctypes.c_char * 256)]
+
+def load_readdir():
+    '''Get the (opendir, readdir64, closedir) functions of the C library, or None if it does not have them'''
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        opendir, readdir, closedir = libc.opendir, libc.readdir64, libc.closedir
+    except (OSError, AttributeError):
+        return None
+    opendir.argtypes = [ctypes.c_char_p]
+    opendir.restype = ctypes.c_void_p
+    readdir.argtypes = [ctypes.c_void_p]
+    readdir.restype = ctypes.POINTER(Dirent64)
+    closedir.argtypes = [ctypes.c_void_p]
+    closedir.restype = ctypes.c_int
+    return (opendir, readdir, closedir)
+
+def readdir_scandir(dirpath):
+    '''Get the DirEntrys of a directory, with their types, from readdir'''
+    encoding = None
+    if isinstance(dirpath, unicode):
+        encoding = sys.getfilesystemencoding()
+    opendir, readdir, closedir = libc_readdir
+    d = opendir(dirpath.encode(encoding) if encoding else dirpath)
+    if not d:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno), dirpath)
+    prefix = os.path.join(dirpath, '')
+    entries = []
+    try:
+        while True:
+            ctypes.set_errno(0)
+            dirent = readdir(d)
+            if not dirent:
+                errno = ctypes.get_errno()
+                if errno:
+                    raise OSError(errno, os.strerror(errno), dirpath)
+                return entries
+            dirent = dirent.contents
+            name = dirent.d_name
+            if name == '.' or name == '..':
+                continue
+            if encoding:
+                try:
+                    name = name.decode(encoding)
+                except UnicodeDecodeError:
+                    # Kept as bytes, as by listdir
+                    pass
+            entries.append(DirEntry(prefix + name, name, dirent.d_type, dirent.d_ino))
+    finally:
+        closedir(d)
+
+libc_readdir = None
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        libc_readdir = load_readdir()
+        scandir = readdir_scandir if libc_readdir is not None else listdir_scandir
+
+def walk_files(top, extensions=DEFAULT_EXTENSIONS, follow_symlinks=True, onerror=None, ondir=None):
+    '''Walk a directory tree, yielding the path of each file with one of the extensions
+
+    Extensions are matched regardless of case, and None matches all
+    files.  Paths are yielded in order of their names, directory by
+    directory, so the order is the same from walk to walk.  Symbolic
+    links to directories are followed if follow_symlinks is set, except
+    those which lead back to a directory being walked.  Errors listing a
+    directory are passed to onerror, if given, and otherwise ignored,
+    as with os.walk.  If ondir is given, it is called with the path of
+    each directory before the directory is listed.
+    '''
+    return (entry.path for entry in walk_entries(top, extensions, follow_symlinks, onerror, ondir))
+
+def walk_entries(top, extensions=DEFAULT_EXTENSIONS, follow_symlinks=True, onerror=None, ondir=None):
+    '''Walk a directory tree as walk_files does, yielding the directory entry of each file
+
+    The entries are like os.DirEntry, so their inode numbers can be had
+    with inode() without a stat where the directory gives them.
+    '''
+    extensions = get_extension_set(extensions)
+    return _walk(top, os.path.realpath(top), [], extensions, follow_symlinks, onerror, ondir)
+
+def _walk(dirpath, realpath, ancestors, extensions, follow_symlinks, onerror, ondir):
+    '''Walk a directory, given its real path and the real paths of the directories above it'''
+    if ondir is not None:
+        ondir(dirpath)
+    try:
+        entries = sorted(scandir(dirpath), key=lambda entry: entry.name)
+    except OSError as e:
+        if onerror is not None:
+            onerror(e)
+        return
+    ancestors.append(realpath)
+    for entry in entries:
+        if entry.is_dir(follow_symlinks):
+            if not entry.is_symlink():
+                entry_realpath = os.path.join(realpath, entry.name)
+            else:
+                entry_realpath = os.path.realpath(entry.path)
+                if any(ancestor == entry_realpath or ancestor.startswith(os.path.join(entry_realpath, ''))
+                       for ancestor in ancestors):
+                    # A link back to a directory being walked
+                    continue
+            for file_entry in _walk(entry.path, entry_realpath, ancestors, extensions, follow_symlinks, onerror, ondir):
+                yield file_entry
+        elif extensions is None or get_extension(entry.name) in extensions:
+            if entry.is_file():
+                yield entry
+    ancestors.pop()
@@ -0,0 +1,308 @@
+# Copyright (c) 2013, pynewb
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice, this list
+#     of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice, this
+#     list of conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution.
+#   * Neither the name of pynewb nor the names of its contributors may be used to endorse
+#     or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''Watches directory trees for changed MP3 files
+
+On Linux, changes are reported by inotify, through ctypes, with a watch
+on each directory of the trees.  Elsewhere, or if inotify cannot be used,
+the trees are walked and their files stat'ed every few seconds.  Either
+way, watch() debounces the changes, so a file being written is reported
+once it has been left alone for a while, and coalesces them, so a file
+changed many times, or created and deleted, is reported once or not at
+all.
+'''
+
+from __future__ import print_function
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import os.path
+import select
+import struct
+import sys
+import time
+
+import mp3_walk
+
+# Seconds a file must be left alone before it is reported
+DEBOUNCE_SECONDS = 2.0
+
+# Seconds between walks of the trees when polling
+POLL_INTERVAL = 10.0
+
+# inotify event masks, as in sys/inotify.h
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+# The events watched for in each directory
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+inotify_event = struct.Struct('iIII')
+
+def load_inotify():
+    '''Get the (inotify_init1, inotify_add_watch) functions of the C library, or None if it does not have them'''
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        init, add_watch = libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    init.argtypes = [ctypes.c_int]
+    init.restype = ctypes.c_int
+    add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    add_watch.restype = ctypes.c_int
+    return (init, add_watch)
+
+class InotifyWatcher(object):
+    '''Reports changes to the files in directory trees through inotify'''
+
+    def __init__(self, extensions=mp3_walk.DEFAULT_EXTENSIONS):
+        '''Create the inotify instance, raising OSError if there is none'''
+        functions = load_inotify()
+        if functions is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        init, self.add_watch = functions
+        self.fd = init(IN_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        self.extensions = extensions
+        self.extension_set = mp3_walk.get_extension_set(extensions)
+        self.tops = []
+        self.dirs = {}
+
+    def __watch_dir(self, dirpath):
+        '''Add a watch on a directory'''
+        path = dirpath.encode(sys.getfilesystemencoding()) if isinstance(dirpath, unicode) else dirpath
+        wd = self.add_watch(self.fd, path, WATCH_MASK)
+        if wd < 0:
+            e = ctypes.get_errno()
+            if e == errno.ENOSPC:
+                raise OSError(e, 'Too many inotify watches (see /proc/sys/fs/inotify/max_user_watches)', dirpath)
+            if e not in (errno.ENOENT, errno.ENOTDIR):
+                print(dirpath + ' : ' + os.strerror(e), file=sys.stderr)
+            return
+        self.dirs[wd] = dirpath
+
+    def __walk(self, top):
+        '''Walk a tree, watching each directory before listing it, and return the paths of its files'''
+        return list(mp3_walk.walk_files(top, self.extensions, ondir=self.__watch_dir))
+
+    def start(self, tops):
+        '''Watch trees, returning the paths of their files'''
+        self.tops = list(tops)
+        paths = []
+        for top in self.tops:
+            paths.extend(self.__walk(top))
+        return paths
+
+    def wait(self, timeout):
+        '''Wait up to timeout seconds (None for no limit) for changes
+
+        This returns (paths, dirs) of the files which may have changed and of
+        directories which are gone and whose files may all have been deleted.
+        '''
+        try:
+            readable = select.select([self.fd], [], [], timeout)[0]
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return ([], [])
+            raise
+        if not readable:
+            return ([], [])
+        data = os.read(self.fd, 1 << 16)
+        paths = []
+        dirs = []
+        offset = 0
+        while offset + inotify_event.size <= len(data):
+            wd, mask, cookie, length = inotify_event.unpack_from(data, offset)
+            offset += inotify_event.size
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so everything may have changed
+                for top in self.tops:
+                    paths.extend(self.__walk(top))
+                dirs.extend(self.tops)
+                continue
+            dirpath = self.dirs.get(wd)
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            if dirpath is None:
+                continue
+            if isinstance(dirpath, unicode):
+                try:
+                    name = name.decode(sys.getfilesystemencoding())
+                except UnicodeDecodeError:
+                    pass
+            path = os.path.join(dirpath, name) if name else dirpath
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                dirs.append(dirpath)
+            elif mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    paths.extend(self.__walk(path))
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    dirs.append(path)
+            elif self.extension_set is None or mp3_walk.get_extension(name) in self.extension_set:
+                paths.append(path)
+        return (paths, dirs)
+
+    def close(self):
+        '''Close the inotify instance, removing its watches'''
+        os.close(self.fd)
+
+class PollingWatcher(object):
+    '''Reports changes to the files in directory trees by walking them every interval seconds'''
+
+    def __init__(self, extensions=mp3_walk.DEFAULT_EXTENSIONS, interval=POLL_INTERVAL):
+        '''Initialize the snapshot of the files'''
+        self.extensions = extensions
+        self.interval = interval
+        self.tops = []
+        self.files = {}
+        self.next_poll = None
+
+    def __snapshot(self):
+        '''Get the (size, mtime) of each file in the trees, by path'''
+        files = {}
+        for top in self.tops:
+            for path in mp3_walk.walk_files(top, self.extensions):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files[path] = (st.st_size, st.st_mtime)
+        return files
+
+    def start(self, tops):
+        '''Watch trees, returning the paths of their files'''
+        self.tops = list(tops)
+        self.files = self.__snapshot()
+        self.next_poll = time.time() + self.interval
+        return sorted(self.files)
+
+    def wait(self, timeout):
+        '''Wait up to timeout seconds (None for no limit) for changes, returning (paths, dirs) as InotifyWatcher does'''
+        delay = max(0, self.next_poll - time.time())
+        if timeout is not None and timeout < delay:
+            time.sleep(timeout)
+            return ([], [])
+        time.sleep(delay)
+        files = self.__snapshot()
+        self.next_poll = time.time() + self.interval
+        paths = [path for path, state in files.iteritems() if self.files.get(path) != state]
+        paths.extend(path for path in self.files if path not in files)
+        self.files = files
+        return (paths, [])
+
+    def close(self):
+        '''Nothing to close'''
+        pass
+
+def make_watcher(extensions=mp3_walk.DEFAULT_EXTENSIONS, poll_interval=None):
+    '''Make an InotifyWatcher, or a PollingWatcher if poll_interval is set or inotify is not available'''
+    if poll_interval is None:
+        try:
+            return InotifyWatcher(extensions)
+        except OSError as e:
+            print('Polling for changes: ' + e.strerror, file=sys.stderr)
+            poll_interval = POLL_INTERVAL
+    return PollingWatcher(extensions, poll_interval)
+
+def watch(tops, extensions=mp3_walk.DEFAULT_EXTENSIONS, debounce=DEBOUNCE_SECONDS, poll_interval=None):
+    '''Watch directory trees, yielding (changed, deleted) lists of the paths of files
+
+    The first pair has all of the files in the trees as changed.  After
+    that, a file is yielded once no change has been seen to it for
+    debounce seconds: as changed if it is there, and as deleted if it was
+    yielded before and is gone.  Changes are watched for with inotify, or
+    by walking the trees every poll_interval seconds if that is set or if
+    inotify is not available.  This runs until the generator is closed.
+    '''
+    watcher = make_watcher(extensions, poll_interval)
+    try:
+        try:
+            known = set(watcher.start(tops))
+        except OSError as e:
+            # Such as running out of inotify watches
+            print('Polling for changes: ' + e.strerror, file=sys.stderr)
+            watcher.close()
+            watcher = PollingWatcher(extensions, poll_interval or POLL_INTERVAL)
+            known = set(watcher.start(tops))
+        yield (sorted(known), [])
+
+        pending = {}
+        while True:
+            now = time.time()
+            timeout = None
+            if pending:
+                timeout = max(0, min(pending.itervalues()) + debounce - now)
+            try:
+                paths, dirs = watcher.wait(timeout)
+            except OSError as e:
+                print('Watching for changes: ' + str(e), file=sys.stderr)
+                paths, dirs = [], []
+            now = time.time()
+            for path in paths:
+                pending[path] = now
+            for dirpath in dirs:
+                prefix = os.path.join(dirpath, '')
+                for path in known:
+                    if path.startswith(prefix):
+                        pending[path] = now
+
+            ready = [path for path, seen in pending.iteritems() if now - seen >= debounce]
+            if not ready:
+                continue
+            changed = []
+            deleted = []
+            for path in sorted(ready):
+                del pending[path]
+                if os.path.isfile(path):
+                    changed.append(path)
+                    known.add(path)
+                elif path in known:
+                    deleted.append(path)
+                    known.discard(path)
+            if changed or deleted:
+                yield (changed, deleted)
+    finally:
+        watcher.close()
@@ -0,0 +1,93 @@
+# Copyright (c) 2013, pynewb
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are
+# permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice, this list
+#     of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice, this
+#     list of conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution.
+#   * Neither the name of pynewb nor the names of its contributors may be used to endorse
+#     or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''Tests for mp3_tag_update'''
+
+from __future__ import print_function
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import mp3_event_parser
+import mp3_tag_update
+
+def text_frame(frame_type, text):
+    '''Pack an ID3v2.3 text info frame in ISO-8859-1'''
+    frame_data = '\x00' + text
+    return struct.pack('>4sIH', frame_type, len(frame_data), 0) + frame_data
+
+def tag(frames, padding=64):
+    '''Pack an ID3v2.3 tag of frames followed by padding'''
+    size = len(frames) + padding
+    return mp3_tag_update.pack_tag_header(3, 0, 0, size) + frames + '\x00' * padding
+
+class TextCollector(mp3_tag_update.TagFrameCollector):
+    '''Collects the text of the frames of a tag'''
+
+    def __init__(self):
+        mp3_tag_update.TagFrameCollector.__init__(self)
+        self.texts = {}
+
+    def on_id3v2dot3_frame(self, frame_type, frame_dict):
+        self.texts[frame_type] = frame_dict.get('frame_string')
+
+class UpdateTagTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'track.mp3')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, data):
+        with open(self.path, 'wb') as f:
+            f.write(data + '\xff\xfb\x90\x00' * 16)
+
+    def read_texts(self):
+        collector = TextCollector()
+        mp3_event_parser.ID3v2Parser(whole_tag=True).parse_id3v2_file(self.path, False, collector)
+        return collector.texts
+
+    def test_in_place(self):
+        self.write(tag(text_frame('TIT2', 'Old') + text_frame('TPE1', 'Artist') + text_frame('TALB', 'Album')))
+        self.assertEqual(mp3_tag_update.update_tag(self.path, {'TIT2': u'New'}, journal=False), 'in place')
+        self.assertEqual(self.read_texts(), {'TIT2': 'New', 'TPE1': 'Artist', 'TALB': 'Album'})
+
+    def test_frames_after_empty_frame_are_kept(self):
+        self.write(tag(text_frame('TIT2', 'Old') + struct.pack('>4sIH', 'TXXX', 0, 0)
+                       + text_frame('TPE1', 'Artist') + text_frame('TALB', 'Album')))
+        with open(self.path, 'rb') as f:
+            before = f.read()
+        with self.assertRaises(ValueError):
+            mp3_tag_update.update_tag(self.path, {'TIT2': u'New'}, journal=False)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), before)
+
+if __name__ == '__main__':
+    unittest.main()
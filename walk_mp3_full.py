@@ -37,11 +37,22 @@
 from __future__ import print_function
 
 import argparse
+import csv
+import functools
+import json
 import os
 import os.path
 import sys
+import time
 
+import mp3_art_store
+import mp3_concurrent_scan
 import mp3_event_parser
+import mp3_parallel
+import mp3_read_schedule
+import mp3_stats
+import mp3_walk
+import mp3_watch
 
 def isprint(ch):
     '''Gets whether a byte represents an ASCII printable character'''
@@ -73,7 +84,12 @@ def print_apic_frame(frame_dict):
     '''Prints data for an ID3v2.3 attached picture frame'''
     print("{0:>40s} : {1}".format('Attached picture mime type', frame_dict['mime_type']))
     print("{0:>40s} : {1}".format('Attached picture description', frame_dict['description_string']))
-    print("{0:>40s} : {1:d}".format('Attached picture data length', len(frame_dict['picture_data'])))
+    if 'digest' in frame_dict:
+        # The picture was extracted to an art store
+        print("{0:>40s} : {1:d}".format('Attached picture data length', frame_dict['picture_data_length']))
+        print("{0:>40s} : {1}".format('Attached picture hash', frame_dict['digest']))
+    else:
+        print("{0:>40s} : {1:d}".format('Attached picture data length', len(frame_dict['picture_data'])))
 
 def print_comm_frame(frame_dict):
     '''Prints data for an ID3v2.3 comment frame'''
@@ -86,7 +102,12 @@ def print_geob_frame(frame_dict):
     print("{0:>40s} : {1}".format('General encapsulated object mime type', frame_dict['mime_type']))
     print("{0:>40s} : {1}".format('General encapsulated object description', frame_dict['description_string']))
     print("{0:>40s} : {1}".format('General encapsulated object filename', frame_dict['filename_string']))
-    print("{0:>40s} : {1:d}".format('General encapsulated object data length', len(frame_dict['binary_data'])))
+    if 'digest' in frame_dict:
+        # The object was extracted to an art store
+        print("{0:>40s} : {1:d}".format('General encapsulated object data length', frame_dict['binary_data_length']))
+        print("{0:>40s} : {1}".format('General encapsulated object hash', frame_dict['digest']))
+    else:
+        print("{0:>40s} : {1:d}".format('General encapsulated object data length', len(frame_dict['binary_data'])))
 
 def print_mcdi_frame(frame_dict):
     '''Prints data for an ID3v2.3 music CD identifier frame'''
@@ -97,7 +118,7 @@ def print_priv_frame(frame_dict):
     print("{0:>40s} : {1}".format('Private owner', frame_dict['owner_string']))
     print("{0:>40s} : {1:d}".format('Private data length', len(frame_dict['private_data'])))
     if frame_dict['owner_string'] == 'WM/UniqueFileIdentifier' or frame_dict['owner_string'] == 'WM/Provider':
-        private_len, private_string = mp3_event_parser.unpack_unicode(str(frame_dict['private_data']))
+        private_len, private_string = mp3_event_parser.unpack_unicode(frame_dict['private_data'].tobytes())
         if len(private_string) > 0:
             print("{0:>40s} : {1}".format('Private data', private_string))
         
@@ -111,17 +132,98 @@ def print_uslt_frame(frame_dict):
     print("{0:>40s} : {1}".format('Unsynchronized lyric translation description', frame_dict['descriptor_string']))
     print("{0:>40s} : {1}".format('Unsynchronized lyric translation text', frame_dict['lyrics_string']))
 
+# Printers for each frame type, called as printer(frame_dict)
+frame_printers = {
+    'APIC': print_apic_frame,
+    'COMM': print_comm_frame,
+    'GEOB': print_geob_frame,
+    'MCDI': print_mcdi_frame,
+    'PRIV': print_priv_frame,
+    'USLT': print_uslt_frame,
+}
+
+# Descriptions of the ID3v2.3 text info frames
+text_info_frame_names = {
+    'TALB': 'Album/Movie/Show Title',
+    'TBPM': 'BPM (beats per minute)',
+    'TCOM': 'Composer',
+    'TCON': 'Content type',
+    'TCOP': 'Copyright message',
+    'TDOR': 'Original release time',
+    'TDRC': 'Recording time',
+    'TDRL': 'Release time',
+    'TENC': 'Encoded by',
+    'TFLT': 'File type',
+    'TIT1': 'Content group description',
+    'TIT2': 'Title/songname/content description',
+    'TIT3': 'Subtitle/Description refinement',
+    'TKEY': 'Initial key',
+    'TLAN': 'Language(s)',
+    'TLEN': 'Length',
+    'TMOO': 'Mood',
+    'TOAL': 'Original album/movie/show title',
+    'TOPE': 'Original artist(s)/performer(s)',
+    'TPE1': 'Lead performer(s)/Soloist(s)',
+    'TPE2': 'Band/orchestra/accompaniment',
+    'TPE3': 'Conductor/performer refinement',
+    'TPOS': 'Part of set',
+    'TPUB': 'Publisher',
+    'TRCK': 'Track number/Position in set',
+    'TSOA': 'Album sort order',
+    'TSOP': 'Performer sort order',
+    'TSOT': 'Title sort order',
+    'TSRC': 'ISRC (international standard recording code)',
+    'TSSE': 'Software/Hardware and settings used for encoding',
+    'TXXX': 'User defined text information frame',
+    'TYER': 'Year',
+}
+
+for frame_type, frame_name in text_info_frame_names.items():
+    frame_printers[frame_type] = functools.partial(print_text_info_frame, frame_name)
+
+# Descriptions of the MPEG audio properties
+mpeg_audio_names = (
+    ('mpeg_version', 'MPEG version'),
+    ('layer', 'Layer'),
+    ('bitrate', 'First frame bitrate (kbit/s)'),
+    ('sample_rate', 'Sample rate (Hz)'),
+    ('channel_mode', 'Channel mode'),
+    ('audio_offset', 'Audio offset'),
+    ('vbr_header', 'VBR header'),
+    ('encoder', 'Encoder'),
+    ('frame_count', 'Frame count'),
+    ('duration', 'Duration (seconds)'),
+    ('average_bitrate', 'Average bitrate (kbit/s)'),
+)
+
+# Descriptions of the MPEG audio validation findings
+mpeg_validation_names = (
+    ('first_frame_offset', 'First frame offset'),
+    ('valid_frames', 'Valid frames'),
+    ('junk_bytes', 'Junk bytes'),
+    ('junk_regions', 'Junk regions'),
+    ('crc_errors', 'CRC errors'),
+    ('id3v1', 'ID3v1 tag'),
+    ('truncated_offset', 'Truncated final frame offset'),
+    ('truncated_bytes', 'Truncated final frame bytes missing'),
+)
+
 class ID3v2Printer(object):
     '''A handler for the ID3v2 file parser that prints the parsed pieces'''
 
-    def __init__(self, aatpath, hexdump, print_headers, frame_types):
+    def __init__(self, aatpath, hexdump, print_headers, frame_types, audio=False, validate=False):
         self.aatpath = aatpath
         self.hexdump = hexdump
         self.print_headers = print_headers
         if frame_types:
-            self.frame_types = frame_types.split(',')
+            self.frame_types = frozenset(frame_types.split(','))
         else:
             self.frame_types = None
+        if not audio:
+            # So the parser does not analyze the audio
+            self.on_mpeg_audio = None
+        if not validate:
+            self.on_mpeg_validation = None
 
     def on_aatpath(self, artist, album, track):
         if self.aatpath:
@@ -135,63 +237,34 @@ class ID3v2Printer(object):
         if self.frame_types and frame_type not in self.frame_types:
             return
 
-        if frame_type == 'APIC':
-            print_apic_frame(frame_dict)
-        elif frame_type == 'COMM':
-            print_comm_frame(frame_dict)
-        elif frame_type == 'GEOB':
-            print_geob_frame(frame_dict)
-        elif frame_type == 'MCDI':
-            print_mcdi_frame(frame_dict)
-        elif frame_type == 'PRIV':
-            print_priv_frame(frame_dict)
-        elif frame_type == 'TALB':
-            print_text_info_frame('Album/Movie/Show Title', frame_dict)
-        elif frame_type == 'TBPM':
-            print_text_info_frame('BPM (beats per minute)', frame_dict)
-        elif frame_type == 'TCOM':
-            print_text_info_frame('Composer', frame_dict)
-        elif frame_type == 'TCON':
-            print_text_info_frame('Content type', frame_dict)
-        elif frame_type == 'TCOP':
-            print_text_info_frame('Copyright message', frame_dict)
-        elif frame_type == 'TENC':
-            print_text_info_frame('Encoded by', frame_dict)
-        elif frame_type == 'TFLT':
-            print_text_info_frame('File type', frame_dict)
-        elif frame_type == 'TIT1':
-            print_text_info_frame('Content group description', frame_dict)
-        elif frame_type == 'TIT2':
-            print_text_info_frame('Title/songname/content description', frame_dict)
-        elif frame_type == 'TIT3':
-            print_text_info_frame('Subtitle/Description refinement', frame_dict)
-        elif frame_type == 'TLEN':
-            print_text_info_frame('Length', frame_dict)
-        elif frame_type == 'TPE1':
-            print_text_info_frame('Lead performer(s)/Soloist(s)', frame_dict)
-        elif frame_type == 'TPE2':
-            print_text_info_frame('Band/orchestra/accompaniment', frame_dict)
-        elif frame_type == 'TPE3':
-            print_text_info_frame('Conductor/performer refinement', frame_dict)
-        elif frame_type == 'TPOS':
-            print_text_info_frame('Part of set', frame_dict)
-        elif frame_type == 'TPUB':
-            print_text_info_frame('Publisher', frame_dict)
-        elif frame_type == 'TRCK':
-            print_text_info_frame('Track number/Position in set', frame_dict)
-        elif frame_type == 'TXXX':
-            print_text_info_frame('User defined text information frame', frame_dict)
-        elif frame_type == 'TYER':
-            print_text_info_frame('Year', frame_dict)
-        elif frame_type == 'USLT':
-            print_uslt_frame(frame_dict)
-        else:
+        frame_printer = frame_printers.get(frame_type)
+        if frame_printer is None:
             print("Do not know frame type", frame_type, file=sys.stderr)
+        else:
+            frame_printer(frame_dict)
 
     def on_id3v2dot3_frame_header(self, frame_type, frame_size, frame_flags):
         if self.print_headers:
             print("type: {0} size: {1:d} flags: {2:04x}".format(frame_type, frame_size, frame_flags))
 
+    def on_mpeg_audio(self, audio_dict):
+        for key, name in mpeg_audio_names:
+            if audio_dict[key] is not None:
+                print("{0:>40s} : {1}".format(name, audio_dict[key]))
+
+    def on_mpeg_validation(self, validation_dict):
+        for key, name in mpeg_validation_names:
+            if validation_dict[key] is not None:
+                print("{0:>40s} : {1}".format(name, validation_dict[key]))
+        for offset, length in validation_dict['junk']:
+            print("{0:>40s} : {1:d} bytes at {2:d}".format('Junk', length, offset))
+        for offset in validation_dict['crc_error_offsets']:
+            print("{0:>40s} : frame at {1:d}".format('CRC error', offset))
+
+    def on_deleted(self, path):
+        '''Handle a file deleted while watching'''
+        print(path + ' : deleted')
+
     def on_path(self, path):
         print(path)
 
@@ -207,20 +280,273 @@ class ID3v2Printer(object):
         if self.hexdump:
             print_bytes(frame_header)
 
-def walk_mp3_and_parse(dirpath, aatpath, parser_handler):
-    '''Walks a directory tree for MP3 files and parses them'''
+    def flush(self):
+        '''Flush the output, after each change while watching'''
+        sys.stdout.flush()
+
+# Fields of the decoded frames holding binary payloads, which records report as lengths
+binary_frame_fields = ('binary_data', 'identifier_data', 'picture_data', 'private_data')
+
+# Columns of CSV and TSV records, one record per frame
+record_columns = (
+    'path', 'path_artist', 'path_album', 'path_track',
+    'version', 'revision', 'flags', 'size', 'error',
+    'frame_type', 'frame_size', 'frame_flags',
+    'frame_string', 'language', 'descriptor_string', 'comment_string', 'lyrics_string',
+    'mime_type', 'description_string', 'filename_string', 'owner_string',
+    'binary_data_length', 'identifier_data_length', 'picture_data_length', 'private_data_length', 'digest',
+    'mpeg_version', 'layer', 'bitrate', 'sample_rate', 'channel_mode', 'audio_offset',
+    'vbr_header', 'encoder', 'frame_count', 'duration', 'average_bitrate',
+    'first_frame_offset', 'valid_frames', 'junk_bytes', 'junk_regions', 'crc_errors', 'id3v1',
+    'truncated_offset', 'truncated_bytes', 'deleted',
+)
+
+def record_text(value):
+    '''Convert a parsed string to unicode, decoding ISO-8859-1 byte strings'''
+    if isinstance(value, str):
+        return value.decode('latin-1')
+    return value
+
+def record_path(path):
+    '''Convert a path to unicode, decoding UTF-8 or else ISO-8859-1 byte strings'''
+    if isinstance(path, str):
+        try:
+            return path.decode('utf-8')
+        except UnicodeDecodeError:
+            return path.decode('latin-1')
+    return path
+
+class ID3v2RecordWriter(object):
+    '''A handler for the ID3v2 file parser that writes machine-readable records
+
+    The format is 'jsonl', with one JSON object per line, or 'csv' or 'tsv'.
+    JSON records are per file, with the decoded frames in a list, or per
+    frame if per_frame is set; CSV and TSV records are always per frame,
+    with the columns in record_columns.  Binary payloads are reported as
+    lengths, and the payloads extracted to an art store by their digests.
+    Records are written to a single file, which should be buffered; call
+    close() after the last file to write the last record, or flush() to
+    write it and keep going.
+
+    If audio is set, the MPEG audio properties are written too, as the
+    audio object of per file records or a record of their own per file.
+    Likewise, if validate is set, the findings of validating the audio
+    are written as the validation object or a record of their own.
+    '''
+
+    def __init__(self, out, format, per_frame, frame_types, audio=False, validate=False):
+        self.out = out
+        self.format = format
+        self.per_frame = per_frame or format != 'jsonl'
+        if frame_types:
+            self.frame_types = frozenset(frame_types.split(','))
+        else:
+            self.frame_types = None
+        if format == 'jsonl':
+            self.write_record = self.write_json
+        else:
+            self.csv_writer = csv.writer(out, dialect='excel-tab' if format == 'tsv' else 'excel')
+            self.csv_writer.writerow(record_columns)
+            self.write_record = self.write_csv
+        self.file_record = None
+        if not audio:
+            # So the parser does not analyze the audio
+            self.on_mpeg_audio = None
+        if not validate:
+            self.on_mpeg_validation = None
+
+    def write_json(self, record):
+        self.out.write(json.dumps(record, separators=(',', ':')))
+        self.out.write('\n')
+
+    def write_csv(self, record):
+        row = []
+        for column in record_columns:
+            value = record.get(column)
+            if value is None:
+                value = ''
+            elif isinstance(value, basestring):
+                # The csv module can neither write unicode nor nul characters
+                value = record_text(value).replace(u'\0', u'').encode('utf-8')
+            row.append(value)
+        self.csv_writer.writerow(row)
+
+    def flush_file_record(self):
+        '''Write the record of the previous file, if records are per file'''
+        if self.file_record is not None and not self.per_frame:
+            self.write_record(self.file_record)
+        self.file_record = None
+
+    def flush(self):
+        '''Write the record of the previous file and flush the output'''
+        self.flush_file_record()
+        self.out.flush()
+
+    def close(self):
+        '''Write the last record and flush the output'''
+        self.flush()
+
+    def on_aatpath(self, artist, album, track):
+        self.file_record['path_artist'] = record_path(artist)
+        self.file_record['path_album'] = record_path(album)
+        self.file_record['path_track'] = record_path(track)
+
+    def on_deleted(self, path):
+        '''Write a record of a file deleted while watching'''
+        self.flush_file_record()
+        self.write_record({'path': record_path(path), 'deleted': True})
+
+    def on_error(self, msg):
+        if self.per_frame:
+            record = dict(self.file_record)
+            record['error'] = msg
+            self.write_record(record)
+        else:
+            self.file_record.setdefault('errors', []).append(msg)
+
+    def on_id3v2_header(self, version, revision, flags, size):
+        self.file_record['version'] = version
+        self.file_record['revision'] = revision
+        self.file_record['flags'] = flags
+        self.file_record['size'] = size
+
+    def on_id3v2dot3_frame(self, frame_type, frame_dict):
+        if self.frame_types and frame_type not in self.frame_types:
+            return
+
+        frame_record = dict()
+        frame_record['frame_type'] = frame_type
+        frame_record['frame_size'], frame_record['frame_flags'] = self.frame_header
+        for key, value in frame_dict.iteritems():
+            if key in binary_frame_fields:
+                frame_record[key + '_length'] = len(value)
+            else:
+                frame_record[key] = record_text(value)
+
+        if self.per_frame:
+            frame_record.update(self.file_record)
+            self.write_record(frame_record)
+        else:
+            self.file_record['frames'].append(frame_record)
+
+    def on_id3v2dot3_frame_header(self, frame_type, frame_size, frame_flags):
+        self.frame_header = (frame_size, frame_flags)
+
+    def on_mpeg_audio(self, audio_dict):
+        if self.per_frame:
+            record = dict(self.file_record)
+            record.update(audio_dict)
+            self.write_record(record)
+        else:
+            self.file_record['audio'] = audio_dict
+
+    def on_mpeg_validation(self, validation_dict):
+        if self.per_frame:
+            record = dict(self.file_record)
+            record.update(validation_dict)
+            self.write_record(record)
+        else:
+            self.file_record['validation'] = validation_dict
+
+    def on_path(self, path):
+        self.flush_file_record()
+        self.file_record = {'path': record_path(path)}
+        if not self.per_frame:
+            self.file_record['frames'] = []
+
+def parse_mp3_files(paths, aatpath, parser_handler, jobs=1, ordered=False, parser_options=None,
+                    concurrency=0, timeout=None, unreadable_errors=False):
+    '''Parses MP3 files, passing the events to the handler
+
+    If jobs is other than 1, the files are parsed by a pool of that many
+    worker processes (0 meaning one per CPU) and the events are passed to
+    the handler in this process, in path order if ordered is set.  Parsers
+    are created with the keyword arguments in parser_options.
+
+    If concurrency is set, the files are instead parsed by that many
+    threads, to keep many reads in flight on high-latency filesystems,
+    and files taking more than timeout seconds are skipped.
+
+    If unreadable_errors is set, files which cannot be opened or read are
+    passed to the handler's on_error, rather than raising IOError or OSError.
+    '''
+    parser_options = parser_options or {}
+
+    if concurrency:
+        event_names = mp3_parallel.get_handler_events(parser_handler)
+        scanner = mp3_concurrent_scan.ConcurrentScanner(aatpath, event_names, concurrency, timeout, parser_options,
+                                                        unreadable_errors)
+        for path, events in scanner.scan(paths):
+            if events is not None:
+                mp3_parallel.replay_events(events, parser_handler)
+        return
+
+    if jobs != 1:
+        event_names = mp3_parallel.get_handler_events(parser_handler)
+        for path, events in mp3_parallel.parse_files(paths, aatpath, event_names, jobs,
+                                                         ordered=ordered, parser_options=parser_options,
+                                                         unreadable_errors=unreadable_errors):
+            mp3_parallel.replay_events(events, parser_handler)
+        return
+
+    parser = None
+
+    for path in paths:
+        if parser is None:
+            parser = mp3_event_parser.ID3v2Parser(**parser_options)
+        mp3_parallel.parse_file(parser, path, aatpath, parser_handler, unreadable_errors)
+
+def walk_mp3_and_parse(dirpath, aatpath, parser_handler, jobs=1, ordered=False, parser_options=None,
+                       concurrency=0, timeout=None, extensions=mp3_walk.DEFAULT_EXTENSIONS, scheduler=None):
+    '''Walks a directory tree for MP3 files, with any of the extensions, and parses them
+
+    The files are parsed as by parse_mp3_files, in walk order if ordered
+    is set, or in the order of a mp3_read_schedule.ReadScheduler if given.
+    '''
     if not os.path.isdir(dirpath):
         print(dirpath + " is not a directory", file=sys.stderr)
         return
 
-    parser = None
+    parse_mp3_files(mp3_read_schedule.walk_scheduled(dirpath, extensions, scheduler), aatpath, parser_handler,
+                    jobs, ordered, parser_options, concurrency, timeout)
+
+def watch_mp3_and_parse(dirpaths, aatpath, parser_handler, jobs=1, ordered=False, parser_options=None,
+                        concurrency=0, timeout=None, extensions=mp3_walk.DEFAULT_EXTENSIONS,
+                        debounce=mp3_watch.DEBOUNCE_SECONDS, poll_interval=None):
+    '''Parses the MP3 files in directory trees, then watches them, parsing files as they change
+
+    Files are parsed as by parse_mp3_files, first all of them and then
+    those created, changed or moved in once no change has been seen to
+    them for debounce seconds.  Deleted and moved out files are passed to
+    the handler's on_deleted.  Files which cannot be read, such as those
+    deleted before they are parsed, are passed to the handler's on_error,
+    and a deleted file is then reported by the next batch of changes, so
+    the watch goes on.  The handler is flushed after each batch of
+    changes.  Changes are watched for with inotify, or by walking the trees
+    every poll_interval seconds if that is set or inotify is not available.
+    This runs until interrupted.
+    '''
+    tops = []
+    for dirpath in dirpaths:
+        if os.path.isdir(dirpath):
+            tops.append(dirpath)
+        else:
+            print(dirpath + " is not a directory", file=sys.stderr)
+    if not tops:
+        return
 
-    for root, dirs, files in os.walk(dirpath):
-        for file in files:
-            if file.endswith('.mp3'):
-                if parser is None:
-                    parser = mp3_event_parser.ID3v2Parser()
-                parser.parse_id3v2_file(os.path.join(root, file), aatpath, parser_handler)
+    changes = mp3_watch.watch(tops, extensions, debounce, poll_interval)
+    try:
+        for changed, deleted in changes:
+            parse_mp3_files(changed, aatpath, parser_handler, jobs, ordered, parser_options, concurrency, timeout,
+                            unreadable_errors=True)
+            for path in deleted:
+                parser_handler.on_deleted(path)
+            parser_handler.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        changes.close()
 
 if __name__ == '__main__':
     '''Entry point if run as a standalone script'''
@@ -230,18 +556,106 @@ if __name__ == '__main__':
     parser.add_argument('--aatpath', dest='aatpath', action='store_const',
                        const=True, default=False,
                        help='Derive artist/album/track from the file path')
+    workers = parser.add_mutually_exclusive_group()
+    workers.add_argument('--jobs', dest='jobs', action='store', type=int,
+                       default=1,
+                       help='Number of worker processes parsing files (0 is one per CPU, default is 1)')
+    workers.add_argument('--concurrency', dest='concurrency', action='store', type=int,
+                       default=0,
+                       help='Number of files to parse at once in threads, for network filesystems')
+    parser.add_argument('--extensions', dest='extensions', action='store', default='mp3',
+                       help='Comma-separated extensions of the files to parse, in any case (default is mp3)')
+    parser.add_argument('--order', dest='order', action='store',
+                       choices=mp3_read_schedule.ORDERS, default='walk',
+                       help='Read files in walk order (the default), or sorted by inode or disk extent, for spinning disks')
+    parser.add_argument('--window', dest='window', action='store', type=int,
+                       default=mp3_read_schedule.DEFAULT_WINDOW,
+                       help='Number of files sorted together with --order (default is %(default)s)')
+    parser.add_argument('--readahead', dest='readahead', action='store', type=int,
+                       default=None,
+                       help='Number of files whose headers are read ahead (default is {0:d} with --order, else 0)'.format(
+                           mp3_read_schedule.DEFAULT_READAHEAD))
+    parser.add_argument('--timeout', dest='timeout', action='store', type=float,
+                       default=None,
+                       help='Seconds after which to skip a file when parsing with --concurrency')
+    parser.add_argument('--ordered', dest='ordered', action='store_const',
+                       const=True, default=False,
+                       help='Report files in walk order when parsing with multiple jobs')
     parser.add_argument('--frame-types', dest='frame_types', action='store',
                        default='',
-                       help='Frame types to print (default is all)')
+                       help='Frame types to print (default is all); other frames are skipped unless printing headers or hex dumps')
     parser.add_argument('--hexdump', dest='hexdump', action='store_const',
                        const=True, default=False,
                        help='Print a hex dump of frame information')
     parser.add_argument('--print-headers', dest='print_headers', action='store_const',
                        const=True, default=False,
                        help='Print file and frame headers')
+    parser.add_argument('--whole-tag', dest='whole_tag', action='store_const',
+                       const=True, default=False,
+                       help='Read each tag with a single read rather than frame by frame')
+    parser.add_argument('--id3v1', dest='id3v1', action='store',
+                       choices=('fallback', 'always'),
+                       help='Read ID3v1 tags of files with no ID3v2 tag (fallback) or of all files (always)')
+    parser.add_argument('--format', dest='format', action='store',
+                       choices=('text', 'jsonl', 'csv', 'tsv'), default='text',
+                       help='Output format (default is text)')
+    parser.add_argument('--per-frame', dest='per_frame', action='store_const',
+                       const=True, default=False,
+                       help='Write a jsonl record per frame rather than per file (csv and tsv are always per frame)')
+    parser.add_argument('--audio', dest='audio', action='store_const',
+                       const=True, default=False,
+                       help='Analyze the MPEG audio for its duration and bitrate')
+    parser.add_argument('--validate', dest='validate', action='store_const',
+                       const=True, default=False,
+                       help='Read the whole MPEG audio stream, reporting junk, CRC errors and truncation')
+    parser.add_argument('--extract-art', dest='extract_art', action='store',
+                       default=None, metavar='DIRECTORY',
+                       help='Extract attached pictures and objects to a store in DIRECTORY named by their hashes, once each')
+    parser.add_argument('--stats', dest='stats', action='store_const',
+                       const=True, default=False,
+                       help='Print parser counters, byte accounting and timings to stderr at the end')
+    parser.add_argument('--watch', dest='watch', action='store_const',
+                       const=True, default=False,
+                       help='After parsing, keep watching for changed files and parse them until interrupted')
+    parser.add_argument('--debounce', dest='debounce', action='store', type=float,
+                       default=mp3_watch.DEBOUNCE_SECONDS,
+                       help='Seconds a file must be left alone before it is parsed when watching (default is %(default)s)')
+    parser.add_argument('--poll', dest='poll', action='store', type=float,
+                       default=None, metavar='SECONDS',
+                       help='Watch by walking the directories every SECONDS rather than with inotify')
     
     args = parser.parse_args()
     
-    parser_handler = ID3v2Printer(args.aatpath, args.hexdump, args.print_headers, args.frame_types)
-    for directory in args.directories:
-        walk_mp3_and_parse(os.path.expanduser(directory), args.aatpath, parser_handler)
+    if args.format == 'text':
+        parser_handler = ID3v2Printer(args.aatpath, args.hexdump, args.print_headers, args.frame_types, args.audio, args.validate)
+    else:
+        out = os.fdopen(os.dup(sys.stdout.fileno()), 'wb', 1 << 16)
+        parser_handler = ID3v2RecordWriter(out, args.format, args.per_frame, args.frame_types, args.audio, args.validate)
+    frame_types = parser_handler.frame_types
+    if args.print_headers or args.hexdump:
+        # The headers and bytes of every frame are printed, so the parser must walk them all
+        frame_types = None
+    parser_options = {'whole_tag': args.whole_tag, 'frame_types': frame_types, 'id3v1': args.id3v1}
+    if args.extract_art:
+        parser_options['art_store'] = mp3_art_store.ArtStore(os.path.expanduser(args.extract_art))
+    if args.stats:
+        parser_options['stats'] = mp3_stats.ParserStats()
+    scheduler = None
+    if args.order != 'walk' or args.readahead:
+        readahead = args.readahead
+        if readahead is None:
+            readahead = mp3_read_schedule.DEFAULT_READAHEAD
+        scheduler = mp3_read_schedule.ReadScheduler(args.order, args.window, readahead)
+    start = time.time()
+    if args.watch:
+        watch_mp3_and_parse([os.path.expanduser(directory) for directory in args.directories], args.aatpath, parser_handler,
+                            args.jobs, args.ordered, parser_options, args.concurrency, args.timeout,
+                            args.extensions.split(','), args.debounce, args.poll)
+    else:
+        for directory in args.directories:
+            walk_mp3_and_parse(os.path.expanduser(directory), args.aatpath, parser_handler, args.jobs, args.ordered, parser_options,
+                               args.concurrency, args.timeout, args.extensions.split(','), scheduler)
+    if args.format != 'text':
+        parser_handler.close()
+    if args.stats:
+        parser_options['stats'].print_summary(time.time() - start)
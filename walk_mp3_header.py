@@ -18,6 +18,8 @@ import re
 import struct
 import sys
 
+import mp3_walk
+
 def isprint(ch):
     return ch >= 32 and ch < 127
 
@@ -92,10 +94,8 @@ def walk_mp3_header(dirpath, aatpath):
         print(dirpath + " is not a directory", file=sys.stderr)
         return
 
-    for root, dirs, files in os.walk(dirpath):
-        for file in files:
-            if file.endswith('.mp3'):
-                print_mp3_header(os.path.join(root, file), aatpath)
+    for path in mp3_walk.walk_files(dirpath):
+        print_mp3_header(path, aatpath)
 
 def main():
     parser = argparse.ArgumentParser(description='List MP3 file information')
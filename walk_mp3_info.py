@@ -3,7 +3,7 @@
 # Introduces:
 #  Console and error output using the print function
 #  String substitution using regular expressions
-#  Directory traversal using walk
+#  Directory tree traversal for MP3 files using mp3_walk.walk_files
 #  Conditional invocation of main
 #
 
@@ -15,6 +15,8 @@ import os.path
 import re
 import sys
 
+import mp3_walk
+
 def print_mp3_info(path, aatpath):
     if aatpath:
         track = os.path.basename(path)
@@ -32,10 +34,8 @@ def walk_mp3_info(dirpath, aatpath):
         print(dirpath + " is not a directory", file=sys.stderr)
         return
 
-    for root, dirs, files in os.walk(dirpath):
-        for file in files:
-            if (re.search('\.mp3$', file)):
-                print_mp3_info(os.path.join(root, file), aatpath)
+    for path in mp3_walk.walk_files(dirpath):
+        print_mp3_info(path, aatpath)
 
 def main():
     parser = argparse.ArgumentParser(description='List MP3 file information')